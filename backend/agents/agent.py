@@ -2,9 +2,13 @@
 Primary Orchestrator Agent - "Mitra" Brain
 Built with ADK framework for Project Kisan
 """
+import asyncio
+import functools
 import os
+import re
+from typing import List, Tuple
 from dotenv import load_dotenv
-from google.adk.agents import LlmAgent
+from google.adk.agents import LlmAgent, ParallelAgent, SequentialAgent
 from agents.vaidya_agent.agent import vaidya_agent
 from agents.sahayak_agent.agent import sahayak_agent
 from agents.vyapari_agent.agent import vyapari_agent
@@ -39,4 +43,125 @@ root_agent = LlmAgent(
         shikshak_agent,
         weather_agent
     ]
-)
\ No newline at end of file
+)
+
+# Fan-out mode: compound questions touching several specialists run those
+# specialists concurrently and merge their findings in one synthesis turn,
+# instead of Mitra transferring to them one after the other.
+FAN_OUT_ENABLED = os.getenv("MITRA_FAN_OUT", "true").lower() == "true"
+FAN_OUT_SYNTHESIZER = "MitraSynthesis"
+
+SPECIALISTS = {
+    agent.name: agent for agent in root_agent.sub_agents
+}
+
+# Word stems that mark a question as touching a specialist's domain
+DOMAIN_KEYWORDS = {
+    "Vaidya": (
+        "disease", "pest", "leaf", "leaves", "spot", "blight", "fungus",
+        "fungi", "fungal", "fungicide", "insect", "insecticide", "wilt",
+        "wilting", "rot", "rotting", "rotten", "infected", "infection",
+        "symptom", "yellowing"
+    ),
+    "Vyapari": (
+        "price", "sell", "selling", "market", "mandi", "rate", "buyer",
+        "profit", "apmc", "demand"
+    ),
+    "WeatherAgent": (
+        "rain", "rainfall", "raining", "weather", "forecast",
+        "temperature", "monsoon", "humid", "humidity", "wind", "storm",
+        "drought", "heat", "heatwave"
+    ),
+    "Sahayak": (
+        "scheme", "subsidy", "subsidies", "pm-kisan", "pm kisan", "loan",
+        "insurance", "government", "yojana"
+    ),
+    "Shikshak": (
+        "video", "tutorial", "quiz", "training", "teach", "teaching"
+    ),
+}
+
+# Whole words only, plus a plural ending: "rot" must not match "rotation"
+_DOMAIN_PATTERNS = {
+    name: re.compile(
+        r"\b(?:" + "|".join(re.escape(k) for k in keywords) + r")(?:e?s)?\b",
+        re.IGNORECASE)
+    for name, keywords in DOMAIN_KEYWORDS.items()
+}
+
+
+def detect_domains(query: str) -> List[str]:
+    """Return the specialists whose domain the query touches, in the
+    order they are registered under Mitra."""
+    return [
+        name for name in SPECIALISTS
+        if name in _DOMAIN_PATTERNS and _DOMAIN_PATTERNS[name].search(query)
+    ]
+
+
+def findings_key(agent_name: str) -> str:
+    """Session state key a fan-out branch writes its answer to"""
+    return f"{agent_name.lower()}_findings"
+
+
+def _offloaded(func):
+    """Run a blocking tool in a worker thread so that parallel branches
+    are not serialized on the event loop."""
+    @functools.wraps(func)
+    async def wrapper(**kwargs):
+        return await asyncio.to_thread(func, **kwargs)
+    return wrapper
+
+
+def _build_branch(specialist: LlmAgent) -> LlmAgent:
+    return LlmAgent(
+        name=specialist.name,
+        model=specialist.model,
+        description=specialist.description,
+        instruction=(
+            f"{specialist.instruction} "
+            "Answer only the part of the farmer's question that falls in "
+            "your domain; other specialists cover the rest. Be brief."
+        ),
+        tools=[_offloaded(tool) for tool in specialist.tools],
+        output_key=findings_key(specialist.name),
+        disallow_transfer_to_parent=True,
+        disallow_transfer_to_peers=True
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_fan_out_agent(domains: Tuple[str, ...]) -> SequentialAgent:
+    """Build (once per domain combination) a pipeline that runs the given
+    specialists in parallel and then synthesizes one answer.
+
+    The farmer's question must be in session state as `farmer_question`.
+    """
+    findings = "\n\n".join(
+        f"{name} findings:\n{{{findings_key(name)}?}}" for name in domains
+    )
+    synthesizer = LlmAgent(
+        name=FAN_OUT_SYNTHESIZER,
+        model=root_agent.model,
+        description="Merges specialist findings into one answer.",
+        instruction=(
+            "You are Mitra, an AI assistant for Indian farmers. "
+            "Several specialists have looked at the farmer's question. "
+            "Combine their findings into one practical, actionable answer, "
+            "weighing them against each other where they interact.\n\n"
+            "Farmer's question:\n{farmer_question}\n\n" + findings
+        ),
+        include_contents="none"
+    )
+    return SequentialAgent(
+        name="MitraFanOut",
+        sub_agents=[
+            ParallelAgent(
+                name="MitraFanOutBranches",
+                sub_agents=[
+                    _build_branch(SPECIALISTS[name]) for name in domains
+                ]
+            ),
+            synthesizer
+        ]
+    )
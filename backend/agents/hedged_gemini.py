@@ -0,0 +1,92 @@
+"""
+Gemini model with hedged requests behind a circuit breaker.
+
+Registered in the ADK model registry in place of Gemini, so every agent
+whose model is a "gemini-..." name gets it. A non-streaming call that
+runs past the p95 latency seen for its model is duplicated and the first
+response wins; generation is idempotent, and at most one call in twenty
+is expected to be hedged. Each model has its own breaker ("llm:<model>"),
+so a failing model is skipped quickly and tiering moves up a tier, and
+its own adaptive concurrency limiter, which every attempt (hedges
+included) holds a slot of.
+"""
+
+import asyncio
+import time
+
+from google.adk.models.google_llm import Gemini
+from google.adk.models.registry import LLMRegistry
+
+from circuit_breaker import (
+    CircuitOpenError, get_breaker, is_dependency_failure
+)
+from concurrency_limits import get_limiter
+from deadlines import latency_tracker, count
+
+
+class HedgedGemini(Gemini):
+
+    async def generate_content_async(self, llm_request, stream=False):
+        if stream:
+            async for response in super().generate_content_async(
+                    llm_request, stream=True):
+                yield response
+            return
+
+        key = f"llm:{llm_request.model}"
+        breaker = get_breaker(key)
+        if not breaker.allow():
+            raise CircuitOpenError(f"{key} is unavailable (circuit open)")
+        limiter = get_limiter(key)
+
+        async def attempt():
+            async with limiter.slot_async():
+                started = time.monotonic()
+                response = None
+                async for response in Gemini.generate_content_async(
+                        self, llm_request, stream=False):
+                    pass
+                latency_tracker.record(key, time.monotonic() - started)
+                return response
+
+        first_started = time.monotonic()
+        first = asyncio.ensure_future(attempt())
+        attempts = [first]
+        delay = latency_tracker.hedge_delay(key)
+        if delay is not None:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if not done:
+                count('llm_hedges_started')
+                attempts.append(asyncio.ensure_future(attempt()))
+        try:
+            pending = set(attempts)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            count('llm_hedges_won')
+                            # Lower bound for the cancelled first call,
+                            # which is never sampled otherwise
+                            latency_tracker.record(
+                                key, time.monotonic() - first_started)
+                        breaker.record_success()
+                        yield task.result()
+                        return
+                    error = task.exception()
+            if is_dependency_failure(error):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            raise error
+        finally:
+            for task in attempts:
+                task.cancel()
+
+
+def install() -> None:
+    """Make the registry resolve Gemini model names to HedgedGemini"""
+    LLMRegistry.register(HedgedGemini)
+    LLMRegistry.resolve.cache_clear()
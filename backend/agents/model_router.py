@@ -0,0 +1,288 @@
+"""
+Model tiering for the Mitra agent tree.
+
+Each query is classified by complexity (length, intent, images, script)
+and every LLM call is sent to the model tier that MODEL_ROUTES gives the
+calling agent for that complexity, so a greeting runs on a lite model
+while an image diagnosis gets the strongest one. A final answer that
+looks unreliable is regenerated one tier up, a run that fails is retried
+with every agent one tier up, and tiers whose model's circuit breaker is
+open are skipped. Latency, tokens and cost are recorded per tier to tune
+the routes.
+"""
+
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from google.adk.models.registry import LLMRegistry
+from google.adk.plugins.base_plugin import BasePlugin
+
+from circuit_breaker import get_breaker
+from request_context import current_request
+
+load_dotenv()
+
+MODEL_TIERING_ENABLED = os.getenv("MODEL_TIERING", "true").lower() == "true"
+
+
+def _prices(tier: str, input_usd: float, output_usd: float) -> Dict[str, float]:
+    """USD per million input/output tokens, overridable as
+    MODEL_PRICES_<TIER>="<input>,<output>" when a tier's model changes"""
+    override = os.getenv(f"MODEL_PRICES_{tier.upper()}")
+    if override:
+        input_usd, output_usd = (float(v) for v in override.split(","))
+    return {"input_usd_per_mtok": input_usd, "output_usd_per_mtok": output_usd}
+
+
+# Tiers from cheapest to strongest
+MODEL_TIERS = {
+    "fast": {
+        "model": os.getenv("MODEL_TIER_FAST", "gemini-2.0-flash-lite"),
+        **_prices("fast", 0.075, 0.30),
+    },
+    "standard": {
+        "model": os.getenv("GEMINI_MODEL_NAME", "gemini-2.0-flash"),
+        **_prices("standard", 0.10, 0.40),
+    },
+    "advanced": {
+        "model": os.getenv("MODEL_TIER_ADVANCED", "gemini-2.5-pro"),
+        **_prices("advanced", 1.25, 10.00),
+    },
+}
+TIER_ORDER = ["fast", "standard", "advanced"]
+
+SIMPLE, MODERATE, COMPLEX = "simple", "moderate", "complex"
+
+# complexity -> agent name -> tier; "*" covers agents not listed.
+# Mitra mostly routes, so it stays a tier below the specialists.
+MODEL_ROUTES = {
+    SIMPLE: {"*": "fast"},
+    MODERATE: {"Mitra": "fast", "*": "standard"},
+    COMPLEX: {"Mitra": "standard", "Vaidya": "advanced", "*": "standard"},
+}
+
+_GREETING = re.compile(
+    r"^\s*(hi|hello|hey|namaste|namaskara|thanks|thank you|ok|okay|bye)\b",
+    re.IGNORECASE)
+_NON_LATIN = re.compile(r"[^\x00-\x7f]")
+_HEDGING = re.compile(
+    r"\b(i'?m not sure|i am not sure|i don'?t know|i do not know|"
+    r"cannot determine|can'?t determine|unable to (?:help|answer|determine)|"
+    r"not enough information)\b",
+    re.IGNORECASE)
+# Final answers shorter than this for a non-simple question are suspect
+MIN_CONFIDENT_CHARS = 40
+
+
+def classify_query(question: str, image_count: int = 0,
+                   domains: Optional[List[str]] = None) -> str:
+    """Complexity class of a query: simple, moderate or complex"""
+    domains = domains or []
+    words = len(question.split())
+    if image_count or len(domains) > 1 or "Vaidya" in domains or words > 60:
+        return COMPLEX
+    if not domains and words <= 8 and (_GREETING.match(question) or words <= 3):
+        # Lite models handle Indic scripts less reliably
+        if len(_NON_LATIN.findall(question)) > len(question) // 2:
+            return MODERATE
+        return SIMPLE
+    return MODERATE
+
+
+def tier_for(agent_name: str, complexity: Optional[str],
+             escalation: int = 0) -> str:
+    """Tier an agent's calls use, `escalation` steps above its route"""
+    routes = MODEL_ROUTES.get(complexity or MODERATE, MODEL_ROUTES[MODERATE])
+    tier = routes.get(agent_name, routes["*"])
+    index = min(TIER_ORDER.index(tier) + escalation, len(TIER_ORDER) - 1)
+    return TIER_ORDER[index]
+
+
+def available_tier(tier: str) -> str:
+    """`tier`, or the next one up while its model's breaker is open"""
+    while get_breaker(f"llm:{MODEL_TIERS[tier]['model']}").is_open():
+        higher = next_tier(tier)
+        if higher is None:
+            break
+        tier = higher
+    return tier
+
+
+def next_tier(tier: str) -> Optional[str]:
+    index = TIER_ORDER.index(tier)
+    return TIER_ORDER[index + 1] if index + 1 < len(TIER_ORDER) else None
+
+
+def escalate_after_failure(context) -> bool:
+    """Move a failed request's agents one tier up; False at the top"""
+    if context is None or not MODEL_TIERING_ENABLED:
+        return False
+    if context.tier_escalation >= len(TIER_ORDER) - 1:
+        return False
+    context.tier_escalation += 1
+    _metrics.count_run_escalation()
+    return True
+
+
+def is_low_confidence(llm_response, complexity: Optional[str]) -> bool:
+    """Whether a final answer should be regenerated on a stronger model"""
+    if llm_response.error_code:
+        return True
+    parts = llm_response.content.parts if llm_response.content else []
+    text = ''.join(p.text for p in parts or [] if p.text and not p.thought)
+    if not text.strip():
+        return True
+    if _HEDGING.search(text):
+        return True
+    return complexity != SIMPLE and len(text.strip()) < MIN_CONFIDENT_CHARS
+
+
+def _is_final_text(llm_response) -> bool:
+    if llm_response.partial:
+        return False
+    parts = llm_response.content.parts if llm_response.content else []
+    return not any(p.function_call for p in parts or [])
+
+
+class TierMetrics:
+    """Per-tier call, latency, token and cost counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tiers = {}
+        self.complexity = {}
+        self.run_escalations = 0
+
+    def count_query(self, complexity: str) -> None:
+        with self._lock:
+            self.complexity[complexity] = self.complexity.get(
+                complexity, 0) + 1
+
+    def count_run_escalation(self) -> None:
+        with self._lock:
+            self.run_escalations += 1
+
+    def record_call(self, tier: str, latency: float, llm_response=None,
+                    failed: bool = False, low_confidence: bool = False,
+                    escalated: bool = False) -> None:
+        usage = getattr(llm_response, 'usage_metadata', None)
+        input_tokens = (usage.prompt_token_count or 0) if usage else 0
+        output_tokens = (usage.candidates_token_count or 0) if usage else 0
+        prices = MODEL_TIERS[tier]
+        cost = (input_tokens * prices["input_usd_per_mtok"]
+                + output_tokens * prices["output_usd_per_mtok"]) / 1e6
+        with self._lock:
+            stats = self.tiers.setdefault(tier, {
+                "model": prices["model"], "calls": 0, "failures": 0,
+                "low_confidence": 0, "escalated_calls": 0,
+                "latency_ms_total": 0.0, "input_tokens": 0,
+                "output_tokens": 0, "cost_usd": 0.0,
+            })
+            stats["calls"] += 1
+            stats["failures"] += int(failed)
+            stats["low_confidence"] += int(low_confidence)
+            stats["escalated_calls"] += int(escalated)
+            stats["latency_ms_total"] += latency * 1000
+            stats["input_tokens"] += input_tokens
+            stats["output_tokens"] += output_tokens
+            stats["cost_usd"] += cost
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            tiers = {}
+            for tier, stats in self.tiers.items():
+                tiers[tier] = dict(stats)
+                tiers[tier]["avg_latency_ms"] = round(
+                    stats["latency_ms_total"] / stats["calls"], 1)
+                tiers[tier]["cost_usd"] = round(stats["cost_usd"], 6)
+            return {
+                "enabled": MODEL_TIERING_ENABLED,
+                "queries_by_complexity": dict(self.complexity),
+                "run_escalations": self.run_escalations,
+                "tiers": tiers,
+            }
+
+
+_metrics = TierMetrics()
+_models = {}
+
+
+def get_tier_metrics() -> Dict[str, Any]:
+    return _metrics.snapshot()
+
+
+def record_complexity(complexity: str) -> None:
+    _metrics.count_query(complexity)
+
+
+def _llm_for(tier: str):
+    model = MODEL_TIERS[tier]["model"]
+    if model not in _models:
+        _models[model] = LLMRegistry.new_llm(model)
+    return _models[model]
+
+
+class ModelTierPlugin(BasePlugin):
+    """Sets each LLM call's model from the request's complexity and
+    regenerates low-confidence final answers one tier up.
+
+    Runs after TokenAccountingPlugin, which therefore accounts for the
+    original call; regenerated calls are accounted here per tier.
+    """
+
+    def __init__(self):
+        super().__init__(name="model_tiering")
+
+    async def before_model_callback(self, *, callback_context, llm_request):
+        context = current_request()
+        if context is None or not MODEL_TIERING_ENABLED:
+            return None
+        tier = available_tier(tier_for(
+            callback_context.agent_name, context.complexity,
+            context.tier_escalation))
+        llm_request.model = MODEL_TIERS[tier]["model"]
+        key = (callback_context.invocation_id, callback_context.agent_name)
+        context.model_calls[key] = (tier, time.monotonic(), llm_request)
+        return None
+
+    async def after_model_callback(self, *, callback_context, llm_response):
+        context = current_request()
+        if context is None or not MODEL_TIERING_ENABLED:
+            return None
+        key = (callback_context.invocation_id, callback_context.agent_name)
+        pending = context.model_calls.pop(key, None)
+        if pending is None:
+            return None
+        tier, started, llm_request = pending
+        final = _is_final_text(llm_response)
+        low_confidence = final and is_low_confidence(
+            llm_response, context.complexity)
+        _metrics.record_call(tier, time.monotonic() - started, llm_response,
+                             failed=bool(llm_response.error_code),
+                             low_confidence=low_confidence)
+        higher = next_tier(tier) if low_confidence else None
+        if higher is None:
+            return None
+
+        print(f"DEBUG: Low-confidence answer from {callback_context.agent_name}"
+              f" on {tier}, retrying on {higher}")
+        llm_request.model = MODEL_TIERS[higher]["model"]
+        started = time.monotonic()
+        retried = None
+        try:
+            async for response in _llm_for(higher).generate_content_async(
+                    llm_request, stream=False):
+                retried = response
+        except Exception as e:
+            print(f"ERROR: Escalated call on {higher} failed: {e}")
+        _metrics.record_call(higher, time.monotonic() - started, retried,
+                             failed=retried is None or
+                             bool(retried.error_code),
+                             escalated=True)
+        if retried is None or retried.error_code:
+            return None
+        return retried
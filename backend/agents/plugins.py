@@ -0,0 +1,91 @@
+"""
+Runner-wide ADK plugins for the Mitra agent tree.
+
+Plugins apply to every agent run by a Runner, so cross-cutting behaviour
+(accounting, guards, result shaping) lives here instead of being copied
+onto each LlmAgent. Order matters: a plugin callback that returns a value
+short-circuits the plugins after it.
+"""
+
+from google.adk.plugins.base_plugin import BasePlugin
+from google.genai import types
+
+from agents import hedged_gemini
+from agents.model_router import ModelTierPlugin
+from deadlines import DeadlineExceeded, stage_timeout, time_left
+from request_context import current_request
+from token_accounting import TokenAccountingPlugin
+from tool_projection import project_tool_result
+from translation_memo import localize_tool_result
+
+
+# Gemini agents send hedged requests (see agents/hedged_gemini.py)
+hedged_gemini.install()
+
+
+class DeadlinePlugin(BasePlugin):
+    """Bounds every LLM turn by the request deadline and stops starting
+    tools once the deadline has passed."""
+
+    def __init__(self):
+        super().__init__(name="deadlines")
+
+    async def before_model_callback(self, *, callback_context, llm_request):
+        timeout_ms = int(stage_timeout("llm_call") * 1000)
+        if llm_request.config is None:
+            llm_request.config = types.GenerateContentConfig()
+        if llm_request.config.http_options is None:
+            llm_request.config.http_options = types.HttpOptions()
+        llm_request.config.http_options.timeout = timeout_ms
+        return None
+
+    async def before_tool_callback(self, *, tool, tool_args, tool_context):
+        left = time_left()
+        if left is not None and left <= 0:
+            raise DeadlineExceeded(f"request deadline passed before {tool.name}")
+        return None
+
+
+# Transformations applied, in order, to every tool result before it goes
+# back into the prompt. Each stage is called as
+# stage(tool_name, args, result, request_context) and returns the result.
+# Projection runs first so that only what reaches the prompt is translated.
+TOOL_RESULT_STAGES = [
+    project_tool_result,
+    localize_tool_result,
+]
+
+
+class ToolResultPlugin(BasePlugin):
+    """Runs tool results through TOOL_RESULT_STAGES.
+
+    The stages live in one plugin because ADK stops at the first plugin
+    that returns a replacement result.
+    """
+
+    def __init__(self, stages=None):
+        super().__init__(name="tool_result_stages")
+        self.stages = list(stages if stages is not None
+                           else TOOL_RESULT_STAGES)
+
+    async def after_tool_callback(self, *, tool, tool_args, tool_context,
+                                  result):
+        context = current_request()
+        shaped = result
+        for stage in self.stages:
+            try:
+                shaped = stage(tool.name, tool_args, shaped, context)
+            except Exception as e:
+                print(f"ERROR: Tool result stage {stage.__name__} failed "
+                      f"for {tool.name}: {e}")
+        return shaped if shaped is not result else None
+
+
+def build_plugins():
+    """Create the plugin instances to pass to a Runner"""
+    return [
+        DeadlinePlugin(),
+        TokenAccountingPlugin(),
+        ModelTierPlugin(),
+        ToolResultPlugin(),
+    ]
@@ -12,6 +12,7 @@ from datetime import datetime
 import uuid
 from dotenv import load_dotenv
 from google.adk.agents import LlmAgent
+from gazetteer import resolve_location
 
 # Load environment variables
 load_dotenv()
@@ -30,9 +31,11 @@ def search_government_schemes(farmer_category: str, crop_type: str = "all",
     Returns:
         Dict containing available schemes, eligibility, and application process
     """
+    place = resolve_location(location)
     # TODO: Integrate with Vertex AI Search for government scheme database
     return {
         "status": "success",
+        "state": place.state if place else location,
         "schemes_found": [
             {
                 "name": "PM-KISAN",
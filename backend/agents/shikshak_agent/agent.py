@@ -7,37 +7,132 @@ import os
 import json
 import asyncio
 import aiohttp
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime
 import uuid
 from dotenv import load_dotenv
 from google.adk.agents import LlmAgent
+from content_bank import get_content_bank, personalize
+from job_queue import get_job_queue, register_handler
+from request_context import current_request
+from segments import EXPERIENCE_LEVELS, segment_descriptor, segment_for
+from tool_projection import matches, register_projection
 
 # Load environment variables
 load_dotenv()
 
+VIDEO_JOB_KIND = "educational_video"
+
+
+CONTENT_KINDS = ("quiz", "simulation", "guide")
+
+
+def _farmer_profile(farmer_profile: Optional[dict] = None):
+    """Profile of the farmer asking; the one loaded for the request wins
+    over what the model passed in"""
+    context = current_request()
+    if context is not None and context.farmer_profile is not None:
+        return context.farmer_profile
+    return farmer_profile or {}
+
+
+def _segment(profile, farmer_level: Optional[str] = None) -> dict:
+    """Segment of the farmer; `farmer_level` stands in for an experience
+    level the profile does not have"""
+    segment = segment_for(profile)
+    level = (farmer_level or "").strip().lower()
+    known = (profile.get("experience_level") if isinstance(profile, dict)
+             else getattr(profile, "experience_level", None))
+    if not known and level in EXPERIENCE_LEVELS \
+            and level != segment["experience_level"]:
+        segment = segment_descriptor(segment["language"], segment["zone"],
+                                     segment["crops"], level)
+    return segment
+
+
+def _crop_phrase(segment: dict) -> str:
+    return " and ".join(segment["crops"]) or "{crop}"
+
+
+def _video_kind(language: str, duration: str) -> str:
+    """Content bank kind of a video plan; a plan only answers requests
+    for the same narration language and length"""
+    return "video_plan:" + ":".join(
+        " ".join(str(value).lower().split()) for value in (language, duration))
+
+
 # Shikshak Agent - Educational Media Generation Specialist
 def generate_educational_video(topic: str, language: str = "Kannada", 
                              duration: str = "5 minutes") -> dict:
     """
     Generates educational video content for farmers using AI.
     
+    Video generation takes minutes, so this queues a generation job and
+    returns its ID straight away. Videos are made once per farmer segment,
+    topic, language and duration; when one already exists it is returned
+    instead.
+    
     Args:
         topic: Educational topic for video content
         language: Language for video narration
         duration: Target duration of the video
     
+    Returns:
+        Dict containing the job ID and where to check its status, or the
+        existing video plan
+    """
+    profile = _farmer_profile()
+    segment = _segment(profile)
+    bank = get_content_bank()
+    plan = bank and bank.get(segment["segment_key"],
+                             _video_kind(language, duration), topic)
+    if plan:
+        return {**personalize(plan, profile), "from_content_bank": True,
+                "segment": segment["segment_key"]}
+    job, created = get_job_queue().enqueue(VIDEO_JOB_KIND, {
+        "topic": topic,
+        "language": language,
+        "duration": duration,
+        "segment": segment
+    })
+    return {
+        "status": "success",
+        "job_id": job["job_id"],
+        "topic": topic,
+        "language": language,
+        "duration": duration,
+        "segment": segment["segment_key"],
+        "generation_status": job["status"],
+        "already_requested": not created,
+        "estimated_completion": "10 minutes",
+        "status_url": f"/api/jobs/{job['job_id']}"
+    }
+
+def build_video_plan(topic: str, language: str = "Kannada",
+                     duration: str = "5 minutes",
+                     segment: Optional[dict] = None) -> dict:
+    """
+    Builds the educational video for a queued generation job and banks it
+    for the farmer segment it was made for.
+    
+    Args:
+        topic: Educational topic for video content
+        language: Language for video narration
+        duration: Target duration of the video
+        segment: Farmer segment the video is made for
+    
     Returns:
         Dict containing video generation details and content plan
     """
+    crops = _crop_phrase(segment) if segment else "{crop}"
     # TODO: Integrate with Vertex AI Veo API for video generation
-    return {
+    plan = {
         "status": "success",
         "topic": topic,
         "language": language,
         "duration": duration,
         "video_plan": {
-            "title": f"Complete Guide to {topic}",
+            "title": f"Complete Guide to {topic} for {crops} growers",
             "sections": [
                 {
                     "section": "Introduction",
@@ -47,7 +142,7 @@ def generate_educational_video(topic: str, language: str = "Kannada",
                 {
                     "section": "Step-by-step Process",
                     "duration": "3 minutes",
-                    "content": "Detailed demonstration with visuals"
+                    "content": f"Detailed demonstration on a {crops} field"
                 },
                 {
                     "section": "Best Practices",
@@ -72,68 +167,105 @@ def generate_educational_video(topic: str, language: str = "Kannada",
                 "pace": "Slow and clear for easy understanding"
             }
         },
-        "generation_status": "In progress",
-        "estimated_completion": "10 minutes",
         "output_format": "MP4 with subtitles"
     }
+    bank = get_content_bank()
+    if bank is not None and segment:
+        bank.put(segment["segment_key"], _video_kind(language, duration),
+                 topic, plan)
+    return plan
+
+register_handler(VIDEO_JOB_KIND, build_video_plan)
+
+def _build_quiz(segment: dict, topic: str) -> dict:
+    crops = _crop_phrase(segment)
+    # TODO: Integrate with interactive content generation
+    return {
+        "type": "Quiz",
+        "questions": [
+            {
+                "question": f"What is the best time to plant {crops}?",
+                "options": ["Morning", "Evening", "Afternoon", "Night"],
+                "correct_answer": "Evening",
+                "explanation": "Evening planting reduces transplant shock"
+            },
+            {
+                "question": "How often should you water newly planted seeds "
+                            "around {city}?",
+                "options": ["Once a day", "Twice a day", "Every 2-3 days", "Weekly"],
+                "correct_answer": "Twice a day",
+                "explanation": "Seeds need consistent moisture for germination"
+            }
+        ]
+    }
+
+def _build_simulation(segment: dict, topic: str) -> dict:
+    return {
+        "type": "Simulation",
+        "scenario": f"Crop disease identification on {_crop_phrase(segment)}",
+        "interactive_features": [
+            "Click on affected areas of the plant",
+            "Select symptoms from a list",
+            "Choose appropriate treatment options",
+            "Get instant feedback and explanations"
+        ]
+    }
+
+def _build_guide(segment: dict, topic: str) -> dict:
+    return {
+        "type": "Step-by-step Guide",
+        "title": f"{topic} for {_crop_phrase(segment)} in {{city}}",
+        "features": [
+            "Progress tracking",
+            "Pause and resume functionality",
+            "Bookmark important sections",
+            "Download for offline viewing"
+        ]
+    }
+
+def _banked(segment: dict, kind: str, topic: str) -> Tuple[dict, bool]:
+    """Content for a segment and topic, from the bank when it has it"""
+    generate = lambda: _BUILDERS[kind](segment, topic)
+    bank = get_content_bank()
+    if bank is None:
+        return generate(), False
+    return bank.get_or_create(segment["segment_key"], kind, topic, generate)
 
 def create_interactive_content(content_type: str, topic: str, 
                              farmer_level: str = "beginner") -> dict:
     """
     Creates interactive educational content for farmers.
     
+    Content is shared by all farmers in the same segment and filled in
+    with the asking farmer's details.
+    
     Args:
         content_type: Type of content (quiz, simulation, guide)
         topic: Educational topic
-        farmer_level: Target farmer experience level
+        farmer_level: Target farmer experience level, used when the
+            farmer's profile has none
     
     Returns:
         Dict containing interactive content structure
     """
-    # TODO: Integrate with interactive content generation
+    profile = _farmer_profile()
+    segment = _segment(profile, farmer_level)
+    requested = content_type.strip().lower()
+    kinds = [requested] if requested in CONTENT_KINDS else list(CONTENT_KINDS)
+    elements = []
+    from_bank = True
+    for kind in kinds:
+        content, hit = _banked(segment, kind, topic)
+        elements.append(personalize(content, profile))
+        from_bank = from_bank and hit
     return {
         "status": "success",
         "content_type": content_type,
         "topic": topic,
-        "farmer_level": farmer_level,
-        "interactive_elements": [
-            {
-                "type": "Quiz",
-                "questions": [
-                    {
-                        "question": "What is the best time to plant tomatoes?",
-                        "options": ["Morning", "Evening", "Afternoon", "Night"],
-                        "correct_answer": "Evening",
-                        "explanation": "Evening planting reduces transplant shock"
-                    },
-                    {
-                        "question": "How often should you water newly planted seeds?",
-                        "options": ["Once a day", "Twice a day", "Every 2-3 days", "Weekly"],
-                        "correct_answer": "Twice a day",
-                        "explanation": "Seeds need consistent moisture for germination"
-                    }
-                ]
-            },
-            {
-                "type": "Simulation",
-                "scenario": "Crop disease identification",
-                "interactive_features": [
-                    "Click on affected areas of the plant",
-                    "Select symptoms from a list",
-                    "Choose appropriate treatment options",
-                    "Get instant feedback and explanations"
-                ]
-            },
-            {
-                "type": "Step-by-step Guide",
-                "features": [
-                    "Progress tracking",
-                    "Pause and resume functionality",
-                    "Bookmark important sections",
-                    "Download for offline viewing"
-                ]
-            }
-        ],
+        "farmer_level": segment["experience_level"],
+        "segment": segment["segment_key"],
+        "from_content_bank": from_bank,
+        "interactive_elements": elements,
         "accessibility_features": [
             "Voice narration in local language",
             "Large text and high contrast",
@@ -142,22 +274,23 @@ def create_interactive_content(content_type: str, topic: str,
         ]
     }
 
-def generate_personalized_content(farmer_profile: dict, topic: str) -> dict:
-    """
-    Generates personalized educational content based on farmer profile.
-    
-    Args:
-        farmer_profile: Farmer's information and preferences
-        topic: Educational topic
-    
-    Returns:
-        Dict containing personalized content recommendations
-    """
+def _project_interactive_content(args: dict, result: dict) -> dict:
+    """Only the kind of content asked for, without the boilerplate"""
+    wanted = args.get("content_type")
+    elements = result.get("interactive_elements")
+    if isinstance(elements, list) and wanted:
+        selected = [e for e in elements
+                    if isinstance(e, dict) and matches(e.get("type", ""), wanted)]
+        result["interactive_elements"] = selected or elements
+    result.pop("accessibility_features", None)
+    return result
+
+register_projection("create_interactive_content", _project_interactive_content)
+
+def _build_recommendations(segment: dict, topic: str) -> dict:
+    crops = _crop_phrase(segment)
     # TODO: Integrate with personalized content generation
     return {
-        "status": "success",
-        "farmer_profile": farmer_profile,
-        "topic": topic,
         "personalization_factors": [
             "Crop types grown by the farmer",
             "Experience level and education",
@@ -168,20 +301,20 @@ def generate_personalized_content(farmer_profile: dict, topic: str) -> dict:
         "content_recommendations": [
             {
                 "type": "Video Tutorial",
-                "title": f"Personalized Guide to {topic}",
+                "title": f"Guide to {topic} for {crops} growers in {{city}}",
                 "duration": "8 minutes",
                 "focus_areas": [
-                    "Specific to farmer's crop types",
-                    "Local climate considerations",
+                    f"Specific to {crops}",
+                    f"Climate of the {segment['zone'].replace('_', ' ')} zone",
                     "Available resource optimization"
                 ]
             },
             {
                 "type": "Interactive Quiz",
-                "difficulty": "Adaptive based on experience",
+                "difficulty": segment["experience_level"].title(),
                 "topics": [
-                    "Crop-specific best practices",
-                    "Local market conditions",
+                    f"Best practices for {crops}",
+                    "Market conditions in {state}",
                     "Weather adaptation strategies"
                 ]
             },
@@ -198,12 +331,47 @@ def generate_personalized_content(farmer_profile: dict, topic: str) -> dict:
         ],
         "delivery_preferences": {
             "format": "Mobile-optimized video",
-            "language": farmer_profile.get("native_language", "Kannada"),
+            "language": "{language}",
             "duration": "5-10 minutes per session",
             "frequency": "Weekly updates"
         }
     }
 
+_BUILDERS = {"quiz": _build_quiz, "simulation": _build_simulation,
+             "guide": _build_guide, "recommendations": _build_recommendations}
+
+def generate_personalized_content(farmer_profile: dict, topic: str) -> dict:
+    """
+    Generates personalized educational content based on farmer profile.
+    
+    Recommendations are made once per farmer segment and topic and filled
+    in with this farmer's details.
+    
+    Args:
+        farmer_profile: Farmer's information and preferences
+        topic: Educational topic
+    
+    Returns:
+        Dict containing personalized content recommendations
+    """
+    profile = _farmer_profile(farmer_profile)
+    segment = _segment(profile)
+    content, hit = _banked(segment, "recommendations", topic)
+    return {
+        "status": "success",
+        "topic": topic,
+        "segment": segment["segment_key"],
+        "from_content_bank": hit,
+        **personalize(content, profile)
+    }
+
+def _project_personalized_content(args: dict, result: dict) -> dict:
+    result.pop("personalization_factors", None)
+    return result
+
+register_projection("generate_personalized_content",
+                    _project_personalized_content)
+
 def create_community_content(community_topic: str, participants: int = 10) -> dict:
     """
     Creates community-based learning content for farmer groups.
@@ -8,6 +8,11 @@ from typing import Dict, Any
 from dotenv import load_dotenv
 from google.adk.agents import LlmAgent
 import google.generativeai as genai
+from circuit_breaker import (
+    CircuitOpenError, get_breaker, is_dependency_failure
+)
+from concurrency_limits import get_limiter
+from deadlines import hedged_call, stage_timeout
 
 # Load environment variables
 load_dotenv()
@@ -18,6 +23,20 @@ if os.getenv("GOOGLE_API_KEY"):
 
 GEMINI_MODEL = os.getenv("GEMINI_MODEL_NAME", "gemini-2.0-flash")
 
+gemini_breaker = get_breaker("gemini-api")
+gemini_limiter = get_limiter("gemini-api")
+
+
+def _generate(model, contents):
+    # The slot is taken before hedging, so the wait for it is bounded by
+    # the llm_call stage and a caller that gave up never reaches Gemini
+    with gemini_limiter.slot(timeout=stage_timeout("llm_call")):
+        return hedged_call(
+            f"vaidya:{GEMINI_MODEL}", model.generate_content, contents,
+            stage="llm_call",
+            request_options={"timeout": stage_timeout("llm_call")})
+
+
 def answer_crop_health_query(query: str, native_language: str = "Kannada") -> Dict[str, Any]:
     """
     Answers queries related to crop health, diseases, treatments, and prevention
@@ -38,12 +57,15 @@ def answer_crop_health_query(query: str, native_language: str = "Kannada") -> Di
             "treatments, or prevention. "
             "If relevant, include name, cause, treatment, and prevention tips."
         )
-        response = model.generate_content([
-            prompt,
-            query
-        ])
+        response = gemini_breaker.call(
+            _generate, model, [prompt, query],
+            is_failure=is_dependency_failure
+        )
         result = response.text if hasattr(response, "text") else str(response)
         return {"answer": result}
+    except CircuitOpenError:
+        return {"answer": None,
+                "error": "Crop health service is temporarily unavailable"}
     except Exception as e:
         return {"answer": None, "error": str(e)}
 
@@ -12,10 +12,20 @@ from datetime import datetime
 import uuid
 from dotenv import load_dotenv
 from google.adk.agents import LlmAgent
+from gazetteer import get_gazetteer, resolve_location
+from price_forecast import get_price_store, trend_report
+from request_context import current_request
+from tool_projection import register_projection, select_entities
 
 # Load environment variables
 load_dotenv()
 
+def _place(location: str) -> dict:
+    """Canonical name, district, state and coordinates of a location, or
+    the location as given when the gazetteer does not know it"""
+    place = resolve_location(location)
+    return place.to_dict() if place else {"name": location}
+
 # Vyapari Agent - Market & Weather Analysis Specialist
 def get_market_prices(crop_type: str, location: str = "Karnataka", 
                      market_type: str = "mandi") -> dict:
@@ -34,7 +44,7 @@ def get_market_prices(crop_type: str, location: str = "Karnataka",
     return {
         "status": "success",
         "crop_type": crop_type,
-        "location": location,
+        "location": _place(location),
         "market_type": market_type,
         "current_prices": {
             "tomato": {"price": "₹40/kg", "trend": "increasing", "change": "+15%"},
@@ -54,6 +64,18 @@ def get_market_prices(crop_type: str, location: str = "Karnataka",
         ]
     }
 
+def _project_market_prices(args: dict, result: dict) -> dict:
+    """Only the price of the crop asked about"""
+    prices = result.get("current_prices")
+    if isinstance(prices, dict):
+        selected = select_entities(prices, args.get("crop_type"))
+        if not selected:
+            result["prices_available_for"] = sorted(prices)
+        result["current_prices"] = selected
+    return result
+
+register_projection("get_market_prices", _project_market_prices)
+
 def get_weather_forecast(location: str, days: int = 7) -> dict:
     """
     Provides weather forecast for agricultural planning.
@@ -68,7 +90,7 @@ def get_weather_forecast(location: str, days: int = 7) -> dict:
     # TODO: Integrate with Google Weather API
     return {
         "status": "success",
-        "location": location,
+        "location": _place(location),
         "forecast_period": f"{days} days",
         "weather_data": [
             {
@@ -100,6 +122,16 @@ def get_weather_forecast(location: str, days: int = 7) -> dict:
         ]
     }
 
+def _project_forecast_days(args: dict, result: dict) -> dict:
+    """No more forecast days than were asked for"""
+    days = args.get("days")
+    if isinstance(result.get("weather_data"), list) and isinstance(days, int) \
+            and days > 0:
+        result["weather_data"] = result["weather_data"][:days]
+    return result
+
+register_projection("get_weather_forecast", _project_forecast_days)
+
 def get_crop_calendar(crop_type: str, location: str = "Karnataka") -> dict:
     """
     Provides optimal planting and harvesting calendar for crops.
@@ -115,7 +147,7 @@ def get_crop_calendar(crop_type: str, location: str = "Karnataka") -> dict:
     return {
         "status": "success",
         "crop_type": crop_type,
-        "location": location,
+        "location": _place(location),
         "planting_season": {
             "start": "June-July",
             "end": "August-September",
@@ -138,45 +170,65 @@ def get_crop_calendar(crop_type: str, location: str = "Karnataka") -> dict:
         ]
     }
 
-def get_market_trends(commodity: str, time_period: str = "monthly") -> dict:
+# Forecast horizon asked for by each analysis period
+TREND_HORIZONS = {"weekly": 7, "fortnightly": 14, "monthly": 30,
+                  "quarterly": 30}
+
+
+def get_market_trends(commodity: str, time_period: str = "monthly",
+                      market: str = "", state: str = "") -> dict:
     """
     Analyzes market trends and price predictions for commodities.
     
     Args:
         commodity: Agricultural commodity for trend analysis
         time_period: Analysis period (weekly, monthly, quarterly)
+        market: Mandi name, if the farmer asked about a specific market
+        state: State name; defaults to the farmer's state
     
     Returns:
-        Dict containing trend analysis and price predictions
+        Dict containing price statistics, seasonality, a price forecast
+        and the best-paying markets in the state
     """
-    # TODO: Integrate with market analytics API
-    return {
-        "status": "success",
-        "commodity": commodity,
-        "analysis_period": time_period,
-        "price_trends": {
-            "current_price": "₹40/kg",
-            "price_change": "+15%",
-            "trend_direction": "increasing",
-            "volatility": "moderate"
-        },
-        "market_factors": [
-            "Increased demand due to festival season",
-            "Supply constraints from heavy rainfall",
-            "Transportation costs affecting prices",
-            "Government procurement supporting prices"
-        ],
-        "predictions": {
-            "short_term": "Prices likely to remain high for next 2 weeks",
-            "medium_term": "Expected stabilization after festival season",
-            "long_term": "Stable prices expected in next quarter"
-        },
-        "recommendations": [
-            "Consider selling in current high-price period",
-            "Monitor supply chain disruptions",
-            "Plan storage for off-season sales"
-        ]
-    }
+    context = current_request()
+    profile = context.farmer_profile if context else None
+    # The farmer's own town and state, unless another place was asked for
+    if state or market:
+        profile = None
+    gazetteer = get_gazetteer()
+    state = gazetteer.state_of(state) or state
+    # Mandi files use older spellings (Mysore, Bellary); try every name of
+    # the place, and take the state from it when none was given
+    asked = market or (profile.city if profile else "")
+    market_names = [asked] if asked else []
+    place = resolve_location(asked) if asked else None
+    if place:
+        state = state or place.state
+        market_names += [n for n in gazetteer.latin_names(place)
+                         if n != asked]
+    state = state or (profile.state if profile else "")
+    try:
+        store = get_price_store()
+        trends = None
+        for name in market_names:
+            trends = store.find_market(commodity, name, state)
+            if trends is not None:
+                break
+        if trends is None and state:
+            trends = store.get(commodity, state)
+        if trends is None:
+            trends = store.get(commodity)
+        if trends is None:
+            return {"status": "error",
+                    "message": f"No price history for {commodity}"}
+        report = trend_report(trends, TREND_HORIZONS.get(time_period, 30))
+        if state:
+            report["best_markets_in_state"] = store.best_markets(
+                commodity, state)
+        return report
+    except Exception as e:
+        print(f"ERROR: Market trend lookup failed: {e}")
+        return {"status": "error", "message": "Market trends are unavailable"}
 
 vyapari_agent = LlmAgent(
     name="Vyapari",
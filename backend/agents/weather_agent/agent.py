@@ -8,12 +8,47 @@ import requests
 from typing import Dict, Any
 from dotenv import load_dotenv
 from google.adk.agents import LlmAgent
+from circuit_breaker import (
+    CircuitOpenError, LastKnownGood, get_breaker, is_dependency_failure
+)
+from concurrency_limits import get_limiter
+from deadlines import DeadlineExceeded, hedged_call, stage_timeout
+from gazetteer import resolve_location
+from tool_projection import register_projection
 
 # Load environment variables
 load_dotenv()
 
 WEATHERAPI_API_KEY = os.getenv("WEATHERAPI_API_KEY", "YOUR_WEATHERAPI_API_KEY")
 
+weather_breaker = get_breaker("weatherapi")
+weather_limiter = get_limiter("weatherapi")
+# Last successful reading per location, served (marked stale) in outages
+last_weather = LastKnownGood()
+
+
+class WeatherServiceError(Exception):
+    """WeatherAPI answered with a server error or rate limited us"""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"WeatherAPI returned {status_code}")
+        self.status_code = status_code
+
+
+def _get_current(url: str) -> requests.Response:
+    resp = requests.get(url, timeout=stage_timeout("http"))
+    if resp.status_code >= 500 or resp.status_code == 429:
+        raise WeatherServiceError(resp.status_code)
+    return resp
+
+
+def _fetch_current(url: str) -> requests.Response:
+    # The slot is taken before hedging, so the wait for it is bounded by
+    # the http stage and a caller that gave up never reaches WeatherAPI
+    with weather_limiter.slot(timeout=stage_timeout("http")):
+        return hedged_call("weatherapi.current", _get_current, url)
+
+
 # Tool: Get current weather using WeatherAPI.com Realtime API
 def get_weather_forecast(location: str) -> Dict[str, Any]:
     """
@@ -23,8 +58,23 @@ def get_weather_forecast(location: str) -> Dict[str, Any]:
     Returns:
         Dict with current weather data or error message
     """
-    url = f"https://api.weatherapi.com/v1/current.json?key={WEATHERAPI_API_KEY}&q={location}&aqi=no"
-    resp = requests.get(url)
+    # Known places are asked for by coordinates, so every spelling of a
+    # place shares one cache entry and WeatherAPI never has to guess
+    place = resolve_location(location)
+    query = f"{place.lat},{place.lon}" if place else location
+    url = f"https://api.weatherapi.com/v1/current.json?key={WEATHERAPI_API_KEY}&q={query}&aqi=no"
+    cache_key = place.key if place else location.strip().lower()
+    try:
+        resp = weather_breaker.call(
+            _fetch_current, url,
+            is_failure=is_dependency_failure)
+    except (CircuitOpenError, DeadlineExceeded, WeatherServiceError,
+            requests.RequestException) as e:
+        cached = last_weather.get(cache_key)
+        if cached:
+            weather, age = cached
+            return {**weather, "stale": True, "stale_seconds": int(age)}
+        return {"status": "error", "message": f"Weather service unavailable: {e}"}
     if resp.status_code != 200 or not resp.json():
         return {"status": "error", "message": "Location not found or API error"}
     data = resp.json()
@@ -32,9 +82,10 @@ def get_weather_forecast(location: str) -> Dict[str, Any]:
         return {"status": "error", "message": "No weather data found"}
     current = data["current"]
     condition = current.get("condition", {})
-    return {
+    weather = {
         "status": "success",
-        "location": data.get("location", {}).get("name", location),
+        "location": place.name if place else data.get("location", {}).get("name", location),
+        "state": place.state if place else data.get("location", {}).get("region"),
         "last_updated": current.get("last_updated"),
         "temp_c": current.get("temp_c"),
         "feelslike_c": current.get("feelslike_c"),
@@ -49,6 +100,20 @@ def get_weather_forecast(location: str) -> Dict[str, Any]:
         "condition_icon": condition.get("icon"),
         "is_day": current.get("is_day"),
     }
+    last_weather.put(cache_key, weather)
+    return weather
+
+# Readings kept for clients but of no use to the model's answer
+PROMPT_DROPPED_FIELDS = ("condition_icon", "is_day", "pressure_mb")
+
+
+def _project_current_weather(args: dict, result: dict) -> dict:
+    for field in PROMPT_DROPPED_FIELDS:
+        result.pop(field, None)
+    return result
+
+
+register_projection("get_weather_forecast", _project_current_weather)
 
 weather_agent = LlmAgent(
     name="WeatherAgent",
@@ -0,0 +1,253 @@
+"""
+Query analytics sink.
+
+The request path hands one record per query (question, district, handling
+agent, latency, response size, tokens) to record_query, which only puts it on a
+bounded in-memory queue. A writer thread drains the queue in batches
+into zstd-compressed Parquet files, one per hour:
+
+    var/analytics/date=2024-01-01/hour=12/queries-<pid>-<n>.parquet
+
+A file is written as *.parquet.inprogress and renamed when its hour is
+over, so readers only ever see complete files. When the queue is full
+records are dropped and counted instead of slowing the request down.
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+load_dotenv()
+
+ANALYTICS_DIR = os.getenv(
+    'ANALYTICS_DIR', os.path.join(os.path.dirname(__file__), 'var', 'analytics'))
+ANALYTICS_ENABLED = os.getenv('ANALYTICS_ENABLED', 'true').lower() != 'false'
+ANALYTICS_QUEUE_SIZE = int(os.getenv('ANALYTICS_QUEUE_SIZE', 10000))
+ANALYTICS_BATCH_SIZE = int(os.getenv('ANALYTICS_BATCH_SIZE', 1000))
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv('ANALYTICS_FLUSH_INTERVAL', 30))
+
+if pa is not None:
+    QUERY_SCHEMA = pa.schema([
+        ('query_id', pa.string()),
+        ('ts', pa.timestamp('ms', tz='UTC')),
+        ('farmer_id', pa.string()),
+        ('native_language', pa.string()),
+        ('district', pa.string()),
+        ('state', pa.string()),
+        ('question', pa.string()),
+        ('question_chars', pa.int32()),
+        ('image_count', pa.int16()),
+        ('domains', pa.list_(pa.string())),
+        ('agent', pa.string()),
+        ('fan_out', pa.bool_()),
+        ('complexity', pa.string()),
+        ('precomputed', pa.bool_()),
+        ('status', pa.string()),
+        ('latency_ms', pa.float64()),
+        ('response_chars', pa.int32()),
+        ('input_tokens', pa.int64()),
+        ('output_tokens', pa.int64()),
+    ])
+
+
+class AnalyticsSink:
+    """Bounded queue plus a writer thread producing hourly Parquet files"""
+
+    def __init__(self, directory: str = ANALYTICS_DIR,
+                 max_queue: int = ANALYTICS_QUEUE_SIZE,
+                 batch_size: int = ANALYTICS_BATCH_SIZE,
+                 flush_interval: float = ANALYTICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stats = Counter()
+        self._stats_lock = threading.Lock()
+        self._last_error = None
+        # hour key -> (ParquetWriter, in-progress path)
+        self._writers = {}
+        self._file_seq = 0
+        self._closed = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='analytics-writer', daemon=True)
+        self._thread.start()
+
+    def record(self, row: Dict[str, Any]) -> bool:
+        """Queue a record without blocking; False if it was dropped"""
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('enqueued')
+        return True
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            counters = dict(self._stats)
+        return {
+            "enabled": True,
+            "queued": self._queue.qsize(),
+            "open_files": len(self._writers),
+            "last_error": self._last_error,
+            **counters,
+        }
+
+    def close(self, timeout: float = 10) -> None:
+        """Flush what is queued and finish all open files"""
+        self._closed.set()
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take_batch()
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    self._count('write_errors')
+                    self._count('lost', len(batch))
+                    self._last_error = str(e)
+                    print(f"ERROR: Writing {len(batch)} analytics records "
+                          f"failed: {e}")
+            self._rotate(keep=_hour_key(datetime.now(timezone.utc)))
+            if self._closed.is_set() and self._queue.empty():
+                self._rotate(keep=None)
+                return
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        deadline = time.monotonic() + self.flush_interval
+        batch = []
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0 or (self._closed.is_set() and self._queue.empty()):
+                break
+            try:
+                batch.append(self._queue.get(timeout=min(timeout, 1.0)))
+            except queue.Empty:
+                continue
+        return batch
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        by_hour = {}
+        for row in batch:
+            by_hour.setdefault(_hour_key(row['ts']), []).append(row)
+        for hour, rows in by_hour.items():
+            writer, _ = self._writer_for(hour)
+            writer.write_table(pa.Table.from_pylist(rows, schema=QUERY_SCHEMA))
+            self._count('written', len(rows))
+            self._count('row_groups')
+
+    def _writer_for(self, hour: str):
+        if hour not in self._writers:
+            directory = os.path.join(self.directory, hour)
+            os.makedirs(directory, exist_ok=True)
+            self._file_seq += 1
+            path = os.path.join(
+                directory, f"queries-{os.getpid()}-{int(time.time())}-"
+                           f"{self._file_seq}.parquet.inprogress")
+            self._writers[hour] = (
+                pq.ParquetWriter(path, QUERY_SCHEMA, compression='zstd'),
+                path)
+        return self._writers[hour]
+
+    def _rotate(self, keep: Optional[str]) -> None:
+        """Finish every file except the one for hour `keep`"""
+        for hour in [h for h in self._writers if h != keep]:
+            writer, path = self._writers.pop(hour)
+            try:
+                writer.close()
+                os.replace(path, path[:-len('.inprogress')])
+                self._count('files')
+            except Exception as e:
+                self._last_error = str(e)
+                print(f"ERROR: Finishing analytics file {path} failed: {e}")
+
+
+def _hour_key(ts: datetime) -> str:
+    return ts.strftime('date=%Y-%m-%d/hour=%H')
+
+
+def record_query(request_context, question: str, answer=None,
+                 usage_dump: Optional[Dict] = None,
+                 image_count: int = 0) -> None:
+    """Queue the analytics record of one answered (or failed) query.
+
+    `answer` is the AgentAnswer, None when the pipeline raised.
+    """
+    sink = get_analytics_sink()
+    if sink is None:
+        return
+    if answer is None:
+        status = 'error'
+    elif answer.partial:
+        status = 'timeout'
+    elif not answer.text:
+        status = 'empty'
+    else:
+        status = 'ok'
+    totals = (usage_dump or {}).get('totals', {})
+    profile = request_context.farmer_profile
+    sink.record({
+        "query_id": request_context.query_id,
+        "ts": datetime.fromtimestamp(request_context.started_at, timezone.utc),
+        "farmer_id": request_context.farmer_id,
+        "native_language": request_context.native_language,
+        "district": profile.city if profile else None,
+        "state": profile.state if profile else None,
+        "question": question,
+        "question_chars": len(question),
+        "image_count": image_count,
+        "domains": answer.domains if answer else [],
+        "agent": answer.author if answer else None,
+        "fan_out": answer.fan_out if answer else False,
+        "complexity": request_context.complexity,
+        "precomputed": answer.precomputed if answer else False,
+        "status": status,
+        "latency_ms": round(
+            (time.time() - request_context.started_at) * 1000, 1),
+        "response_chars": len(answer.text) if answer and answer.text else 0,
+        "input_tokens": totals.get('input_tokens'),
+        "output_tokens": totals.get('output_tokens'),
+    })
+
+
+_sink = None
+_init_lock = threading.Lock()
+
+
+def get_analytics_sink() -> Optional[AnalyticsSink]:
+    """Return the process-wide sink, None when analytics is disabled"""
+    global _sink
+    if not ANALYTICS_ENABLED or pa is None:
+        return None
+    with _init_lock:
+        if _sink is None:
+            _sink = AnalyticsSink()
+            atexit.register(_sink.close)
+        return _sink
+
+
+def get_analytics_stats() -> Dict[str, Any]:
+    sink = get_analytics_sink()
+    if sink is None:
+        reason = "pyarrow is not installed" if pa is None else "disabled"
+        return {"enabled": False, "reason": reason}
+    return sink.stats()
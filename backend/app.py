@@ -1,21 +1,57 @@
+import functools
+import hmac
+import io
 import os
 import uuid
-import asyncio
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file
 from flask_cors import CORS
 from config import config
 from models import (
     FarmerCreate, FarmerResponse, UserQueryRequest, UserQueryResponse,
-    ErrorResponse, APIResponse
+    ErrorResponse, APIResponse, JobStatusResponse, MediaUploadRequest,
+    MediaRef, InboundMessage
+)
+from query_pipeline import AgentAnswer, QueryPipeline
+from request_context import RequestContext, request_scope
+from token_accounting import (
+    open_usage, close_usage, get_request_dump, get_token_metrics
+)
+from translation_memo import get_memo_stats
+from tool_projection import get_projection_stats
+from gazetteer import get_gazetteer_stats
+from job_queue import get_job_queue, start_workers, SUCCEEDED, FAILED
+from response_encoding import json_response, query_response_payload
+from analytics import record_query, get_analytics_stats
+from agents.model_router import get_tier_metrics
+from deadlines import (
+    REQUEST_TIMEOUT_SECONDS, request_deadline, get_deadline_stats
+)
+from circuit_breaker import get_breaker_stats
+from concurrency_limits import get_limiter_stats
+from messaging import get_message_queue, get_messaging_stats, start_messaging
+from conversation_memory import (
+    get_conversation_memory, get_conversation_memory_stats
+)
+from precompute import get_answer_bank, get_precompute_stats
+from image_triage import triage_images, get_triage_stats
+from content_bank import get_content_bank_stats
+from response_store import (
+    DONE, RUN, RUNNING, IdempotencyConflict, get_response_store,
+    get_response_store_stats, request_hash
+)
+from segments import get_segment_store
+from profiler import (
+    PROFILER_ENABLED, ProfilerBusy, capture_memory, capture_profile,
+    top_functions
+)
+from profile_cache import (
+    get_profile_cache, start_profile_cache, profile_context
+)
+from media_store import (
+    get_media_store, start_garbage_collector, decode_base64_image
 )
-from agents.agent import root_agent
 from pydantic import ValidationError
 
-# ADK imports for proper agent invocation
-from google.adk.sessions import InMemorySessionService
-from google.adk.runners import Runner
-from google.genai import types
-
 
 def create_app(config_name='development'):
     """Create and configure the Flask application."""
@@ -60,15 +96,67 @@ def create_app(config_name='development'):
     else:
         print(f"DEBUG: Credentials file found at: {credentials_path}")
     
-    # Initialize ADK Session Service and Runner
-    APP_NAME = "fasal_mitra_kisan"
-    
-    session_service = InMemorySessionService()
-    runner = Runner(
-        agent=root_agent,
-        app_name=APP_NAME,
-        session_service=session_service
-    )
+    # Initialize ADK Session Service and Runners
+    query_pipeline = QueryPipeline()
+
+    # Background workers for long-running jobs (media generation)
+    start_workers()
+    media_store = get_media_store()
+    start_garbage_collector()
+    # Farmer profiles: prefetch active farmers, follow Firestore changes
+    profile_cache = start_profile_cache()
+    # Nightly answers to the top questions per district and language
+    answer_bank = get_answer_bank()
+    # Responses by query_id and idempotency key, for retried submissions
+    response_store = get_response_store()
+    # Facts, summary and recent turns of each farmer's conversation
+    conversation_memory = get_conversation_memory()
+
+    def error_json(message, status_code):
+        error_response = ErrorResponse(error=message, status="error")
+        return jsonify(error_response.dict()), status_code
+
+    @app.errorhandler(413)
+    def request_too_large(e):
+        return error_json("Request body exceeds MAX_CONTENT_LENGTH", 413)
+
+    def debug_endpoint(view):
+        """Require the debug bearer token; without DEBUG_API_TOKEN set the
+        debug endpoints do not exist"""
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            token = app.config.get('DEBUG_API_TOKEN')
+            if not token:
+                return error_json("Not found", 404)
+            supplied = request.headers.get('Authorization', '')
+            if not hmac.compare_digest(supplied.encode('utf-8'),
+                                       f"Bearer {token}".encode('utf-8')):
+                return error_json("Invalid or missing debug token", 401)
+            return view(*args, **kwargs)
+        return wrapper
+
+    def load_query_images(query_request):
+        """Resolve hash references (and legacy base64 images, which are
+        stored so that retries can reference them) to image bytes."""
+        refs = list(query_request.image_refs or [])
+        legacy = list(query_request.image_inputs or [])
+        if query_request.image_input:
+            legacy.insert(0, query_request.image_input)
+        for encoded in legacy:
+            refs.append(media_store.put_bytes(decode_base64_image(encoded)))
+        return [media_store.read(ref) for ref in dict.fromkeys(refs)]
+
+    def precomputed_answer(question, farmer_profile, native_language):
+        """Answer from the answer bank for the farmer's district, if any"""
+        if answer_bank is None or farmer_profile is None:
+            return None
+        hit = answer_bank.lookup(question, farmer_profile.city,
+                                 native_language)
+        if hit is None:
+            return None
+        print(f"DEBUG: Serving precomputed answer (version {hit['version']})")
+        return AgentAnswer(hit['answer'], hit['agent'], hit['domains'],
+                           precomputed=True)
     
     @app.route('/')
     def hello_world():
@@ -80,109 +168,179 @@ def create_app(config_name='development'):
         """Health check endpoint."""
         return jsonify({"status": "healthy", "service": "fasal-mitra-backend"})
 
+    def run_query(query_request, query_id):
+        """Answer a query through photo triage, the answer bank or the
+        agents. Raises LookupError for unknown image references."""
+        # Get the user's actual question
+        if query_request.text_input:
+            user_question = query_request.text_input
+        elif query_request.voice_input_text:
+            user_question = query_request.voice_input_text
+        else:
+            user_question = "I need farming advice"
+        
+        print(f"DEBUG: Processing question: {user_question}")
+        
+        user_id = query_request.farmer_id or str(uuid.uuid4())
+        farmer_profile = profile_cache.get(query_request.farmer_id)
+        native_language = query_request.native_language or (
+            farmer_profile.native_language if farmer_profile
+            else 'Kannada')
+        request_context = RequestContext(
+            query_id=query_id,
+            farmer_id=user_id,
+            native_language=native_language,
+            farmer_profile=farmer_profile,
+            deadline=request_deadline()
+        )
+        open_usage(request_context)
+
+        try:
+            images = load_query_images(query_request)
+        except LookupError:
+            close_usage(request_context)
+            raise
+
+        answer = None
+        image_count = len(images)
+        memory_note = conversation_memory.context_note(user_id) \
+            if conversation_memory else None
+        farmer_note = '\n\n'.join(
+            note for note in (profile_context(farmer_profile), memory_note)
+            if note) or None
+        try:
+            if images:
+                with request_scope(request_context):
+                    triage = triage_images(images)
+                if triage is not None:
+                    # Unusable photos never reach the agents
+                    if triage.rejection:
+                        answer = AgentAnswer(triage.rejection,
+                                             'ImageTriage', ['Vaidya'])
+                    images = triage.images
+                    farmer_note = '\n\n'.join(
+                        note for note in (farmer_note, triage.hint)
+                        if note) or None
+            elif memory_note is None:
+                # Banked answers are per district; a follow-up needs the
+                # crop and problem the farmer already told us about
+                answer = precomputed_answer(
+                    user_question, farmer_profile, native_language)
+            if answer is None:
+                with request_scope(request_context):
+                    answer = query_pipeline.answer(
+                        user_question, user_id, images, farmer_note)
+        finally:
+            usage_dump = close_usage(request_context)
+            record_query(request_context, user_question, answer,
+                         usage_dump, image_count)
+
+        if usage_dump:
+            print(f"DEBUG: Token usage: {usage_dump['totals']}")
+        if conversation_memory and answer.text and not answer.partial \
+                and answer.author != 'ImageTriage':
+            conversation_memory.record_turn(
+                user_id, user_question, answer.text,
+                farmer_profile.state if farmer_profile else None)
+        response_text = answer.text
+        
+        # Fallback if no response
+        if not response_text:
+            response_text = "I apologize, but I couldn't process your query. Please try again."
+        
+        print(f"DEBUG: Final response length: {len(response_text)} characters")
+        
+        # Create response object
+        return UserQueryResponse(
+            text_response=response_text,
+            voice_response_text=response_text,
+            native_language=native_language,
+            query_id=query_id,
+            image_response=None,
+            image_responses=None,
+            partial=answer.partial
+        )
+
+    def claim_idempotency_key(key, req_hash, query_id):
+        """(state, stored response) for a request with an idempotency
+        key, waiting while an earlier request with the key runs"""
+        for _ in range(2):
+            state, _, stored = response_store.claim(key, req_hash, query_id)
+            if state != RUNNING:
+                return state, stored
+            print(f"DEBUG: Waiting for the in-flight run of key {key}")
+            state, stored = response_store.wait(key, REQUEST_TIMEOUT_SECONDS)
+            # The earlier run failed and gave the key up: claim it again
+            if state != RUN:
+                return state, stored
+        return RUNNING, None
+
+    def answer_message(message, text):
+        """Answer messages from a gateway; returns (query_id, reply)"""
+        query_request = UserQueryRequest(
+            farmer_id=message['farmer_id'] or message['farmer_key'],
+            native_language=message['native_language'] or '',
+            text_input=text)
+        query_response = run_query(query_request, str(uuid.uuid4()))
+        if response_store is not None:
+            response_store.put(query_response.query_id,
+                               query_request.farmer_id, query_response.dict())
+        return query_response.query_id, query_response.text_response
+
+    # SMS, WhatsApp and IVR messages queued by /api/messages/inbound
+    start_messaging(answer_message)
+
     @app.route('/api/getUserQueryResponse', methods=['POST'])
     def get_user_query_response():
-        """Process user query using Mitra multi-agent system."""
+        """Process user query using Mitra multi-agent system.
+
+        With an Idempotency-Key header (or idempotency_key field) retries
+        of the same request get the first run's response."""
         try:
             # Validate request data
             query_request = UserQueryRequest(**request.json)
-            
-            # Get the user's actual question
-            if query_request.text_input:
-                user_question = query_request.text_input
-            elif query_request.voice_input_text:
-                user_question = query_request.voice_input_text
-            else:
-                user_question = "I need farming advice"
-            
-            print(f"DEBUG: Processing question: {user_question}")
-            
-            # Create unique session for each query
-            unique_session_id = f"session_{uuid.uuid4()}"
-            user_id = query_request.farmer_id or str(uuid.uuid4())
-            
-            # Run async operations
-            async def run_agent_async():
-                # Create a new session
-                await session_service.create_session(
-                    app_name=APP_NAME,
-                    user_id=user_id,
-                    session_id=unique_session_id
-                )
-                
-                # Create the message content
-                new_message = types.Content(
-                    parts=[types.Part(text=user_question)]
-                )
-                
-                print(f"DEBUG: Sending to agent: {user_question}")
-                
-                # Collect all events from the agent
-                all_events = []
+            query_id = str(uuid.uuid4())
+
+            key = None
+            idempotency_key = (request.headers.get('Idempotency-Key')
+                               or query_request.idempotency_key or '').strip()
+            if idempotency_key and response_store is not None:
+                key = f"{query_request.farmer_id}:{idempotency_key}"
                 try:
-                    async for event in runner.run_async(
-                        user_id=user_id,
-                        session_id=unique_session_id,
-                        new_message=new_message
-                    ):
-                        all_events.append(event)
-                        
-                        # Log the response
-                        if hasattr(event, 'content') and event.content:
-                            if hasattr(event.content, 'parts'):
-                                for part in event.content.parts:
-                                    if hasattr(part, 'text'):
-                                        print(f"DEBUG: Agent response preview: {part.text[:100]}...")
-                except Exception as e:
-                    print(f"ERROR: Agent execution failed: {str(e)}")
-                    raise
-                
-                return all_events
-            
-            # Execute the async function
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+                    state, stored = claim_idempotency_key(
+                        key, request_hash(request.json), query_id)
+                except IdempotencyConflict as e:
+                    return error_json(str(e), 422)
+                if state == RUNNING:
+                    return error_json(
+                        "A request with this idempotency key is still "
+                        "being processed", 409)
+                if state == DONE:
+                    print(f"DEBUG: Replaying stored response "
+                          f"{stored['query_id']} for key {key}")
+                    response = json_response(query_response_payload(
+                        UserQueryResponse(**stored),
+                        query_request.omit_duplicate_voice))
+                    response.headers['Idempotent-Replayed'] = 'true'
+                    return response
+
             try:
-                events = loop.run_until_complete(run_agent_async())
-            finally:
-                loop.close()
-            
-            print(f"DEBUG: Received {len(events)} events")
-            
-            # Extract the response
-            response_text = None
-            
-            # Look for the actual response in events
-            for event in events:
-                if hasattr(event, 'content') and event.content:
-                    if hasattr(event.content, 'parts') and event.content.parts:
-                        for part in event.content.parts:
-                            if hasattr(part, 'text') and part.text:
-                                text = part.text.strip()
-                                # Skip empty responses
-                                if text:
-                                    response_text = text
-                                    break
-                    if response_text:
-                        break
-            
-            # Fallback if no response
-            if not response_text:
-                response_text = "I apologize, but I couldn't process your query. Please try again."
-            
-            print(f"DEBUG: Final response length: {len(response_text)} characters")
-            
-            # Create response object
-            query_response = UserQueryResponse(
-                text_response=response_text,
-                voice_response_text=response_text,
-                native_language=query_request.native_language or 'Kannada',
-                query_id=str(uuid.uuid4()),
-                image_response=None,
-                image_responses=None
-            )
+                query_response = run_query(query_request, query_id)
+            except Exception as e:
+                if key is not None:
+                    response_store.release(key, query_id)
+                if isinstance(e, LookupError):
+                    return error_json(str(e), 400)
+                raise
+
+            if response_store is not None:
+                # A partial answer is not final: a retry runs again
+                response_store.put(query_id, query_request.farmer_id,
+                                   query_response.dict(), key,
+                                   keep_key=not query_response.partial)
             
-            return jsonify(query_response.dict()), 200
+            return json_response(query_response_payload(
+                query_response, query_request.omit_duplicate_voice))
             
         except Exception as e:
             print(f"ERROR: Exception in query processing: {str(e)}")
@@ -194,6 +352,262 @@ def create_app(config_name='development'):
                 status="error"
             )
             return jsonify(error_response.dict()), 500
+
+    @app.route('/api/queries/<query_id>')
+    def stored_query_response(query_id):
+        """A past query's response, while it is kept."""
+        stored = response_store.get(query_id) if response_store else None
+        if stored is None:
+            return error_json(f"Query {query_id} not found", 404)
+        return json_response(query_response_payload(
+            UserQueryResponse(**stored),
+            request.args.get('omit_duplicate_voice') == 'true'))
+
+    @app.route('/api/messages/inbound', methods=['POST'])
+    def inbound_messages():
+        """Gateway webhook: queue one message (or {"messages": [...]})
+        and acknowledge at once; replies are sent asynchronously."""
+        token = app.config.get('MESSAGING_WEBHOOK_TOKEN')
+        if not token and not app.config.get('MESSAGING_ALLOW_UNAUTHENTICATED'):
+            # Left open, anyone could start agent runs and have replies
+            # sent to any number
+            return error_json("Messaging webhook is not configured", 403)
+        if token and not hmac.compare_digest(
+                request.headers.get('X-Gateway-Token', '').encode('utf-8'),
+                token.encode('utf-8')):
+            return error_json("Invalid or missing gateway token", 401)
+        payload = request.get_json(silent=True) or {}
+        items = payload.get('messages', [payload]) \
+            if isinstance(payload, dict) else payload
+        try:
+            messages = [InboundMessage(**item).dict() for item in items]
+        except (ValidationError, TypeError) as e:
+            return error_json(str(e), 400)
+        accepted, duplicates = get_message_queue().enqueue(messages)
+        return jsonify(APIResponse(
+            message="Messages queued", status="success",
+            data={"accepted": accepted, "duplicates": duplicates}
+        ).dict()), 202
+
+    @app.route('/api/media/uploads', methods=['POST'])
+    def start_media_upload():
+        """Open a chunked upload, or skip it if the hash is already stored."""
+        try:
+            upload_request = MediaUploadRequest(**(request.get_json(
+                silent=True) or {}))
+            upload = media_store.start_upload(upload_request.sha256)
+        except (ValidationError, ValueError) as e:
+            return error_json(str(e), 400)
+        return jsonify(upload), 200 if upload["exists"] else 201
+
+    @app.route('/api/media/uploads/<upload_id>', methods=['GET', 'PUT'])
+    def media_upload_chunk(upload_id):
+        """PUT appends the raw request body at the `offset` query
+        parameter; GET returns the offset to resume from."""
+        try:
+            if request.method == 'GET':
+                return jsonify({"upload_id": upload_id,
+                                "offset": media_store.upload_offset(upload_id)})
+            offset = media_store.append_chunk(
+                upload_id, request.args.get('offset', 0, type=int),
+                request.stream)
+        except LookupError as e:
+            return error_json(str(e), 404)
+        except ValueError as e:
+            return error_json(str(e), 409)
+        return jsonify({"upload_id": upload_id, "offset": offset})
+
+    @app.route('/api/media/uploads/<upload_id>/complete', methods=['POST'])
+    def complete_media_upload(upload_id):
+        """Finish an upload; returns the media reference."""
+        try:
+            media_ref = MediaRef(**media_store.complete_upload(upload_id))
+        except LookupError as e:
+            return error_json(str(e), 404)
+        except ValueError as e:
+            return error_json(str(e), 400)
+        return jsonify(media_ref.dict()), 201
+
+    @app.route('/api/media/<sha256>', methods=['GET', 'HEAD'])
+    def get_media(sha256):
+        """Serve a stored media object by hash (HEAD checks existence)."""
+        if not media_store.exists(sha256):
+            return error_json(f"media {sha256} not found", 404)
+        data, mime_type = media_store.read(sha256)
+        response = send_file(io.BytesIO(data), mimetype=mime_type,
+                             max_age=31536000, etag=sha256)
+        return response
+
+    @app.route('/api/jobs/<job_id>')
+    def job_status(job_id):
+        """Status of a background job."""
+        job = get_job_queue().get(job_id)
+        if job is None:
+            error_response = ErrorResponse(
+                error=f"Job {job_id} not found", status="error")
+            return jsonify(error_response.dict()), 404
+        return jsonify(JobStatusResponse(**job).dict()), 200
+
+    @app.route('/api/jobs/<job_id>/result')
+    def job_result(job_id):
+        """Result of a finished background job."""
+        job = get_job_queue().get(job_id)
+        if job is None:
+            error_response = ErrorResponse(
+                error=f"Job {job_id} not found", status="error")
+            return jsonify(error_response.dict()), 404
+        if job['status'] == FAILED:
+            error_response = ErrorResponse(
+                error=f"Job {job_id} failed: {job['error']}", status="error")
+            return jsonify(error_response.dict()), 500
+        if job['status'] != SUCCEEDED:
+            return jsonify(JobStatusResponse(**job).dict()), 202
+        return jsonify(APIResponse(
+            message="Job completed", status="success", data=job['result']
+        ).dict()), 200
+
+    @app.route('/api/metrics/tokens')
+    def token_metrics():
+        """Aggregated token usage per agent and per tool."""
+        return jsonify(get_token_metrics())
+
+    @app.route('/api/metrics/tool-projection')
+    def tool_projection_metrics():
+        """Bytes and estimated tokens cut from tool results per tool."""
+        return jsonify(get_projection_stats())
+
+    @app.route('/api/metrics/gazetteer')
+    def gazetteer_metrics():
+        """Places indexed, lookups resolved exactly, fuzzily or not at all."""
+        return jsonify(get_gazetteer_stats())
+
+    @app.route('/api/metrics/responses')
+    def response_store_metrics():
+        """Stored responses, replayed retries and idempotency conflicts."""
+        return jsonify(get_response_store_stats())
+
+    @app.route('/api/metrics/translation-memo')
+    def translation_memo_metrics():
+        """Hit/miss counters of the tool-output translation memo."""
+        return jsonify(get_memo_stats())
+
+    @app.route('/api/metrics/profile-cache')
+    def profile_cache_metrics():
+        """Hit rate and size of the farmer profile cache."""
+        return jsonify(get_profile_cache().stats())
+
+    @app.route('/api/metrics/analytics')
+    def analytics_metrics():
+        """Queue depth, written and dropped records of the analytics sink."""
+        return jsonify(get_analytics_stats())
+
+    @app.route('/api/metrics/model-tiers')
+    def model_tier_metrics():
+        """Calls, latency and cost per model tier, queries per complexity."""
+        return jsonify(get_tier_metrics())
+
+    @app.route('/api/metrics/deadlines')
+    def deadline_metrics():
+        """Timeouts, hedged calls and latency percentiles per call."""
+        return jsonify(get_deadline_stats())
+
+    @app.route('/api/metrics/breakers')
+    def breaker_metrics():
+        """State and recent failures of each dependency's circuit breaker."""
+        return jsonify(get_breaker_stats())
+
+    @app.route('/api/metrics/concurrency')
+    def concurrency_metrics():
+        """Adaptive concurrency limit, in-flight calls and queues per upstream."""
+        return jsonify(get_limiter_stats())
+
+    @app.route('/api/metrics/messaging')
+    def messaging_metrics():
+        """Messaging queue depth, lag and reply delivery counts."""
+        return jsonify(get_messaging_stats())
+
+    @app.route('/api/metrics/conversation-memory')
+    def conversation_memory_metrics():
+        """Conversations kept, summaries made and memory note sizes."""
+        return jsonify(get_conversation_memory_stats())
+
+    @app.route('/api/metrics/precomputed')
+    def precomputed_metrics():
+        """Active answer bank version, its size and the lookup hit rate."""
+        return jsonify(get_precompute_stats())
+
+    @app.route('/api/metrics/image-triage')
+    def image_triage_metrics():
+        """Images rejected or diagnosed on the CPU, and model batching."""
+        return jsonify(get_triage_stats())
+
+    @app.route('/api/metrics/content-bank')
+    def content_bank_metrics():
+        """Shikshak content reused per farmer segment, and the segments."""
+        return jsonify({"content": get_content_bank_stats(),
+                        "segments": get_segment_store().stats()})
+
+    @app.route('/api/debug/token-usage/<query_id>')
+    @debug_endpoint
+    def token_usage_dump(query_id):
+        """Per-request token and prompt-size breakdown."""
+        dump = get_request_dump(query_id)
+        if dump is None:
+            error_response = ErrorResponse(
+                error=f"No token usage recorded for query {query_id}",
+                status="error"
+            )
+            return jsonify(error_response.dict()), 404
+        return jsonify(dump)
+
+    @app.route('/api/debug/profile')
+    @debug_endpoint
+    def profile_capture():
+        """Sample all threads for ?seconds= and return a flame graph
+        (format=speedscope, collapsed or summary)."""
+        if not PROFILER_ENABLED:
+            return error_json("Profiler is disabled (PROFILER_ENABLED)", 404)
+        output = request.args.get('format', 'speedscope')
+        if output not in ('speedscope', 'collapsed', 'summary'):
+            return error_json(
+                "format must be speedscope, collapsed or summary", 400)
+        try:
+            seconds = float(request.args.get('seconds', 10))
+            interval_ms = request.args.get('interval_ms')
+            interval = float(interval_ms) / 1000 if interval_ms else None
+        except ValueError:
+            return error_json("seconds and interval_ms must be numbers", 400)
+        idle = request.args.get('idle', 'false').lower() == 'true'
+        try:
+            profiler = capture_profile(seconds, interval, idle)
+        except ProfilerBusy as e:
+            return error_json(str(e), 409)
+        if output == 'collapsed':
+            return Response(profiler.collapsed(), mimetype='text/plain')
+        if output == 'summary':
+            return jsonify({**profiler.summary(), "top_functions": [
+                {"function": name, "samples": count}
+                for name, count in top_functions(profiler)]})
+        response = jsonify(profiler.speedscope())
+        response.headers['Content-Disposition'] = (
+            'attachment; filename="profile.speedscope.json"')
+        return response
+
+    @app.route('/api/debug/memory')
+    @debug_endpoint
+    def memory_snapshot():
+        """Largest allocation sites and their growth over ?seconds=."""
+        if not PROFILER_ENABLED:
+            return error_json("Profiler is disabled (PROFILER_ENABLED)", 404)
+        try:
+            seconds = float(request.args.get('seconds', 0))
+            top = int(request.args.get('top', 25))
+            return jsonify(capture_memory(
+                seconds, top, request.args.get('group_by', 'lineno')))
+        except ValueError as e:
+            return error_json(str(e), 400)
+        except ProfilerBusy as e:
+            return error_json(str(e), 409)
         
     return app
 
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the SQLite farmer store: bulk upsert, indexed cohort
+queries and paged iteration over synthetic farmers. Runs offline.
+
+Run from the backend directory:
+    python benchmarks/bench_farmer_store.py [--farmers 100000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from farmer_store import SQLiteFarmerStore  # noqa: E402
+from models import FarmerResponse  # noqa: E402
+
+PLACES = {
+    "Karnataka": ["Mysuru", "Mandya", "Hassan", "Tumakuru", "Belagavi",
+                  "Dharwad", "Raichur", "Kalaburagi"],
+    "Maharashtra": ["Pune", "Nashik", "Nagpur", "Solapur", "Satara"],
+    "Tamil Nadu": ["Madurai", "Salem", "Erode", "Thanjavur"],
+    "Uttar Pradesh": ["Agra", "Meerut", "Varanasi", "Bareilly"],
+}
+LANGUAGES = {
+    "Karnataka": ["Kannada", "Kannada", "Kannada", "Hindi", "Telugu"],
+    "Maharashtra": ["Marathi", "Marathi", "Hindi"],
+    "Tamil Nadu": ["Tamil", "Tamil", "Telugu"],
+    "Uttar Pradesh": ["Hindi"],
+}
+
+
+def synthetic_farmers(count, seed=7):
+    rng = random.Random(seed)
+    states = list(PLACES)
+    for i in range(count):
+        state = rng.choice(states)
+        yield FarmerResponse(
+            farmer_id=f"{rng.getrandbits(128):032x}",
+            farmer_name=f"Farmer {i}",
+            state=state,
+            city=rng.choice(PLACES[state]),
+            contact_number=f"+91-9{rng.randrange(10 ** 9):09d}",
+            native_language=rng.choice(LANGUAGES[state]),
+            created_at="2024-01-01T12:00:00",
+            updated_at="2024-01-01T12:00:00",
+        )
+
+
+def timed(label, func, repeat=1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    elapsed = (time.perf_counter() - started) / repeat
+    print(f"{label:<52} {elapsed * 1000:>9.2f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--farmers', type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SQLiteFarmerStore(os.path.join(tmp, 'farmers.sqlite3'))
+        farmers = list(synthetic_farmers(args.farmers))
+
+        timed(f"bulk_upsert {args.farmers} farmers",
+              lambda: store.bulk_upsert(farmers))
+        timed("bulk_upsert 1000 updates",
+              lambda: store.bulk_upsert(farmers[:1000]))
+
+        cohorts = [
+            {"city": "Mysuru", "native_language": "Kannada"},
+            {"state": "Karnataka", "city": "Mysuru",
+             "native_language": "kannada"},
+            {"native_language": "Telugu"},
+            {"state": "Tamil Nadu"},
+        ]
+        print()
+        for filters in cohorts:
+            label = ', '.join(f"{k}={v}" for k, v in filters.items())
+            count = timed(f"count({label})",
+                          lambda: store.count(**filters), repeat=20)
+            timed(f"  first page of 100 ({count} matches)",
+                  lambda: store.find(limit=100, **filters), repeat=20)
+            print(f"  plan: {'; '.join(store.explain(**filters))}")
+
+        print()
+        ids = [f.farmer_id for f in random.Random(1).sample(farmers, 500)]
+        timed("get_many(500 ids)", lambda: store.get_many(ids), repeat=10)
+        timed("get(1 id)", lambda: store.get(ids[0]), repeat=1000)
+        total = timed("iter_farmers over all, pages of 500",
+                      lambda: sum(1 for _ in store.iter_farmers()))
+        print(f"  iterated {total} farmers")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Latency of place-name resolution at village scale: the shipped gazetteer
+plus synthetic village names, queried with exact names, misspellings,
+native-script names and repeats served from the memo. Runs offline.
+
+Run from the backend directory:
+    python benchmarks/bench_gazetteer.py [--villages 200000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gazetteer import Gazetteer, Place  # noqa: E402
+
+SYLLABLES = [c + v for c in "bcdghjklmnprstvy" for v in ("a", "e", "i", "o", "u",
+                                                        "an", "ar", "al")]
+SUFFIXES = ["halli", "pura", "palya", "kere", "gudi", "nagar", "ur", "wadi"]
+
+
+def synthetic_villages(gazetteer, count, seed=7):
+    rng = random.Random(seed)
+    names = []
+    for _ in range(count):
+        name = ''.join(rng.choice(SYLLABLES)
+                       for _ in range(rng.randint(2, 3))).title()
+        name += rng.choice(SUFFIXES)
+        names.append(name)
+        gazetteer.add(Place(name, 'village', 'Mysuru', 'Karnataka',
+                            12 + rng.random(), 76 + rng.random(),
+                            rng.randint(200, 5000)))
+    return names
+
+
+def timed(label, gazetteer, queries):
+    started = time.perf_counter()
+    resolved = sum(gazetteer._resolve(q, 'Karnataka') is not None
+                   for q in queries)
+    elapsed = (time.perf_counter() - started) / len(queries)
+    print(f"{label:<40} {elapsed * 1e6:>9.1f} us  "
+          f"({resolved}/{len(queries)} resolved)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--villages', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+
+    gazetteer = Gazetteer()
+    started = time.perf_counter()
+    names = synthetic_villages(gazetteer, args.villages)
+    print(f"indexed {len(gazetteer._name_keys)} names in "
+          f"{time.perf_counter() - started:.1f} s")
+
+    rng = random.Random(3)
+    sample = rng.sample(names, min(args.queries, len(names)))
+    timed("exact village name", gazetteer, sample)
+    misspelt = [n[:-2] + n[-1] if len(n) > 6 else n + 'a' for n in sample]
+    timed("village name with a letter dropped", gazetteer, misspelt)
+    timed("city exonym (Bangalore, Mysore, Belgaum)", gazetteer,
+          ["Bangalore", "Mysore", "Belgaum"] * (args.queries // 3))
+    timed("Kannada script (ಮೈಸೂರು, ಮಂಡ್ಯ)", gazetteer,
+          ["ಮೈಸೂರು", "ಮಂಡ್ಯ"] * (args.queries // 2))
+
+    started = time.perf_counter()
+    for query in sample:
+        gazetteer.resolve(query)
+    for query in sample:
+        gazetteer.resolve(query)
+    elapsed = (time.perf_counter() - started) / (2 * len(sample))
+    print(f"{'memoized repeat (half the calls)':<40} {elapsed * 1e6:>9.1f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+CPU latency benchmark of image triage: JPEG decode and quality checks
+per image, the NumPy CNN at several batch sizes, and end-to-end triage
+from concurrent requests through the micro-batcher. Uses a synthetic
+photo and a randomly initialised model of the shipped architecture, so
+it runs offline; latency does not depend on the weights.
+
+Run from the backend directory:
+    python benchmarks/bench_image_triage.py [--requests 64] [--threads 8]
+"""
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import image_triage  # noqa: E402
+from image_triage import (  # noqa: E402
+    ImageTriager, NumpyCNN, decode, quality_issue
+)
+
+LABELS = ["not_plant", "tomato:healthy", "tomato:early_blight",
+          "tomato:late_blight", "tomato:leaf_curl", "chilli:leaf_curl",
+          "paddy:blast", "paddy:brown_spot"]
+
+
+def synthetic_photo(size=1024, seed=3):
+    """Leafy-green JPEG with texture, roughly like a phone photo"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    base = np.stack([0.25 + 0.2 * np.sin(9 * x),
+                     0.55 + 0.2 * np.cos(7 * y),
+                     0.2 + 0.1 * np.sin(5 * x * y)], axis=2)
+    noise = rng.normal(0, 0.08, base.shape)
+    pixels = np.clip(base + noise, 0, 1) * 255
+    buffer = io.BytesIO()
+    Image.fromarray(pixels.astype(np.uint8)).save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def random_model(path, input_size=64, channels=(16, 32, 64), seed=5):
+    rng = np.random.default_rng(seed)
+    weights = {"labels": np.array(LABELS), "input_size": input_size}
+    previous = 3
+    for i, out in enumerate(channels):
+        weights[f"conv{i}_w"] = rng.normal(
+            0, (2 / (9 * previous)) ** 0.5, (out, previous, 3, 3))
+        weights[f"conv{i}_b"] = np.zeros(out)
+        previous = out
+    weights["fc_w"] = rng.normal(0, 0.1, (len(LABELS), previous))
+    weights["fc_b"] = np.zeros(len(LABELS))
+    np.savez(path, **weights)
+    return NumpyCNN(path)
+
+
+def timed(label, func, repeat=20, per=1):
+    func()  # warm-up
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = (time.perf_counter() - started) / repeat
+    print(f"{label:<48} {elapsed * 1000:>8.2f} ms"
+          + (f"  ({elapsed * 1000 / per:.2f} ms/image)" if per > 1 else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    photo = synthetic_photo()
+    image, original = decode(photo)
+    pixels = np.asarray(image, dtype=np.float32) / 255.0
+    print(f"photo: {len(photo)} bytes, quality: {quality_issue(pixels, original)}")
+    timed("decode + resize (1024px JPEG)", lambda: decode(photo))
+    timed("quality checks (256px)", lambda: quality_issue(pixels, original))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model = random_model(os.path.join(tmp, 'triage.npz'))
+    inputs = np.asarray(image.resize((64, 64)), dtype=np.float32) / 255.0
+    for batch_size in (1, 8, 32):
+        batch = np.stack([inputs] * batch_size)
+        timed(f"CNN forward, batch {batch_size}",
+              lambda: model.predict(batch), per=batch_size)
+
+    for max_batch in (1, image_triage.TRIAGE_MAX_BATCH):
+        triager = ImageTriager(model)
+        triager.batcher.max_batch = max_batch
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as pool:
+            list(pool.map(lambda _: triager.triage([(photo, 'image/jpeg')]),
+                          range(args.requests)))
+        elapsed = time.perf_counter() - started
+        stats = triager.stats()
+        print(f"{args.requests} requests x {args.threads} threads, "
+              f"max batch {max_batch:<3}      {elapsed * 1000:>8.2f} ms  "
+              f"({args.requests / elapsed:.0f} images/s, avg batch "
+              f"{stats['batching']['avg_batch_size']})")
+
+
+if __name__ == '__main__':
+    main()
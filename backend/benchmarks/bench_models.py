@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for request validation and response serialization of
+the models in models.py.
+
+Run from the backend directory:
+    python benchmarks/bench_models.py [--number 20000]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import timeit
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import UserQueryRequest, UserQueryResponse  # noqa: E402
+import response_encoding  # noqa: E402
+
+warnings.filterwarnings('ignore')
+
+ANSWER = (
+    "ಟೊಮೆಟೊ ಬೆಲೆ ಈ ವಾರ ಏರಿಕೆಯಾಗುವ ಸಾಧ್ಯತೆ ಇದೆ. ಮಳೆಯ ಮುನ್ಸೂಚನೆ ಇರುವುದರಿಂದ "
+    "ಕೊಯ್ಲು ಮಾಡಿದ ಬೆಳೆಯನ್ನು ಒಣ ಜಾಗದಲ್ಲಿ ಸಂಗ್ರಹಿಸಿ. "
+) * 12
+
+REQUEST_PAYLOAD = {
+    "farmer_id": "550e8400-e29b-41d4-a716-446655440000",
+    "native_language": "Kannada",
+    "text_input": "Should I sell my tomatoes this week given the rain?",
+    "image_refs": ["9f86d081884c7d659a2feaa0c55ad015"
+                   "a3bf4f1b2b0b822cd15d6c15b0f00a08"],
+}
+
+
+def bench(label, func, number):
+    seconds = timeit.timeit(func, number=number)
+    print(f"{label:<44} {seconds / number * 1e6:>9.2f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+    n = args.number
+
+    response = UserQueryResponse(
+        text_response=ANSWER,
+        voice_response_text=ANSWER,
+        native_language="Kannada",
+        query_id="query-12345"
+    )
+
+    print("Validation")
+    bench("UserQueryRequest(**payload)",
+          lambda: UserQueryRequest(**REQUEST_PAYLOAD), n)
+    bench("UserQueryRequest.model_validate(payload)",
+          lambda: UserQueryRequest.model_validate(REQUEST_PAYLOAD), n)
+    raw = json.dumps(REQUEST_PAYLOAD)
+    bench("UserQueryRequest.model_validate_json(raw)",
+          lambda: UserQueryRequest.model_validate_json(raw), n)
+
+    print("\nSerialization")
+    bench("json.dumps(response.dict()) (jsonify path)",
+          lambda: json.dumps(response.dict()), n)
+    bench("response.model_dump_json()",
+          lambda: response.model_dump_json(), n)
+    bench("response_encoding.dumps(model_dump())",
+          lambda: response_encoding.dumps(response.model_dump()), n)
+    bench("... omitting duplicate voice text",
+          lambda: response_encoding.dumps(
+              response_encoding.query_response_payload(response, True)), n)
+
+    print("\nCompression (full compact body)")
+    body = response_encoding.dumps(response.model_dump())
+    bench(f"gzip level {response_encoding.GZIP_LEVEL}",
+          lambda: gzip.compress(body, response_encoding.GZIP_LEVEL), n // 10)
+    if response_encoding.brotli is not None:
+        bench(f"brotli quality {response_encoding.BROTLI_QUALITY}",
+              lambda: response_encoding.brotli.compress(
+                  body, quality=response_encoding.BROTLI_QUALITY), n // 10)
+
+    print("\nPayload size (bytes)")
+    compact = response_encoding.dumps(
+        response_encoding.query_response_payload(response, True))
+    sizes = {
+        "jsonify-style (ASCII escapes)": len(json.dumps(response.dict())),
+        "compact UTF-8": len(body),
+        "compact UTF-8, no duplicate voice": len(compact),
+        "... + gzip": len(gzip.compress(compact)),
+    }
+    if response_encoding.brotli is not None:
+        sizes["... + brotli"] = len(response_encoding.brotli.compress(
+            compact, quality=response_encoding.BROTLI_QUALITY))
+    for label, size in sizes.items():
+        print(f"{label:<44} {size:>9}")
+
+
+if __name__ == '__main__':
+    main()
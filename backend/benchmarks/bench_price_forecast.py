@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the nightly price-forecasting batch and of the request-time
+lookup, on synthetic seasonal price histories. Runs offline.
+
+Run from the backend directory:
+    python benchmarks/bench_price_forecast.py [--series 20000] [--days 730]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pyarrow as pa  # noqa: E402
+import pyarrow.parquet as pq  # noqa: E402
+
+from price_forecast import PriceTrendStore, run_forecasts  # noqa: E402
+
+COMMODITIES = ["Tomato", "Onion", "Potato", "Paddy", "Wheat", "Maize",
+               "Ragi", "Tur", "Groundnut", "Cotton", "Chilli", "Banana"]
+STATES = ["Karnataka", "Maharashtra", "Tamil Nadu", "Uttar Pradesh",
+          "Andhra Pradesh", "Madhya Pradesh", "Gujarat", "Rajasthan"]
+
+
+def synthetic_history(path, series, days, seed=11, report_rate=0.8):
+    """Daily modal prices with trend, yearly seasonality and noise; each
+    market reports on `report_rate` of the days"""
+    rng = np.random.default_rng(seed)
+    markets_per_state = max(1, series // (len(COMMODITIES) * len(STATES)))
+    commodity = np.repeat(np.arange(len(COMMODITIES)),
+                          len(STATES) * markets_per_state)
+    state = np.tile(np.repeat(np.arange(len(STATES)), markets_per_state),
+                    len(COMMODITIES))
+    market = np.tile(np.arange(markets_per_state),
+                     len(COMMODITIES) * len(STATES))
+    n = len(commodity)
+    t = np.arange(days)
+    base = rng.uniform(800, 6000, n)[:, None]
+    season = 1 + rng.uniform(0.05, 0.3, n)[:, None] * np.sin(
+        2 * np.pi * (t[None, :] / 365 + rng.uniform(0, 1, n)[:, None]))
+    drift = 1 + rng.normal(0, 0.0003, n)[:, None] * t[None, :]
+    noise = np.exp(rng.normal(0, 0.03, (n, days)))
+    prices = base * season * drift * noise
+    reported = rng.random((n, days)) < report_rate
+
+    rows, cols = np.nonzero(reported)
+    start = date.today() - timedelta(days=days - 1)
+    dates = np.datetime64(start) + cols.astype('timedelta64[D]')
+    market_names = np.array([f"Market {i}" for i in range(markets_per_state)])
+    table = pa.table({
+        "commodity": pa.DictionaryArray.from_arrays(
+            commodity[rows], COMMODITIES).cast(pa.string()),
+        "state": pa.DictionaryArray.from_arrays(
+            state[rows], STATES).cast(pa.string()),
+        "market": pa.DictionaryArray.from_arrays(
+            market[rows], market_names).cast(pa.string()),
+        "date": pa.array(dates, pa.date32()),
+        "modal_price": np.round(prices[rows, cols]),
+    })
+    pq.write_table(table, path)
+    return n, table.num_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--series', type=int, default=20000)
+    parser.add_argument('--days', type=int, default=730)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        history = os.path.join(tmp, 'history')
+        os.makedirs(history)
+        started = time.perf_counter()
+        series, rows = synthetic_history(
+            os.path.join(history, 'prices.parquet'), args.series, args.days)
+        print(f"synthetic history: {series} series, {rows} rows "
+              f"({time.perf_counter() - started:.1f} s)")
+
+        store = PriceTrendStore(os.path.join(tmp, 'prices.sqlite3'))
+        started = time.perf_counter()
+        result = run_forecasts(history, store)
+        print(f"nightly batch: {time.perf_counter() - started:.2f} s total, "
+              f"{result}")
+
+        lookups = [(COMMODITIES[i % len(COMMODITIES)],
+                    STATES[i % len(STATES)], f"Market {i % 7}")
+                   for i in range(1000)]
+        started = time.perf_counter()
+        for commodity, state, market in lookups:
+            store.get(commodity, state, market)
+        elapsed = (time.perf_counter() - started) / len(lookups)
+        print(f"{'lookup by (commodity, state, market)':<44} "
+              f"{elapsed * 1e6:>8.1f} us")
+        started = time.perf_counter()
+        for commodity, state, _ in lookups:
+            store.best_markets(commodity, state)
+        elapsed = (time.perf_counter() - started) / len(lookups)
+        print(f"{'best 5 markets in a state':<44} {elapsed * 1e6:>8.1f} us")
+
+        sample = store.get("Tomato", "Karnataka", "Market 0")
+        print({k: sample[k] for k in ("last_price", "forecast_7d",
+                                      "forecast_30d", "method",
+                                      "backtest_mape_pct",
+                                      "seasonal_index_this_month")})
+
+
+if __name__ == '__main__':
+    main()
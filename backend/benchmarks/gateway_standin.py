@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for an SMS/WhatsApp gateway: fires bursts of inbound
+webhooks at the backend and receives the replies, then reports the
+acknowledgement latency, the time until every farmer had a reply, and
+any reply that arrived out of order.
+
+Start the backend with the stand-in as its outbound URL, then run it:
+    MESSAGING_OUTBOUND_URL=http://localhost:3010/send python app.py
+    python benchmarks/gateway_standin.py --farmers 50 --messages 3
+"""
+
+import argparse
+import json
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+QUESTIONS = [
+    "ಟೊಮೇಟೊ ಬೆಲೆ ಎಷ್ಟು?",
+    "Will it rain in Mysuru tomorrow?",
+    "मेरे धान के पत्ते पीले हो रहे हैं",
+    "Which government schemes help with drip irrigation?",
+    "When should I sow ragi?",
+]
+
+
+class Replies:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_recipient = {}
+        self.arrived = threading.Event()
+
+    def add(self, reply):
+        with self.lock:
+            self.by_recipient.setdefault(reply['recipient'], []).append(
+                (time.perf_counter(), reply['in_reply_to']))
+        self.arrived.set()
+
+
+def make_handler(replies):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            replies.add(json.loads(body))
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+    return Handler
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--target', default='http://localhost:3005')
+    parser.add_argument('--port', type=int, default=3010)
+    parser.add_argument('--channel', default='sms')
+    parser.add_argument('--farmers', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=3,
+                        help='messages per farmer, sent in order')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--redeliver', action='store_true',
+                        help='send every webhook twice, as gateways do')
+    parser.add_argument('--token', help='X-Gateway-Token to send')
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    replies = Replies()
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(replies))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    run = uuid.uuid4().hex[:8]
+    url = f"{args.target}/api/messages/inbound"
+    headers = {'X-Gateway-Token': args.token} if args.token else {}
+    session = requests.Session()
+    ack_ms = []
+    ack_lock = threading.Lock()
+
+    def send_farmer(farmer):
+        sender = f"+9198450{farmer:05d}"
+        for i in range(args.messages):
+            message = {"channel": args.channel, "sender": sender,
+                       "text": QUESTIONS[(farmer + i) % len(QUESTIONS)],
+                       "message_id": f"{run}-{farmer}-{i}"}
+            for _ in range(2 if args.redeliver else 1):
+                started = time.perf_counter()
+                resp = session.post(url, json=message, headers=headers,
+                                    timeout=10)
+                resp.raise_for_status()
+                with ack_lock:
+                    ack_ms.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(send_farmer, range(args.farmers)))
+    burst_seconds = time.perf_counter() - started
+    print(f"sent {len(ack_ms)} webhooks in {burst_seconds:.2f}s; ack p50 "
+          f"{percentile(ack_ms, 50):.1f} ms, p95 {percentile(ack_ms, 95):.1f} "
+          f"ms, max {max(ack_ms):.1f} ms")
+
+    # A farmer is done once a reply covers their last message
+    last_id = {f"+9198450{f:05d}": f"{run}-{f}-{args.messages - 1}"
+               for f in range(args.farmers)}
+    deadline = time.perf_counter() + args.timeout
+    while time.perf_counter() < deadline:
+        with replies.lock:
+            done = sum(1 for r, last in last_id.items()
+                       if any(i == last for _, i in
+                              replies.by_recipient.get(r, ())))
+        if done == len(last_id):
+            break
+        replies.arrived.wait(1)
+        replies.arrived.clear()
+    drained = time.perf_counter() - started
+
+    out_of_order = 0
+    reply_count = 0
+    for recipient, received in replies.by_recipient.items():
+        reply_count += len(received)
+        order = [int(i.rsplit('-', 1)[1]) for _, i in received]
+        out_of_order += sum(1 for a, b in zip(order, order[1:]) if b <= a)
+    print(f"{done}/{len(last_id)} farmers answered in {drained:.1f}s with "
+          f"{reply_count} replies ({args.farmers * args.messages} messages); "
+          f"{out_of_order} out of order")
+    first_reply = [received[0][0] - started
+                   for received in replies.by_recipient.values()]
+    if first_reply:
+        print(f"first reply per farmer: median "
+              f"{statistics.median(first_reply):.1f}s, max "
+              f"{max(first_reply):.1f}s")
+    try:
+        stats = session.get(f"{args.target}/api/metrics/messaging",
+                            timeout=5).json()
+        print(f"backend: {json.dumps(stats)}")
+    except requests.RequestException:
+        pass
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""
+Circuit breakers for external dependencies.
+
+Each dependency (WeatherAPI, the Gemini APIs, Firestore) has a named
+breaker. While the failure rate over the recent window stays below the
+threshold the breaker is closed and calls go through. Above it the
+breaker opens and calls fail at once with CircuitOpenError instead of
+waiting for the dependency to time out; after a cool-down a few probe
+calls are let through (half-open) and their outcome closes or re-opens
+the breaker.
+
+LastKnownGood keeps the latest successful result per key, so callers
+that can live with old data (weather, profiles) answer from it with a
+staleness flag while the dependency is down.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from concurrency_limits import QueueTimeout
+from deadlines import RequestDeadlineExceeded
+
+load_dotenv()
+
+BREAKER_FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', 0.5))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', 5))
+BREAKER_WINDOW_SECONDS = float(os.getenv('BREAKER_WINDOW_SECONDS', 60))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', 30))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv('BREAKER_HALF_OPEN_PROBES', 1))
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """The dependency's breaker is open; the call was not attempted"""
+
+
+def is_dependency_failure(exc: Exception) -> bool:
+    """Whether an error says the dependency is unhealthy. Rejected calls
+    (4xx other than timeouts/throttling), waits on our own limiter and
+    the request running out of its own time do not."""
+    if isinstance(exc, (QueueTimeout, RequestDeadlineExceeded)):
+        return False
+    code = getattr(exc, 'code', None) or getattr(exc, 'status_code', None)
+    return not isinstance(code, int) or code >= 500 or code in (408, 429)
+
+
+class CircuitBreaker:
+    """Failure-rate breaker over a sliding time window"""
+
+    def __init__(self, name: str,
+                 failure_rate: float = BREAKER_FAILURE_RATE,
+                 min_calls: int = BREAKER_MIN_CALLS,
+                 window_seconds: float = BREAKER_WINDOW_SECONDS,
+                 open_seconds: float = BREAKER_OPEN_SECONDS,
+                 half_open_probes: int = BREAKER_HALF_OPEN_PROBES):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self._results = deque()  # (time, succeeded)
+        self._opened_at = 0.0
+        self._probes = 0
+        self._rejected = 0
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now (counts half-open probes)"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now - self._opened_at < self.open_seconds:
+                    self._rejected += 1
+                    return False
+                self.state = HALF_OPEN
+                self._opened_at = now
+                self._probes = 0
+            if self.state == HALF_OPEN:
+                # Probes whose outcome never got recorded (e.g. cancelled
+                # calls) must not keep the breaker half-open forever
+                if now - self._opened_at >= self.open_seconds:
+                    self._opened_at = now
+                    self._probes = 0
+                if self._probes >= self.half_open_probes:
+                    self._rejected += 1
+                    return False
+                self._probes += 1
+            return True
+
+    def is_open(self) -> bool:
+        """Whether calls are currently being rejected (no side effects)"""
+        with self._lock:
+            return (self.state == OPEN and
+                    time.monotonic() - self._opened_at < self.open_seconds)
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state == HALF_OPEN:
+                print(f"DEBUG: Circuit {self.name} closed")
+                self.state = CLOSED
+                self._results.clear()
+            self._add(True)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._trip()
+                return
+            self._add(False)
+            failures = sum(1 for _, ok in self._results if not ok)
+            if (self.state == CLOSED and len(self._results) >= self.min_calls
+                    and failures / len(self._results) >= self.failure_rate):
+                self._trip()
+
+    def call(self, func: Callable[..., Any], *args,
+             is_failure: Callable[[Exception], bool] = None,
+             **kwargs) -> Any:
+        """Run func through the breaker.
+
+        `is_failure(exc)` decides whether an exception counts against the
+        dependency (e.g. a 404 does not); by default every one does.
+        """
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if is_failure is None or is_failure(e):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._prune(time.monotonic())
+            failures = sum(1 for _, ok in self._results if not ok)
+            return {
+                "state": self.state,
+                "window_calls": len(self._results),
+                "window_failures": failures,
+                "times_opened": self._opened,
+                "rejected_calls": self._rejected,
+            }
+
+    def _add(self, succeeded: bool) -> None:
+        now = time.monotonic()
+        self._results.append((now, succeeded))
+        self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        while self._results and self._results[0][0] < now - self.window_seconds:
+            self._results.popleft()
+
+    def _trip(self) -> None:
+        print(f"DEBUG: Circuit {self.name} opened")
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._opened += 1
+        self._results.clear()
+
+
+class LastKnownGood:
+    """Latest successful result per key, bounded LRU"""
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._values[key] = (value, time.time())
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        """(value, age in seconds) or None"""
+        with self._lock:
+            entry = self._values.get(key)
+        if entry is None:
+            return None
+        return entry[0], time.time() - entry[1]
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Return the process-wide breaker for dependency `name`"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def get_breaker_stats() -> Dict[str, Dict[str, Any]]:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
@@ -0,0 +1,355 @@
+"""
+Adaptive concurrency limits for outbound calls.
+
+Each upstream (every Gemini model the agents call, the genai API used by
+Vaidya, WeatherAPI) has a limiter that caps the calls in flight. The cap
+follows AIMD: it grows by about one per round of calls that finish
+normally and is cut by LIMIT_BACKOFF when the upstream signals overload
+(429, 503, timeouts) or when recent latency rises above
+LIMIT_LATENCY_TOLERANCE times its long-run average, i.e. requests are
+queueing upstream. Cuts happen at most once per latency period, so one
+burst of 429s cuts the cap once rather than collapsing it.
+
+Calls over the cap wait in a queue per request class and are let through
+in weighted round-robin (LIMIT_CLASS_WEIGHTS), so nightly precompute and
+background jobs cannot crowd out farmers waiting for an answer. A wait
+never outlasts the request's deadline.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+from deadlines import DeadlineExceeded, time_left
+from request_context import current_request
+
+load_dotenv()
+
+LIMITS_ENABLED = os.getenv('CONCURRENCY_LIMITS_ENABLED', 'true').lower() != 'false'
+LIMIT_INITIAL = float(os.getenv('LIMIT_INITIAL', 8))
+LIMIT_MIN = float(os.getenv('LIMIT_MIN', 1))
+LIMIT_MAX = float(os.getenv('LIMIT_MAX', 64))
+# Multiplicative decrease on overload
+LIMIT_BACKOFF = float(os.getenv('LIMIT_BACKOFF', 0.7))
+# Recent latency above this multiple of the long-run average is overload
+LIMIT_LATENCY_TOLERANCE = float(os.getenv('LIMIT_LATENCY_TOLERANCE', 2.0))
+# Longest wait for a slot outside a request with a deadline
+LIMIT_MAX_WAIT_SECONDS = float(os.getenv('LIMIT_MAX_WAIT_SECONDS', 30))
+# Slots granted to a class per turn of the round-robin
+LIMIT_CLASS_WEIGHTS = {
+    name.strip(): int(weight)
+    for name, _, weight in (
+        item.partition('=') for item in os.getenv(
+            'LIMIT_CLASS_WEIGHTS', 'interactive=4,background=1').split(','))
+    if name.strip()
+}
+# Smoothing of the short and long latency averages
+_SHORT_ALPHA = 0.2
+_LONG_ALPHA = 0.02
+# Calls seen before latency is trusted as an overload signal
+_WARMUP_CALLS = 20
+
+INTERACTIVE, BACKGROUND = 'interactive', 'background'
+
+
+class QueueTimeout(DeadlineExceeded):
+    """No slot for the call freed up in time"""
+
+
+def is_overload(exc: BaseException) -> bool:
+    """Whether an error says the upstream is overloaded rather than that
+    the call itself was bad"""
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError)) \
+            and not isinstance(exc, QueueTimeout):
+        return True
+    code = getattr(exc, 'code', None) or getattr(exc, 'status_code', None)
+    return code in (429, 503) or type(exc).__name__ in (
+        'ResourceExhausted', 'ServiceUnavailable', 'Timeout',
+        'ReadTimeout', 'ConnectTimeout')
+
+
+def current_class() -> str:
+    """Request class of the running code: farmer queries are interactive,
+    everything without a request (jobs, nightly runs) is background"""
+    context = current_request()
+    if context is None:
+        return BACKGROUND
+    return getattr(context, 'request_class', INTERACTIVE)
+
+
+class _Waiter:
+    __slots__ = ('event', 'loop', 'future', 'granted')
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.future = loop.create_future() if loop else None
+        self.event = None if loop else threading.Event()
+        self.granted = False
+
+    def grant(self) -> None:
+        self.granted = True
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._resolve)
+        else:
+            self.event.set()
+
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit with fair queueing between request classes"""
+
+    def __init__(self, name: str, initial: float = LIMIT_INITIAL,
+                 min_limit: float = LIMIT_MIN, max_limit: float = LIMIT_MAX,
+                 weights: Optional[Dict[str, int]] = None):
+        self.name = name
+        self.limit = max(min_limit, min(initial, max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.weights = dict(weights or LIMIT_CLASS_WEIGHTS) or {INTERACTIVE: 1}
+        self.in_flight = 0
+        self._queues: Dict[str, deque] = {c: deque() for c in self.weights}
+        self._order = list(self.weights)
+        self._turn = 0
+        self._credit = self.weights[self._order[0]]
+        self._short = None
+        self._long = None
+        self._last_cut = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "queued": 0, "queue_timeouts": 0,
+                       "overloads": 0, "latency_cuts": 0, "cuts": 0,
+                       "peak_in_flight": 0, "queued_by_class": {}}
+
+    # Slots
+
+    def _queue(self, request_class: str) -> deque:
+        queue = self._queues.get(request_class)
+        if queue is None:
+            queue = self._queues[request_class] = deque()
+            self.weights.setdefault(request_class, 1)
+            self._order.append(request_class)
+        return queue
+
+    def _take(self) -> None:
+        self.in_flight += 1
+        self._stats["calls"] += 1
+        self._stats["peak_in_flight"] = max(self._stats["peak_in_flight"],
+                                            self.in_flight)
+
+    def _try_enter(self, request_class: str, waiter: _Waiter) -> bool:
+        """Take a slot at once, or queue `waiter` for one"""
+        with self._lock:
+            if self.in_flight < int(self.limit) and not any(self._queues.values()):
+                self._take()
+                return True
+            self._queue(request_class).append(waiter)
+            self._stats["queued"] += 1
+            by_class = self._stats["queued_by_class"]
+            by_class[request_class] = by_class.get(request_class, 0) + 1
+            return False
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        """Weighted round-robin over the classes with waiters"""
+        for _ in range(len(self._order) + 1):
+            queue = self._queues[self._order[self._turn]]
+            if queue and self._credit > 0:
+                self._credit -= 1
+                return queue.popleft()
+            self._turn = (self._turn + 1) % len(self._order)
+            self._credit = self.weights[self._order[self._turn]]
+        return None
+
+    def _dispatch(self) -> None:
+        """Hand free slots to waiters; call with the lock held"""
+        while self.in_flight < int(self.limit):
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            self._take()
+            waiter.grant()
+
+    def _give_up(self, request_class: str, waiter: _Waiter) -> bool:
+        """Leave the queue after a timeout; False when the slot was
+        granted meanwhile and must be used (or released)"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._queue(request_class).remove(waiter)
+            self._stats["queue_timeouts"] += 1
+            return True
+
+    def _timeout(self, timeout: Optional[float]) -> float:
+        if timeout is not None:
+            return timeout
+        left = time_left()
+        return LIMIT_MAX_WAIT_SECONDS if left is None else max(0.0, left)
+
+    def acquire(self, timeout: Optional[float] = None,
+                request_class: Optional[str] = None) -> None:
+        """Block until a slot is free. Raises QueueTimeout."""
+        request_class = request_class or current_class()
+        waiter = _Waiter()
+        if self._try_enter(request_class, waiter):
+            return
+        timeout = self._timeout(timeout)
+        if not waiter.event.wait(timeout) \
+                and self._give_up(request_class, waiter):
+            raise QueueTimeout(
+                f"{self.name}: no free slot within {timeout:.1f}s")
+
+    async def acquire_async(self, timeout: Optional[float] = None,
+                            request_class: Optional[str] = None) -> None:
+        """Wait (without blocking the event loop) until a slot is free"""
+        request_class = request_class or current_class()
+        waiter = _Waiter(asyncio.get_running_loop())
+        if self._try_enter(request_class, waiter):
+            return
+        timeout = self._timeout(timeout)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            # A slot granted just as the wait timed out is kept
+            if self._give_up(request_class, waiter):
+                raise QueueTimeout(
+                    f"{self.name}: no free slot within {timeout:.1f}s")
+        except asyncio.CancelledError:
+            if not self._give_up(request_class, waiter):
+                self.release(None, overloaded=False)
+            raise
+
+    def release(self, latency: Optional[float], overloaded: bool) -> None:
+        """Return a slot and adjust the limit from the call's outcome.
+        `latency` is None for calls that did not complete."""
+        with self._lock:
+            self.in_flight -= 1
+            if overloaded:
+                self._stats["overloads"] += 1
+                self._cut(latency)
+            elif latency is not None:
+                self._observe(latency)
+            self._dispatch()
+
+    # AIMD
+
+    def _observe(self, latency: float) -> None:
+        if self._short is None:
+            self._short = self._long = latency
+        else:
+            self._short += _SHORT_ALPHA * (latency - self._short)
+            self._long += _LONG_ALPHA * (latency - self._long)
+        if self._stats["calls"] >= _WARMUP_CALLS and \
+                self._short > LIMIT_LATENCY_TOLERANCE * self._long:
+            if self._cut(latency):
+                self._stats["latency_cuts"] += 1
+            return
+        # Only grow a limit that is being used; an idle upstream tells
+        # nothing about how much more it could take
+        if self.in_flight + 1 >= int(self.limit):
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def _cut(self, latency: Optional[float]) -> bool:
+        now = time.monotonic()
+        # Calls of the same latency period report the same overload
+        if now - self._last_cut < max(self._long or 0.0, latency or 0.0, 0.1):
+            return False
+        self._last_cut = now
+        self.limit = max(self.min_limit, self.limit * LIMIT_BACKOFF)
+        self._stats["cuts"] += 1
+        return True
+
+    # Wrappers
+
+    @contextmanager
+    def slot(self, is_overload: Callable[[BaseException], bool] = is_overload,
+             timeout: Optional[float] = None):
+        """Hold a slot for the enclosed call and learn from its outcome.
+        Waits up to `timeout` (default: the request's time left)."""
+        self.acquire(timeout)
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self.release(None, overloaded=isinstance(e, Exception)
+                         and is_overload(e))
+            raise
+        self.release(time.monotonic() - started, overloaded=False)
+
+    @asynccontextmanager
+    async def slot_async(self, is_overload: Callable[[BaseException], bool]
+                         = is_overload):
+        await self.acquire_async()
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self.release(None, overloaded=isinstance(e, Exception)
+                         and is_overload(e))
+            raise
+        self.release(time.monotonic() - started, overloaded=False)
+
+    def call(self, func: Callable[..., Any], *args,
+             is_overload: Callable[[BaseException], bool] = is_overload,
+             **kwargs) -> Any:
+        with self.slot(is_overload):
+            return func(*args, **kwargs)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "waiting": {c: len(q) for c, q in self._queues.items() if q},
+                "latency_short_ms": round(self._short * 1000, 1)
+                if self._short is not None else None,
+                "latency_long_ms": round(self._long * 1000, 1)
+                if self._long is not None else None,
+                **{k: dict(v) if isinstance(v, dict) else v
+                   for k, v in self._stats.items()},
+            }
+
+
+class _Unlimited:
+    """Stand-in when limits are disabled"""
+
+    @contextmanager
+    def slot(self, is_overload=None, timeout=None):
+        yield
+
+    @asynccontextmanager
+    async def slot_async(self, is_overload=None):
+        yield
+
+    def call(self, func, *args, is_overload=None, **kwargs):
+        return func(*args, **kwargs)
+
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str):
+    """Return the process-wide limiter for upstream `name`"""
+    if not LIMITS_ENABLED:
+        return _Unlimited()
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = AdaptiveLimiter(name)
+        return _limiters[name]
+
+
+def get_limiter_stats() -> Dict[str, Any]:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {
+        "enabled": LIMITS_ENABLED,
+        "class_weights": LIMIT_CLASS_WEIGHTS,
+        "limiters": {l.name: l.snapshot() for l in limiters},
+    }
@@ -8,6 +8,16 @@ class Config:
     """Base configuration class"""
     SECRET_KEY = os.environ.get('SECRET_KEY') or \
         'dev-secret-key-change-in-production'
+    # Bearer token for the /api/debug endpoints; unset disables them
+    DEBUG_API_TOKEN = os.environ.get('DEBUG_API_TOKEN')
+    # Shared secret messaging gateways send in X-Gateway-Token; unset
+    # refuses webhooks, except in development and testing
+    MESSAGING_WEBHOOK_TOKEN = os.environ.get('MESSAGING_WEBHOOK_TOKEN')
+    MESSAGING_ALLOW_UNAUTHENTICATED = False
+    # Largest request body; fits a full-size media chunk or a query with
+    # legacy base64 images
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH',
+                                            32 * 1024 ** 2))
     DEBUG = False
     TESTING = False
 
@@ -16,6 +26,7 @@ class DevelopmentConfig(Config):
     """Development configuration"""
     DEBUG = True
     FLASK_ENV = 'development'
+    MESSAGING_ALLOW_UNAUTHENTICATED = True
 
 
 class ProductionConfig(Config):
@@ -28,6 +39,7 @@ class TestingConfig(Config):
     """Testing configuration"""
     TESTING = True
     DEBUG = True
+    MESSAGING_ALLOW_UNAUTHENTICATED = True
 
 
 # Configuration dictionary
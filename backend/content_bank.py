@@ -0,0 +1,202 @@
+"""
+Content bank for Shikshak: educational content generated once per farmer
+segment and topic, and reused for everyone in the segment.
+
+Entries are keyed by (segment, kind, topic) where kind is e.g. 'quiz',
+'guide' or 'video_plan:<language>:<duration>'. Generated content may carry placeholders such as
+{city} or {crop}; `personalize` fills them in from the asking farmer's
+profile, so a request is a lookup plus light templating. Concurrent misses
+for the same key generate the content once.
+"""
+
+import copy
+import json
+import os
+import sqlite3
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from precompute import normalize_intent
+
+load_dotenv()
+
+CONTENT_BANK_ENABLED = os.getenv('CONTENT_BANK_ENABLED', 'true').lower() != 'false'
+CONTENT_BANK_DB_PATH = os.getenv(
+    'CONTENT_BANK_DB_PATH',
+    os.path.join(os.path.dirname(__file__), 'var', 'content_bank.sqlite3'))
+# Content older than this is generated again on the next request
+CONTENT_BANK_MAX_AGE_DAYS = float(os.getenv('CONTENT_BANK_MAX_AGE_DAYS', 30))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS content_bank (
+    segment_key TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    topic_key TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (segment_key, kind, topic_key)
+) WITHOUT ROWID;
+"""
+
+
+class _Blank(dict):
+    def __missing__(self, key):
+        return '{' + key + '}'
+
+
+def _fill(value: Any, fields: Dict[str, str]) -> Any:
+    if isinstance(value, str):
+        if '{' not in value:
+            return value
+        try:
+            return value.format_map(fields)
+        except (ValueError, IndexError):
+            return value
+    if isinstance(value, dict):
+        return {k: _fill(v, fields) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_fill(v, fields) for v in value]
+    return value
+
+
+def personalize(content: Dict[str, Any], profile: Any) -> Dict[str, Any]:
+    """Copy of `content` with {city}, {state}, {crop} and {language}
+    filled in from a farmer profile (a FarmerResponse or a dict)"""
+    def field(name, default=''):
+        if isinstance(profile, dict):
+            return profile.get(name) or default
+        return getattr(profile, name, None) or default
+
+    crops = field('crops', [])
+    fields = _Blank(
+        city=field('city', 'your area'),
+        state=field('state', 'your state'),
+        crop=crops[0] if crops else 'your crop',
+        language=field('native_language', 'Kannada'),
+    )
+    return _fill(copy.deepcopy(content), fields)
+
+
+class ContentBank:
+    """SQLite table of generated content per segment and topic"""
+
+    def __init__(self, path: str = CONTENT_BANK_DB_PATH,
+                 max_age_days: float = CONTENT_BANK_MAX_AGE_DAYS):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_age = timedelta(days=max_age_days)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._stats = Counter()
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(_SCHEMA)
+
+    def get(self, segment_key: str, kind: str,
+            topic: str) -> Optional[Dict[str, Any]]:
+        """Banked content, or None when missing or too old"""
+        content = self._read((segment_key, kind, normalize_intent(topic)))
+        with self._lock:
+            self._stats['hits' if content is not None else 'misses'] += 1
+        return content
+
+    def _read(self, key: Tuple[str, str, str]) -> Optional[Dict[str, Any]]:
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT content, created_at FROM content_bank "
+                "WHERE segment_key = ? AND kind = ? AND topic_key = ?",
+                key).fetchone()
+            if row is None or (datetime.now(timezone.utc)
+                               - datetime.fromisoformat(row['created_at'])
+                               > self.max_age):
+                return None
+            self._conn.execute(
+                "UPDATE content_bank SET hits = hits + 1 "
+                "WHERE segment_key = ? AND kind = ? AND topic_key = ?", key)
+        return json.loads(row['content'])
+
+    def put(self, segment_key: str, kind: str, topic: str,
+            content: Dict[str, Any]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO content_bank (segment_key, kind, "
+                "topic_key, topic, content, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (segment_key, kind, normalize_intent(topic), topic,
+                 json.dumps(content),
+                 datetime.now(timezone.utc).isoformat()))
+            self._stats['stored'] += 1
+
+    def get_or_create(self, segment_key: str, kind: str, topic: str,
+                      generate: Callable[[], Dict[str, Any]]
+                      ) -> Tuple[Dict[str, Any], bool]:
+        """Banked content and whether it came from the bank; on a miss
+        `generate` runs once however many requests are waiting for it"""
+        content = self.get(segment_key, kind, topic)
+        if content is not None:
+            return content, True
+        key = (segment_key, kind, normalize_intent(topic))
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                # Another request may have generated it meanwhile
+                content = self._read(key)
+                if content is not None:
+                    return content, True
+                content = generate()
+                self.put(segment_key, kind, topic, content)
+                with self._lock:
+                    self._stats['generated'] += 1
+                return content, False
+        finally:
+            with self._lock:
+                self._key_locks.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._stats)
+            by_kind = {row['kind']: {"entries": row['entries'],
+                                     "segments": row['segments'],
+                                     "hits": row['hits']}
+                       for row in self._conn.execute(
+                           "SELECT kind, COUNT(*) AS entries, "
+                           "COUNT(DISTINCT segment_key) AS segments, "
+                           "SUM(hits) AS hits FROM content_bank GROUP BY kind")}
+        lookups = counters.get('hits', 0) + counters.get('misses', 0)
+        return {
+            "enabled": CONTENT_BANK_ENABLED,
+            "hit_rate": round(counters.get('hits', 0) / lookups, 3)
+            if lookups else 0.0,
+            "by_kind": by_kind,
+            **counters,
+        }
+
+
+_bank = None
+_init_lock = threading.Lock()
+
+
+def get_content_bank() -> Optional[ContentBank]:
+    """Return the process-wide content bank, None when disabled"""
+    global _bank
+    if not CONTENT_BANK_ENABLED:
+        return None
+    with _init_lock:
+        if _bank is None:
+            _bank = ContentBank()
+        return _bank
+
+
+def get_content_bank_stats() -> Dict[str, Any]:
+    bank = get_content_bank()
+    if bank is None:
+        return {"enabled": False}
+    return bank.stats()
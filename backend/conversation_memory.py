@@ -0,0 +1,435 @@
+"""
+Conversation memory: what the farmer told us in earlier queries, within
+a fixed prompt budget.
+
+Every query runs in a fresh ADK session, so on its own each question
+starts from nothing. This layer keeps, per farmer:
+
+- the most recent turns verbatim,
+- a running summary of the older ones, compacted off the request path by
+  a job on the job queue (Gemini, or an extractive fallback),
+- facts pulled from the farmer's questions (crops, place, field size,
+  symptoms) as a small structured record.
+
+context_note() renders facts, summary and recent turns newest first into
+a note sent with the question, cut to MEMORY_TOKEN_BUDGET tokens however
+long the conversation gets. Turns folded into the summary are deleted,
+and conversations idle for MEMORY_TTL_DAYS start over.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from gazetteer import get_gazetteer
+from job_queue import get_job_queue, register_handler
+from token_accounting import CHARS_PER_TOKEN, estimate_tokens
+
+load_dotenv()
+
+MEMORY_ENABLED = os.getenv('CONVERSATION_MEMORY_ENABLED', 'true').lower() != 'false'
+MEMORY_DB_PATH = os.getenv(
+    'CONVERSATION_MEMORY_DB_PATH',
+    os.path.join(os.path.dirname(__file__), 'var', 'conversations.sqlite3'))
+# Tokens the whole memory note may take in the prompt
+MEMORY_TOKEN_BUDGET = int(os.getenv('MEMORY_TOKEN_BUDGET', 600))
+MEMORY_SUMMARY_TOKENS = int(os.getenv('MEMORY_SUMMARY_TOKENS', 200))
+# Turns kept verbatim; older ones are folded into the summary
+MEMORY_RECENT_TURNS = int(os.getenv('MEMORY_RECENT_TURNS', 4))
+# Longest part of one answer quoted back in the note
+MEMORY_ANSWER_TOKENS = int(os.getenv('MEMORY_ANSWER_TOKENS', 120))
+MEMORY_TTL_DAYS = float(os.getenv('MEMORY_TTL_DAYS', 30))
+MEMORY_SUMMARY_MODEL = os.getenv(
+    'MEMORY_SUMMARY_MODEL', os.getenv('MODEL_TIER_FAST', 'gemini-2.0-flash-lite'))
+MAX_CROPS = 3
+
+SUMMARY_JOB_KIND = 'conversation_summary'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    farmer_id TEXT PRIMARY KEY,
+    summary TEXT NOT NULL DEFAULT '',
+    summary_through INTEGER NOT NULL DEFAULT 0,
+    facts TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    farmer_id TEXT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS turns_farmer ON turns (farmer_id, id);
+"""
+
+# Canonical crop -> names farmers use (English, Hindi, Kannada)
+CROP_NAMES = {
+    'tomato': ['tomato', 'tomatoes', 'tamatar', 'टमाटर', 'ಟೊಮೇಟೊ', 'ಟೊಮ್ಯಾಟೊ'],
+    'paddy': ['paddy', 'rice', 'dhan', 'धान', 'चावल', 'ಭತ್ತ'],
+    'ragi': ['ragi', 'finger millet', 'रागी', 'ರಾಗಿ'],
+    'maize': ['maize', 'corn', 'makka', 'मक्का', 'ಮೆಕ್ಕೆಜೋಳ'],
+    'jowar': ['jowar', 'sorghum', 'ज्वार', 'ಜೋಳ'],
+    'wheat': ['wheat', 'gehu', 'gehun', 'गेहूं', 'गेहूँ', 'ಗೋಧಿ'],
+    'onion': ['onion', 'onions', 'pyaz', 'प्याज', 'ಈರುಳ್ಳಿ'],
+    'potato': ['potato', 'potatoes', 'aloo', 'आलू', 'ಆಲೂಗಡ್ಡೆ'],
+    'chilli': ['chilli', 'chili', 'mirchi', 'मिर्च', 'ಮೆಣಸಿನಕಾಯಿ'],
+    'cotton': ['cotton', 'kapas', 'कपास', 'ಹತ್ತಿ'],
+    'sugarcane': ['sugarcane', 'ganna', 'गन्ना', 'ಕಬ್ಬು'],
+    'groundnut': ['groundnut', 'peanut', 'moongphali', 'मूंगफली', 'ಶೇಂಗಾ',
+                  'ಕಡಲೆಕಾಯಿ'],
+    'tur': ['tur', 'toor', 'arhar', 'pigeon pea', 'अरहर', 'ತೊಗರಿ'],
+    'soybean': ['soybean', 'soya', 'सोयाबीन'],
+    'banana': ['banana', 'kela', 'केला', 'ಬಾಳೆ'],
+    'mango': ['mango', 'aam', 'आम', 'ಮಾವು'],
+    'coconut': ['coconut', 'nariyal', 'नारियल', 'ತೆಂಗು'],
+    'arecanut': ['arecanut', 'areca', 'supari', 'सुपारी', 'ಅಡಿಕೆ'],
+    'coffee': ['coffee', 'कॉफी', 'ಕಾಫಿ'],
+}
+SYMPTOM_NAMES = {
+    'yellowing leaves': ['yellow', 'पीले', 'पीली', 'ಹಳದಿ'],
+    'leaf spots': ['spot', 'spots', 'धब्बे', 'ಚುಕ್ಕೆ'],
+    'wilting': ['wilt', 'wilting', 'मुरझा', 'ಬಾಡು', 'ಬಾಡಿ'],
+    'leaf curl': ['curl', 'curling', 'मुड़', 'ಮುರುಟು'],
+    'pests': ['pest', 'pests', 'insect', 'insects', 'worm', 'worms', 'aphid',
+              'aphids', 'whitefly', 'caterpillar', 'कीड़े', 'कीट', 'ಕೀಟ', 'ಹುಳು'],
+    'rot': ['rot', 'rotting', 'सड़', 'ಕೊಳೆ'],
+    'fungus': ['fungus', 'fungal', 'mildew', 'फफूंद', 'ಶಿಲೀಂಧ್ರ'],
+}
+_FIELD_SIZE = re.compile(
+    r'(\d+(?:\.\d+)?)\s*(acres?|ekar|एकड़|ಎಕರೆ|hectares?|ha\b|guntas?|'
+    r'gunthas?|ಗುಂಟೆ|bighas?|बीघा)', re.IGNORECASE)
+
+
+def _alias_patterns(names: Dict[str, List[str]]) -> List[Tuple[re.Pattern, str]]:
+    """Longest alias first, so 'ಮೆಕ್ಕೆಜೋಳ' is maize before 'ಜೋಳ' is jowar.
+    Latin aliases match whole words; Indic ones also match inflected
+    words ('ಟೊಮೇಟೊಗೆ')."""
+    patterns = []
+    for canonical, aliases in names.items():
+        for alias in aliases:
+            pattern = (rf'\b{re.escape(alias)}\b' if alias.isascii()
+                       else re.escape(alias))
+            patterns.append((re.compile(pattern, re.IGNORECASE), canonical))
+    return sorted(patterns, key=lambda p: -len(p[0].pattern))
+
+
+_CROP_PATTERNS = _alias_patterns(CROP_NAMES)
+_SYMPTOM_PATTERNS = _alias_patterns(SYMPTOM_NAMES)
+
+
+def _mentions(text: str, patterns) -> List[str]:
+    found = []
+    for pattern, canonical in patterns:
+        if pattern.search(text):
+            text = pattern.sub(' ', text)
+            if canonical not in found:
+                found.append(canonical)
+    return found
+
+
+def extract_facts(question: str, state: Optional[str] = None) -> Dict[str, Any]:
+    """Crops, place, field size and symptoms the farmer mentioned"""
+    facts = {}
+    crops = _mentions(question, _CROP_PATTERNS)
+    if crops:
+        facts['crops'] = crops
+    places = get_gazetteer().find_places(question, state)
+    if places:
+        facts['place'] = places[0].name
+        facts['state'] = places[0].state
+    size = _FIELD_SIZE.search(question)
+    if size:
+        facts['field_size'] = f"{size.group(1)} {size.group(2)}"
+    symptoms = _mentions(question, _SYMPTOM_PATTERNS)
+    if symptoms:
+        facts['symptoms'] = symptoms
+    return facts
+
+
+def merge_facts(known: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Newer facts win; crops accumulate, most recent first"""
+    merged = {**known, **new}
+    if 'crops' in new:
+        merged['crops'] = list(dict.fromkeys(
+            new['crops'] + known.get('crops', [])))[:MAX_CROPS]
+    return merged
+
+
+def render_facts(facts: Dict[str, Any]) -> str:
+    parts = []
+    if facts.get('crops'):
+        parts.append(f"crops {', '.join(facts['crops'])}")
+    if facts.get('place'):
+        parts.append(f"place {facts['place']}, {facts.get('state', '')}".rstrip(', '))
+    if facts.get('field_size'):
+        parts.append(f"field {facts['field_size']}")
+    if facts.get('symptoms'):
+        parts.append(f"problem {', '.join(facts['symptoms'])}")
+    return '; '.join(parts)
+
+
+def _clip(text: str, tokens: int) -> str:
+    """`text` cut to about `tokens` tokens"""
+    limit = max(0, tokens) * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    return text[:max(0, limit - 1)].rstrip() + '…'
+
+
+def _turn_text(question: str, answer: str) -> str:
+    return (f"Farmer: {_clip(question.strip(), MEMORY_ANSWER_TOKENS)}\n"
+            f"Mitra: {_clip(answer.strip(), MEMORY_ANSWER_TOKENS)}")
+
+
+class ConversationMemory:
+    """SQLite store of turns, summaries and facts per farmer"""
+
+    def __init__(self, path: str = MEMORY_DB_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._stats = Counter()
+        self._note_tokens = 0
+        self._max_note_tokens = 0
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(_SCHEMA)
+
+    def _conversation(self, farmer_id: str) -> Optional[sqlite3.Row]:
+        row = self._conn.execute(
+            "SELECT * FROM conversations WHERE farmer_id = ?",
+            (farmer_id,)).fetchone()
+        if row is not None and \
+                time.time() - row['updated_at'] > MEMORY_TTL_DAYS * 86400:
+            return None
+        return row
+
+    def context_note(self, farmer_id: str,
+                     budget: int = MEMORY_TOKEN_BUDGET) -> Optional[str]:
+        """Facts, summary and the most recent turns within `budget`
+        tokens, or None for a new conversation"""
+        with self._lock:
+            conversation = self._conversation(farmer_id)
+            if conversation is None:
+                return None
+            turns = self._conn.execute(
+                "SELECT question, answer FROM turns WHERE farmer_id = ? "
+                "AND id > ? ORDER BY id DESC LIMIT ?",
+                (farmer_id, conversation['summary_through'],
+                 2 * MEMORY_RECENT_TURNS)).fetchall()
+        header = ("Earlier in this conversation with the farmer (use it for "
+                  "follow-up questions; the new question wins where they "
+                  "differ)")
+        sections = [header + ':']
+        left = budget - estimate_tokens(header) - 1
+        facts = render_facts(json.loads(conversation['facts']))
+        if facts:
+            line = _clip(f"Known: {facts}.", left)
+            sections.append(line)
+            left -= estimate_tokens(line) + 1
+        if conversation['summary']:
+            line = _clip(f"Summary: {conversation['summary']}",
+                         min(left, MEMORY_SUMMARY_TOKENS))
+            sections.append(line)
+            left -= estimate_tokens(line) + 1
+        recent = []
+        for turn in turns:
+            text = _turn_text(turn['question'], turn['answer'])
+            if estimate_tokens(text) + 1 > left:
+                if not recent and left > 20:
+                    recent.append(_clip(text, left - 1))
+                break
+            recent.append(text)
+            left -= estimate_tokens(text) + 1
+        sections.extend(reversed(recent))
+        if len(sections) == 1:
+            return None
+        note = '\n'.join(sections)
+        tokens = estimate_tokens(note)
+        with self._lock:
+            self._stats['notes'] += 1
+            self._note_tokens += tokens
+            self._max_note_tokens = max(self._max_note_tokens, tokens)
+        return note
+
+    def record_turn(self, farmer_id: str, question: str, answer: str,
+                    state: Optional[str] = None) -> int:
+        """Store a finished turn, update the facts and queue a summary
+        once twice the recent window has piled up"""
+        now = time.time()
+        new_facts = extract_facts(question, state)
+        with self._lock, self._conn:
+            conversation = self._conversation(farmer_id)
+            if conversation is None:
+                # New or expired: start over
+                self._conn.execute(
+                    "DELETE FROM turns WHERE farmer_id = ?", (farmer_id,))
+                facts = {}
+            else:
+                facts = json.loads(conversation['facts'])
+            facts = merge_facts(facts, new_facts)
+            cursor = self._conn.execute(
+                "INSERT INTO turns (farmer_id, question, answer, created_at) "
+                "VALUES (?, ?, ?, ?)", (farmer_id, question, answer, now))
+            turn_id = cursor.lastrowid
+            if conversation is None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO conversations (farmer_id, facts, "
+                    "updated_at) VALUES (?, ?, ?)",
+                    (farmer_id, json.dumps(facts, ensure_ascii=False), now))
+                summary_through = 0
+            else:
+                self._conn.execute(
+                    "UPDATE conversations SET facts = ?, updated_at = ? "
+                    "WHERE farmer_id = ?",
+                    (json.dumps(facts, ensure_ascii=False), now, farmer_id))
+                summary_through = conversation['summary_through']
+            pending = self._conn.execute(
+                "SELECT id FROM turns WHERE farmer_id = ? AND id > ? "
+                "ORDER BY id DESC", (farmer_id, summary_through)).fetchall()
+            self._stats['turns'] += 1
+        if (len(pending) >= 2 * MEMORY_RECENT_TURNS
+                and len(pending) % MEMORY_RECENT_TURNS == 0):
+            # Fold everything but the recent window into the summary, in
+            # batches so that not every turn costs a summary call (and a
+            # lagging job is retried once per batch, not once per turn)
+            through = pending[MEMORY_RECENT_TURNS]['id']
+            get_job_queue().enqueue(SUMMARY_JOB_KIND, {
+                "farmer_id": farmer_id, "through": through})
+            with self._lock:
+                self._stats['summaries_queued'] += 1
+        return turn_id
+
+    def summarize(self, farmer_id: str, through: int) -> Dict[str, Any]:
+        """Fold the turns up to `through` into the running summary"""
+        with self._lock:
+            conversation = self._conversation(farmer_id)
+            if conversation is None or conversation['summary_through'] >= through:
+                return {"skipped": True}
+            turns = self._conn.execute(
+                "SELECT question, answer FROM turns WHERE farmer_id = ? "
+                "AND id > ? AND id <= ? ORDER BY id",
+                (farmer_id, conversation['summary_through'], through)).fetchall()
+        previous = conversation['summary']
+        summary, method = _llm_summary(previous, turns), 'llm'
+        if not summary:
+            summary, method = _extractive_summary(previous, turns), 'extractive'
+        summary = _clip(summary, MEMORY_SUMMARY_TOKENS)
+        with self._lock, self._conn:
+            # A concurrent job may have got further meanwhile
+            updated = self._conn.execute(
+                "UPDATE conversations SET summary = ?, summary_through = ? "
+                "WHERE farmer_id = ? AND summary_through < ?",
+                (summary, through, farmer_id, through)).rowcount
+            if updated:
+                self._conn.execute(
+                    "DELETE FROM turns WHERE farmer_id = ? AND id <= ?",
+                    (farmer_id, through))
+                self._stats[f'summaries_{method}'] += 1
+        return {"turns": len(turns), "method": method,
+                "summary_tokens": estimate_tokens(summary)}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._stats)
+            conversations = self._conn.execute(
+                "SELECT COUNT(*) FROM conversations").fetchone()[0]
+            turns = self._conn.execute(
+                "SELECT COUNT(*) FROM turns").fetchone()[0]
+            note_tokens, max_tokens = self._note_tokens, self._max_note_tokens
+        return {
+            "enabled": MEMORY_ENABLED,
+            "token_budget": MEMORY_TOKEN_BUDGET,
+            "conversations": conversations,
+            "stored_turns": turns,
+            "avg_note_tokens": round(note_tokens / counters['notes'], 1)
+            if counters.get('notes') else 0.0,
+            "max_note_tokens": max_tokens,
+            **counters,
+        }
+
+
+def _extractive_summary(previous: str, turns: List[sqlite3.Row]) -> str:
+    """The farmer's questions and the start of each answer, newest kept
+    when it gets too long"""
+    lines = [previous] if previous else []
+    for turn in turns:
+        answer = turn['answer'].strip().split('\n')[0]
+        lines.append(f"Asked: {_clip(turn['question'].strip(), 30)} "
+                     f"Told: {_clip(answer, 30)}")
+    text = ' '.join(lines)
+    limit = MEMORY_SUMMARY_TOKENS * CHARS_PER_TOKEN
+    return text if len(text) <= limit else '…' + text[-(limit - 1):]
+
+
+def _llm_summary(previous: str, turns: List[sqlite3.Row]) -> Optional[str]:
+    """Summary by the fast Gemini model; None when it is unavailable"""
+    try:
+        import google.generativeai as genai
+        from circuit_breaker import get_breaker, is_dependency_failure
+        from concurrency_limits import get_limiter
+    except ImportError:
+        return None
+    words = MEMORY_SUMMARY_TOKENS * 3 // 4
+    transcript = '\n'.join(_turn_text(t['question'], t['answer'])
+                           for t in turns)
+    prompt = (
+        f"Summarize this conversation between a farmer and the Fasal Mitra "
+        f"assistant in at most {words} words, in English. Keep the crops, "
+        f"place, field size, symptoms, advice already given and anything "
+        f"still unresolved; leave out greetings.\n\n"
+        f"Summary so far: {previous or '(none)'}\n\nNew turns:\n{transcript}"
+    )
+    try:
+        model = genai.GenerativeModel(MEMORY_SUMMARY_MODEL)
+        # The summary model's own breaker and limiter, as its agent calls
+        # use: a missing or failing summary model must not trip the
+        # gemini-api breaker Vaidya answers farmers through
+        key = f"llm:{MEMORY_SUMMARY_MODEL}"
+        response = get_breaker(key).call(
+            get_limiter(key).call, model.generate_content, prompt,
+            request_options={"timeout": 30},
+            is_failure=is_dependency_failure)
+        return (response.text or '').strip() or None
+    except Exception as e:
+        print(f"DEBUG: Summary model unavailable, summarizing extractively: {e}")
+        return None
+
+
+_memory = None
+_init_lock = threading.Lock()
+
+
+def get_conversation_memory() -> Optional[ConversationMemory]:
+    """Return the process-wide conversation memory, None when disabled"""
+    global _memory
+    if not MEMORY_ENABLED:
+        return None
+    with _init_lock:
+        if _memory is None:
+            _memory = ConversationMemory()
+        return _memory
+
+
+def summarize_conversation(farmer_id: str, through: int) -> Dict[str, Any]:
+    """Job handler: compact a farmer's older turns into the summary"""
+    return get_conversation_memory().summarize(farmer_id, through)
+
+
+register_handler(SUMMARY_JOB_KIND, summarize_conversation)
+
+
+def get_conversation_memory_stats() -> Dict[str, Any]:
+    memory = get_conversation_memory()
+    if memory is None:
+        return {"enabled": False}
+    return memory.stats()
@@ -0,0 +1,207 @@
+"""
+Request deadlines, per-stage timeouts and hedged calls.
+
+The query handler gives every request a deadline (REQUEST_TIMEOUT_SECONDS)
+on its RequestContext. Each stage below it (an LLM turn, an HTTP call
+made by a tool) gets the smaller of its own budget and the time left, so
+nothing can outlive the request. Idempotent calls can be hedged: when a
+call runs past the p95 latency seen for it, a second identical call is
+started and whichever finishes first wins.
+"""
+
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+from request_context import current_request
+
+load_dotenv()
+
+REQUEST_TIMEOUT_SECONDS = float(os.getenv('REQUEST_TIMEOUT_SECONDS', 30))
+
+# Longest a single call of each stage may take, before the request
+# deadline shortens it further
+STAGE_BUDGETS = {
+    "llm_call": float(os.getenv('LLM_CALL_TIMEOUT', 15)),
+    "http": float(os.getenv('HTTP_CALL_TIMEOUT', 5)),
+    "image_triage": float(os.getenv('IMAGE_TRIAGE_TIMEOUT', 2)),
+}
+
+HEDGING_ENABLED = os.getenv('HEDGING', 'true').lower() == 'true'
+# Latencies kept per call key, and how many are needed before hedging
+LATENCY_WINDOW = 200
+MIN_HEDGE_SAMPLES = 20
+HEDGE_WORKERS = int(os.getenv('HEDGE_WORKERS', 16))
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request (or a stage of it) ran out of time"""
+
+
+class RequestDeadlineExceeded(DeadlineExceeded):
+    """The request's own deadline, not the stage budget, cut the call
+    short; says nothing about the dependency's health"""
+
+
+def request_deadline() -> float:
+    """Deadline, on the time.monotonic() clock, for a request starting now"""
+    return time.monotonic() + REQUEST_TIMEOUT_SECONDS
+
+
+def time_left() -> Optional[float]:
+    """Seconds until the current request's deadline, None without one"""
+    context = current_request()
+    if context is None or context.deadline is None:
+        return None
+    return context.deadline - time.monotonic()
+
+
+def stage_timeout(stage: str) -> float:
+    """Timeout for one call of `stage` within the current request"""
+    budget = STAGE_BUDGETS[stage]
+    left = time_left()
+    if left is None:
+        return budget
+    if left <= 0:
+        _stats.count('deadline_exceeded')
+        raise RequestDeadlineExceeded(
+            f"request deadline passed before {stage}")
+    return min(budget, left)
+
+
+class LatencyTracker:
+    """Recent latencies per call key, for choosing hedge delays"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(
+                key, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, key: str, pct: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < MIN_HEDGE_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct))]
+
+    def hedge_delay(self, key: str) -> Optional[float]:
+        """When to start a hedge for `key`, None to not hedge"""
+        if not HEDGING_ENABLED:
+            return None
+        return self.percentile(key, 0.95)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            keys = list(self._samples)
+        summary = {}
+        for key in keys:
+            with self._lock:
+                samples = sorted(self._samples[key])
+            summary[key] = {
+                "samples": len(samples),
+                "p50_ms": round(samples[len(samples) // 2] * 1000, 1),
+                "p95_ms": round(samples[min(
+                    len(samples) - 1, int(len(samples) * 0.95))] * 1000, 1),
+            }
+        return summary
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+
+latency_tracker = LatencyTracker()
+_stats = _Stats()
+_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS,
+                               thread_name_prefix='hedge')
+
+
+def count(name: str) -> None:
+    """Bump a deadline/hedging counter shown in get_deadline_stats"""
+    _stats.count(name)
+
+
+def hedged_call(key: str, func: Callable[..., Any], *args,
+                stage: str = 'http', **kwargs) -> Any:
+    """Call func(*args, **kwargs) within the stage timeout, hedging it
+    once it runs past the p95 latency recorded under `key`.
+
+    Only use this for idempotent calls. The losing call is not
+    interrupted; it finishes in the background under its own timeout.
+    """
+    timeout = stage_timeout(stage)
+    started = time.monotonic()
+    end = started + timeout
+    starts = {}
+
+    def submit():
+        # Each attempt gets its own copy so both see the request context
+        future = _executor.submit(
+            contextvars.copy_context().run, func, *args, **kwargs)
+        starts[future] = time.monotonic()
+        return future
+
+    pending = {submit()}
+    delay = latency_tracker.hedge_delay(key)
+    if delay is not None and delay < timeout:
+        done, _ = wait(pending, timeout=delay)
+        if not done:
+            _stats.count('hedges_started')
+            pending.add(submit())
+
+    error = None
+    while pending:
+        done, pending = wait(pending, timeout=max(0, end - time.monotonic()),
+                             return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            if future.exception() is None:
+                now = time.monotonic()
+                latency_tracker.record(key, now - starts[future])
+                if len(starts) > 1:
+                    first = min(starts, key=starts.get)
+                    if future is not first:
+                        _stats.count('hedges_won')
+                        # The slow first call would otherwise never be
+                        # sampled and p95 would drift down; its elapsed
+                        # time is a lower bound on its latency
+                        latency_tracker.record(key, now - starts[first])
+                return future.result()
+            error = future.exception()
+    if error is not None and not pending:
+        raise error
+    _stats.count('stage_timeouts')
+    if timeout < STAGE_BUDGETS[stage]:
+        raise RequestDeadlineExceeded(
+            f"{key} did not finish within the {timeout:.1f}s left")
+    raise DeadlineExceeded(f"{key} did not finish within {timeout:.1f}s")
+
+
+def get_deadline_stats() -> Dict[str, Any]:
+    with _stats._lock:
+        counters = dict(_stats.counters)
+    return {
+        "request_timeout_seconds": REQUEST_TIMEOUT_SECONDS,
+        "stage_budgets": STAGE_BUDGETS,
+        "hedging_enabled": HEDGING_ENABLED,
+        "latency": latency_tracker.snapshot(),
+        **counters,
+    }
@@ -1,17 +1,41 @@
-import os
-from firebase_config import get_firestore_client
+from typing import Callable, Dict, Iterable, Optional
+from farmer_store import get_farmer_store, DEFAULT_PAGE_SIZE, Page
 from models import FarmerResponse
 
 
-COLLECTION_NAME = os.getenv('FIRESTORE_COLLECTION_NAME', 'farmers')
+def register_farmer_in_db(farmer: FarmerResponse) -> FarmerResponse:
+    """Register a farmer in the configured farmer store"""
+    get_farmer_store().upsert(farmer)
 
+    # Imported here to keep the cache optional for scripts using this module
+    from profile_cache import get_profile_cache
+    get_profile_cache().put(farmer)
+    return farmer
 
-def register_farmer_in_db(farmer: FarmerResponse) -> FarmerResponse:
-    """Register a farmer in Firestore database"""
-    db = get_firestore_client()
-    if not db:
-        raise Exception('Database connection failed')
-    
-    doc_ref = db.collection(COLLECTION_NAME).document(farmer.farmer_id)
-    doc_ref.set(farmer.dict())
-    return farmer 
\ No newline at end of file
+
+def get_farmer_from_db(farmer_id: str) -> Optional[FarmerResponse]:
+    """Fetch one farmer profile, None if it does not exist"""
+    return get_farmer_store().get(farmer_id)
+
+
+def get_farmers_from_db(farmer_ids: Iterable[str]) -> Dict[str, FarmerResponse]:
+    """Fetch several farmer profiles in one batched read"""
+    return get_farmer_store().get_many(farmer_ids)
+
+
+def find_farmers(limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None,
+                 **filters: str) -> Page:
+    """One page of farmers by state, city and/or native_language, e.g.
+    find_farmers(city="Mysuru", native_language="Kannada")"""
+    return get_farmer_store().find(limit=limit, after=after, **filters)
+
+
+def watch_farmer_changes(on_change: Callable[[str, Optional[FarmerResponse]], None],
+                         since: str):
+    """Call on_change(farmer_id, profile) for every profile written after
+    `since` (ISO timestamp); profile is None when it was deleted.
+
+    Returns a handle with unsubscribe(), or None if the store has no
+    change feed.
+    """
+    return get_farmer_store().watch_changes(on_change, since)
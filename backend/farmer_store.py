@@ -0,0 +1,396 @@
+"""
+Storage backends for farmer profiles.
+
+FarmerStore is the interface farmer_service talks to. FirestoreFarmerStore
+keeps profiles in the Firestore collection; SQLiteFarmerStore keeps them
+in a local SQLite file (WAL) with secondary indexes on state, city and
+native_language, so cohort queries such as "Kannada speakers in Mysuru"
+run locally without scanning the collection over the network. The
+backend is chosen with FARMER_STORE. Firestore calls go through the
+"firestore" circuit breaker, so an outage fails fast instead of holding
+requests. sync_farmers copies one store into another, e.g. Firestore
+into the local database:
+
+    python farmer_store.py sync
+"""
+
+import functools
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import (
+    Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+)
+
+from dotenv import load_dotenv
+
+from circuit_breaker import get_breaker
+from models import FarmerResponse
+
+load_dotenv()
+
+FARMER_STORE = os.getenv('FARMER_STORE', 'firestore')
+FARMER_DB_PATH = os.getenv(
+    'FARMER_DB_PATH',
+    os.path.join(os.path.dirname(__file__), 'var', 'farmers.sqlite3'))
+COLLECTION_NAME = os.getenv('FIRESTORE_COLLECTION_NAME', 'farmers')
+DEFAULT_PAGE_SIZE = 500
+
+# Fields that cohort queries may filter on
+FILTER_FIELDS = ('state', 'city', 'native_language')
+
+# (profiles, cursor for the next page or None)
+Page = Tuple[List[FarmerResponse], Optional[str]]
+
+
+class FarmerStore(ABC):
+    """Where farmer profiles are kept"""
+
+    @abstractmethod
+    def get(self, farmer_id: str) -> Optional[FarmerResponse]:
+        ...
+
+    @abstractmethod
+    def get_many(self, farmer_ids: Iterable[str]) -> Dict[str, FarmerResponse]:
+        ...
+
+    @abstractmethod
+    def bulk_upsert(self, farmers: Iterable[FarmerResponse]) -> int:
+        """Insert or replace profiles; returns how many were written"""
+
+    @abstractmethod
+    def delete(self, farmer_id: str) -> None:
+        ...
+
+    @abstractmethod
+    def find(self, limit: int = DEFAULT_PAGE_SIZE,
+             after: Optional[str] = None, **filters: str) -> Page:
+        """One page of farmers matching `filters` (exact match on the
+        FILTER_FIELDS), ordered by farmer_id after the cursor `after`"""
+
+    def upsert(self, farmer: FarmerResponse) -> None:
+        self.bulk_upsert([farmer])
+
+    def iter_farmers(self, page_size: int = DEFAULT_PAGE_SIZE,
+                     **filters: str) -> Iterator[FarmerResponse]:
+        """All matching farmers, fetched one page at a time"""
+        cursor = None
+        while True:
+            farmers, cursor = self.find(limit=page_size, after=cursor,
+                                        **filters)
+            yield from farmers
+            if cursor is None:
+                return
+
+    def watch_changes(self, on_change: Callable[
+            [str, Optional[FarmerResponse]], None], since: str):
+        """Subscribe to profiles written by other processes after `since`.
+
+        Returns a handle with unsubscribe(), or None when the backend has
+        no change feed.
+        """
+        return None
+
+
+def _check_filters(filters: Dict[str, str]) -> None:
+    unknown = set(filters) - set(FILTER_FIELDS)
+    if unknown:
+        raise ValueError(f"cannot filter farmers on {', '.join(unknown)}")
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS farmers (
+    farmer_id TEXT PRIMARY KEY,
+    farmer_name TEXT NOT NULL,
+    state TEXT NOT NULL COLLATE NOCASE,
+    city TEXT NOT NULL COLLATE NOCASE,
+    contact_number TEXT NOT NULL,
+    native_language TEXT NOT NULL COLLATE NOCASE,
+    crops TEXT NOT NULL DEFAULT '[]',
+    experience_level TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS farmers_state_city_language
+    ON farmers (state, city, native_language, farmer_id);
+CREATE INDEX IF NOT EXISTS farmers_city_language
+    ON farmers (city, native_language, farmer_id);
+CREATE INDEX IF NOT EXISTS farmers_language_state
+    ON farmers (native_language, state, farmer_id);
+"""
+
+_COLUMNS = ('farmer_id', 'farmer_name', 'state', 'city', 'contact_number',
+            'native_language', 'crops', 'experience_level', 'created_at',
+            'updated_at')
+# Columns added after the first release, for databases created before
+_ADDED_COLUMNS = {
+    'crops': "TEXT NOT NULL DEFAULT '[]'",
+    'experience_level': "TEXT",
+}
+
+
+def _row_to_farmer(row: sqlite3.Row) -> FarmerResponse:
+    farmer = dict(row)
+    farmer['crops'] = json.loads(farmer['crops'])
+    return FarmerResponse(**farmer)
+
+
+def _farmer_to_row(farmer: FarmerResponse) -> tuple:
+    return tuple(json.dumps(farmer.crops) if c == 'crops'
+                 else getattr(farmer, c) for c in _COLUMNS)
+
+
+class SQLiteFarmerStore(FarmerStore):
+    """Farmers in a local SQLite database.
+
+    Filters compare case-insensitively, matching how states and cities
+    are typed in by hand at registration.
+    """
+
+    def __init__(self, path: str = FARMER_DB_PATH):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(_SCHEMA)
+            existing = {row['name'] for row in self._conn.execute(
+                "PRAGMA table_info(farmers)")}
+            for column, definition in _ADDED_COLUMNS.items():
+                if column not in existing:
+                    self._conn.execute(
+                        f"ALTER TABLE farmers ADD COLUMN {column} {definition}")
+
+    def get(self, farmer_id: str) -> Optional[FarmerResponse]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM farmers WHERE farmer_id = ?",
+                (farmer_id,)).fetchone()
+        return _row_to_farmer(row) if row else None
+
+    def get_many(self, farmer_ids: Iterable[str]) -> Dict[str, FarmerResponse]:
+        farmer_ids = list(farmer_ids)
+        found = {}
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(farmer_ids), 500):
+            chunk = farmer_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT * FROM farmers WHERE farmer_id IN "
+                    f"({placeholders})", chunk).fetchall()
+            for row in rows:
+                found[row['farmer_id']] = _row_to_farmer(row)
+        return found
+
+    def bulk_upsert(self, farmers: Iterable[FarmerResponse]) -> int:
+        rows = [_farmer_to_row(f) for f in farmers]
+        updates = ', '.join(f"{c} = excluded.{c}" for c in _COLUMNS[1:])
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT INTO farmers ({', '.join(_COLUMNS)}) "
+                f"VALUES ({','.join('?' * len(_COLUMNS))}) "
+                f"ON CONFLICT(farmer_id) DO UPDATE SET {updates}", rows)
+        return len(rows)
+
+    def delete(self, farmer_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM farmers WHERE farmer_id = ?", (farmer_id,))
+
+    def find(self, limit: int = DEFAULT_PAGE_SIZE,
+             after: Optional[str] = None, **filters: str) -> Page:
+        sql, params = self._where(after, filters)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM farmers{sql} ORDER BY farmer_id LIMIT ?",
+                params + [limit + 1]).fetchall()
+        farmers = [_row_to_farmer(row) for row in rows[:limit]]
+        cursor = farmers[-1].farmer_id if len(rows) > limit else None
+        return farmers, cursor
+
+    def count(self, **filters: str) -> int:
+        sql, params = self._where(None, filters)
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM farmers{sql}", params).fetchone()[0]
+
+    def explain(self, **filters: str) -> List[str]:
+        """Query plan of a cohort lookup, to check that an index is used"""
+        sql, params = self._where(None, filters)
+        with self._lock:
+            rows = self._conn.execute(
+                f"EXPLAIN QUERY PLAN SELECT * FROM farmers{sql} "
+                f"ORDER BY farmer_id", params).fetchall()
+        return [row['detail'] for row in rows]
+
+    @staticmethod
+    def _where(after: Optional[str],
+               filters: Dict[str, str]) -> Tuple[str, list]:
+        _check_filters(filters)
+        clauses, params = [], []
+        for field in FILTER_FIELDS:
+            if filters.get(field) is not None:
+                clauses.append(f"{field} = ?")
+                params.append(filters[field])
+        if after is not None:
+            clauses.append("farmer_id > ?")
+            params.append(after)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+
+def _is_outage(exc: Exception) -> bool:
+    """Whether a Firestore error counts against the breaker; rejected
+    requests (4xx other than timeouts/throttling) do not"""
+    code = getattr(exc, 'code', None)
+    return not isinstance(code, int) or code >= 500 or code in (408, 429)
+
+
+def _through_breaker(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return get_breaker('firestore').call(
+            method, self, *args, is_failure=_is_outage, **kwargs)
+    return wrapper
+
+
+class FirestoreFarmerStore(FarmerStore):
+    """Farmers in the Firestore collection (one document per farmer)"""
+
+    def __init__(self, collection_name: str = COLLECTION_NAME):
+        self.collection_name = collection_name
+
+    def _collection(self):
+        from firebase_config import get_firestore_client
+
+        db = get_firestore_client()
+        if not db:
+            raise Exception('Database connection failed')
+        return db, db.collection(self.collection_name)
+
+    @_through_breaker
+    def get(self, farmer_id: str) -> Optional[FarmerResponse]:
+        _, collection = self._collection()
+        snapshot = collection.document(farmer_id).get()
+        if not snapshot.exists:
+            return None
+        return FarmerResponse(**snapshot.to_dict())
+
+    @_through_breaker
+    def get_many(self, farmer_ids: Iterable[str]) -> Dict[str, FarmerResponse]:
+        db, collection = self._collection()
+        refs = [collection.document(farmer_id) for farmer_id in farmer_ids]
+        if not refs:
+            return {}
+        return {
+            snapshot.id: FarmerResponse(**snapshot.to_dict())
+            for snapshot in db.get_all(refs) if snapshot.exists
+        }
+
+    @_through_breaker
+    def bulk_upsert(self, farmers: Iterable[FarmerResponse]) -> int:
+        db, collection = self._collection()
+        written = 0
+        batch = db.batch()
+        for farmer in farmers:
+            batch.set(collection.document(farmer.farmer_id), farmer.dict())
+            written += 1
+            # Firestore caps a batch at 500 writes
+            if written % 500 == 0:
+                batch.commit()
+                batch = db.batch()
+        if written % 500:
+            batch.commit()
+        return written
+
+    @_through_breaker
+    def delete(self, farmer_id: str) -> None:
+        _, collection = self._collection()
+        collection.document(farmer_id).delete()
+
+    @_through_breaker
+    def find(self, limit: int = DEFAULT_PAGE_SIZE,
+             after: Optional[str] = None, **filters: str) -> Page:
+        from google.cloud.firestore_v1.base_query import FieldFilter
+        from google.cloud.firestore_v1.field_path import FieldPath
+
+        _check_filters(filters)
+        _, collection = self._collection()
+        query = collection
+        for field in FILTER_FIELDS:
+            if filters.get(field) is not None:
+                query = query.where(
+                    filter=FieldFilter(field, '==', filters[field]))
+        query = query.order_by(FieldPath.document_id())
+        if after is not None:
+            query = query.start_after(
+                {FieldPath.document_id(): collection.document(after)})
+        snapshots = list(query.limit(limit + 1).stream())
+        farmers = [FarmerResponse(**s.to_dict()) for s in snapshots[:limit]]
+        cursor = snapshots[limit - 1].id if len(snapshots) > limit else None
+        return farmers, cursor
+
+    def watch_changes(self, on_change: Callable[
+            [str, Optional[FarmerResponse]], None], since: str):
+        from google.cloud.firestore_v1.base_query import FieldFilter
+
+        _, collection = self._collection()
+
+        def on_snapshot(_, changes, __):
+            for change in changes:
+                doc = change.document
+                if change.type.name == 'REMOVED':
+                    on_change(doc.id, None)
+                else:
+                    on_change(doc.id, FarmerResponse(**doc.to_dict()))
+
+        query = collection.where(filter=FieldFilter('updated_at', '>', since))
+        return query.on_snapshot(on_snapshot)
+
+
+def sync_farmers(source: FarmerStore, target: FarmerStore,
+                 page_size: int = DEFAULT_PAGE_SIZE) -> int:
+    """Copy every farmer from `source` into `target`, a page at a time"""
+    copied = 0
+    cursor = None
+    while True:
+        farmers, cursor = source.find(limit=page_size, after=cursor)
+        copied += target.bulk_upsert(farmers)
+        if cursor is None:
+            return copied
+
+
+_store = None
+_init_lock = threading.Lock()
+
+
+def get_farmer_store() -> FarmerStore:
+    """Return the process-wide store selected by FARMER_STORE"""
+    global _store
+    with _init_lock:
+        if _store is None:
+            if FARMER_STORE == 'sqlite':
+                _store = SQLiteFarmerStore(FARMER_DB_PATH)
+            elif FARMER_STORE == 'firestore':
+                _store = FirestoreFarmerStore()
+            else:
+                raise ValueError(f"Unknown FARMER_STORE {FARMER_STORE}")
+        return _store
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Farmer store utilities")
+    parser.add_argument('command', choices=['sync'],
+                        help="sync: copy Firestore into the SQLite store")
+    parser.add_argument('--db', default=FARMER_DB_PATH)
+    args = parser.parse_args()
+
+    total = sync_farmers(FirestoreFarmerStore(), SQLiteFarmerStore(args.db))
+    print(f"Synced {total} farmers into {args.db}")
@@ -39,6 +39,11 @@ def initialize_firebase():
 
 def get_firestore_client():
     """Get Firestore client instance"""
+    try:
+        firebase_admin.get_app()
+    except ValueError:
+        # Not initialized yet in this process
+        return initialize_firebase()
     try:
         return firestore.client()
     except Exception as e:
@@ -0,0 +1,412 @@
+"""
+Offline gazetteer: resolves the place names farmers write to canonical
+places with coordinates.
+
+The same place arrives as "Bengaluru", "Bangalore", "bangalore city" or
+"ಬೆಂಗಳೂರು". Every name and alias in the data file (GAZETTEER_PATH, a CSV
+of name, kind, district, state, lat, lon, population and |-separated
+aliases; append village or census rows to extend it) is indexed under a
+phonetic key: Indic scripts are transliterated to Latin through the
+shared layout of the Unicode Brahmic blocks, and spelling differences
+that do not change the sound (aspirates, doubled letters, ee/i, oo/u,
+w/v) are folded. A query is an exact key lookup, and otherwise a search
+of a trigram index scored by Dice similarity. Ambiguous names prefer the
+farmer's state, then larger places. Results are memoized.
+"""
+
+import csv
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+GAZETTEER_PATH = os.getenv(
+    'GAZETTEER_PATH',
+    os.path.join(os.path.dirname(__file__), 'data', 'gazetteer.csv'))
+# Dice similarity of trigrams a fuzzy match needs. Misspellings are only
+# matched among places of the farmer's (or the named) state: with a partial
+# gazetteer a looser match is mostly a different place ("Mandi", Mandya)
+GAZETTEER_MIN_SCORE = float(os.getenv('GAZETTEER_MIN_SCORE', 0.8))
+GAZETTEER_CACHE_SIZE = int(os.getenv('GAZETTEER_CACHE_SIZE', 10000))
+
+# Preference among places sharing a name
+KIND_RANK = {'state': 0, 'city': 1, 'district': 2, 'town': 3, 'village': 4}
+
+# Latin romanization of each code point offset within a Brahmic block
+# (Devanagari U+0900 ... Malayalam U+0D00 share one layout)
+_VOWELS = {
+    0x05: 'a', 0x06: 'aa', 0x07: 'i', 0x08: 'ii', 0x09: 'u', 0x0A: 'uu',
+    0x0B: 'ri', 0x0C: 'li', 0x0D: 'e', 0x0E: 'e', 0x0F: 'e', 0x10: 'ai',
+    0x11: 'o', 0x12: 'o', 0x13: 'o', 0x14: 'au', 0x60: 'ri', 0x61: 'li',
+}
+_CONSONANTS = dict(zip(range(0x15, 0x3A), [
+    'k', 'kh', 'g', 'gh', 'n', 'ch', 'chh', 'j', 'jh', 'n',
+    't', 'th', 'd', 'dh', 'n', 't', 'th', 'd', 'dh', 'n', 'n',
+    'p', 'ph', 'b', 'bh', 'm', 'y', 'r', 'r', 'l', 'l', 'l', 'v',
+    'sh', 'sh', 's', 'h']))
+_CONSONANTS.update({0x58: 'k', 0x59: 'kh', 0x5A: 'g', 0x5B: 'j',
+                    0x5C: 'r', 0x5D: 'rh', 0x5E: 'f', 0x5F: 'y'})
+_SIGNS = {
+    0x3E: 'aa', 0x3F: 'i', 0x40: 'ii', 0x41: 'u', 0x42: 'uu', 0x43: 'ri',
+    0x44: 'ri', 0x45: 'e', 0x46: 'e', 0x47: 'e', 0x48: 'ai', 0x49: 'o',
+    0x4A: 'o', 0x4B: 'o', 0x4C: 'au', 0x62: 'li', 0x63: 'li',
+}
+_NASALS = (0x01, 0x02)
+_VIRAMA = 0x4D
+# Nukta, avagraha and length marks do not change the romanization
+_IGNORED = (0x3C, 0x3D, 0x55, 0x56, 0x57)
+_BRAHMIC_START, _BRAHMIC_END = 0x0900, 0x0D7F
+# Scripts whose word-final inherent vowel is not pronounced
+# (Devanagari, Bengali, Gurmukhi, Gujarati, Oriya)
+_SCHWA_DELETING = range(0x0900, 0x0B80)
+_TAMIL = range(0x0B80, 0x0C00)
+
+_QUALIFIERS = frozenset(
+    "district dist taluk taluka tehsil tahsil city town village gram "
+    "mandal block near nagar rural urban state".split())
+_COORDINATES = re.compile(r'^\s*-?\d+(\.\d+)?\s*,\s*-?\d+(\.\d+)?\s*$')
+
+
+def transliterate(text: str) -> str:
+    """Romanize Indic-script characters; other characters pass through"""
+    out = []
+    pending = False  # a consonant waiting for its vowel
+    schwa_deleting = False
+    for ch in text:
+        code = ord(ch)
+        if not _BRAHMIC_START <= code <= _BRAHMIC_END:
+            if pending:
+                out.append('' if schwa_deleting else 'a')
+                pending = False
+            out.append(ch)
+            continue
+        offset = code & 0x7F
+        if offset in _IGNORED:
+            continue
+        if offset in _CONSONANTS:
+            if pending:
+                out.append('a')
+            out.append(_CONSONANTS[offset])
+            pending = True
+            schwa_deleting = code in _SCHWA_DELETING
+        elif offset in _SIGNS:
+            out.append(_SIGNS[offset])
+            pending = False
+        elif offset == _VIRAMA:
+            pending = False
+        else:
+            if pending:
+                out.append('a')
+                pending = False
+            if offset in _VOWELS:
+                out.append(_VOWELS[offset])
+            elif offset in _NASALS:
+                out.append('n')
+            elif 0x66 <= offset <= 0x6F:
+                out.append(str(offset - 0x66))
+    if pending:
+        out.append('' if schwa_deleting else 'a')
+    return ''.join(out)
+
+
+_FOLDS = [
+    ('chh', '\x01'), ('ch', '\x01'), ('c', 'k'), ('\x01', 'c'),
+    ('sh', 's'), ('ph', 'f'), ('kh', 'k'), ('gh', 'g'), ('th', 't'),
+    ('dh', 'd'), ('bh', 'b'), ('jh', 'j'), ('w', 'v'), ('z', 'j'),
+    ('q', 'k'), ('x', 'ks'), ('ee', 'i'), ('oo', 'u'), ('ou', 'u'),
+    ('au', 'o'), ('ai', 'i'), ('ei', 'i'),
+]
+_Y_AS_VOWEL = re.compile(r'y(?![aeiou])')
+_H_AFTER_CONSONANT = re.compile(r'(?<=[bcdfgjklmnpqrstvz])h')
+_REPEATS = re.compile(r'(.)\1+')
+
+
+def phonetic_key(text: str, loose: bool = False) -> str:
+    """Spelling-insensitive key of a place name in any script.
+
+    With `loose`, voiced and unvoiced stops are folded too, for scripts
+    (Tamil) that write both with one letter.
+    """
+    text = transliterate(unicodedata.normalize('NFKC', text)).lower()
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(ch if 'a' <= ch <= 'z' or ch.isdigit() else ' '
+                   for ch in text if not unicodedata.combining(ch))
+    words = [w for w in text.split() if w not in _QUALIFIERS] or text.split()
+    key = ' '.join(words)
+    for old, new in _FOLDS:
+        key = key.replace(old, new)
+    key = _H_AFTER_CONSONANT.sub('', key)
+    key = _Y_AS_VOWEL.sub('i', key)
+    key = key.replace('aa', 'a')
+    if loose:
+        key = key.translate(str.maketrans('gdbj', 'ktpc'))
+    return _REPEATS.sub(r'\1', key)
+
+
+def trigrams(key: str) -> List[str]:
+    padded = f"  {key} "
+    return list({padded[i:i + 3] for i in range(len(padded) - 2)})
+
+
+class Place(NamedTuple):
+    name: str
+    kind: str
+    district: str
+    state: str
+    lat: float
+    lon: float
+    population: int
+
+    @property
+    def key(self) -> str:
+        """Stable identifier, e.g. for cache keys"""
+        return f"{self.name}|{self.state}".lower()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "district": self.district or None,
+                "state": self.state, "lat": self.lat, "lon": self.lon}
+
+
+class PlaceMatch(NamedTuple):
+    place: Place
+    score: float
+    matched: str
+
+
+class Gazetteer:
+    """In-memory place index with exact and trigram lookup"""
+
+    def __init__(self, path: str = GAZETTEER_PATH,
+                 cache_size: int = GAZETTEER_CACHE_SIZE):
+        self.places: List[Place] = []
+        self._aliases: Dict[str, List[str]] = {}
+        self._exact: Dict[str, List[int]] = {}
+        self._loose: Dict[str, List[int]] = {}
+        self._name_keys: List[str] = []
+        self._name_places: List[int] = []
+        self._name_texts: List[str] = []
+        self._postings: Dict[str, List[int]] = {}
+        self._states: Dict[str, str] = {}
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        self._stats = Counter()
+        if path and os.path.exists(path):
+            self.load(path)
+        else:
+            print(f"ERROR: Gazetteer data file not found at {path}")
+
+    def load(self, path: str) -> int:
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+        for row in rows:
+            aliases = [a.strip() for a in (row.get('aliases') or '').split('|')
+                       if a.strip()]
+            self.add(Place(
+                name=row['name'].strip(), kind=row['kind'].strip() or 'town',
+                district=(row.get('district') or '').strip(),
+                state=row['state'].strip(), lat=float(row['lat']),
+                lon=float(row['lon']),
+                population=int(row.get('population') or 0)), aliases)
+        print(f"DEBUG: Gazetteer loaded {len(self.places)} places, "
+              f"{len(self._name_keys)} names from {path}")
+        return len(rows)
+
+    def add(self, place: Place, aliases: List[str] = ()) -> None:
+        place_id = len(self.places)
+        self.places.append(place)
+        self._aliases.setdefault(place.key, []).extend(aliases)
+        if place.kind == 'state':
+            for name in (place.name, *aliases):
+                self._states[phonetic_key(name)] = place.state
+        for text in dict.fromkeys((place.name, *aliases)):
+            key = phonetic_key(text)
+            if not key:
+                continue
+            self._exact.setdefault(key, []).append(place_id)
+            self._loose.setdefault(phonetic_key(text, loose=True),
+                                   []).append(place_id)
+            name_id = len(self._name_keys)
+            self._name_keys.append(key)
+            self._name_places.append(place_id)
+            self._name_texts.append(text)
+            for gram in trigrams(key):
+                self._postings.setdefault(gram, []).append(name_id)
+        with self._lock:
+            self._cache.clear()
+
+    def state_of(self, text: str) -> Optional[str]:
+        """Canonical state named by `text`, if it names one"""
+        return self._states.get(phonetic_key(text or ''))
+
+    def latin_names(self, place: Place) -> List[str]:
+        """Name and aliases of a place written in Latin script"""
+        return [n for n in (place.name, *self._aliases.get(place.key, ()))
+                if n.isascii()]
+
+    def _best(self, place_ids: List[int], state: Optional[str]) -> int:
+        return min(place_ids, key=lambda i: (
+            self.places[i].state != state if state else False,
+            KIND_RANK.get(self.places[i].kind, 5),
+            -self.places[i].population))
+
+    def _fuzzy(self, key: str, state: Optional[str]) -> Optional[PlaceMatch]:
+        if not state:
+            return None
+        grams = sorted(trigrams(key),
+                       key=lambda g: len(self._postings.get(g, ())))
+        # A name scoring GAZETTEER_MIN_SCORE shares at least `needed` of the
+        # query's trigrams, so it shares one of the rarest
+        # len(grams) - needed + 1; only those select candidates, and the
+        # common rest is checked against the candidates alone
+        needed = max(1, math.ceil(
+            GAZETTEER_MIN_SCORE * len(grams) / (2 - GAZETTEER_MIN_SCORE)))
+        probe = len(grams) - needed + 1
+        overlap = Counter()
+        for gram in grams[:probe]:
+            overlap.update(self._postings.get(gram, ()))
+        rest = frozenset(grams[probe:])
+        best = None
+        for name_id, shared in overlap.items():
+            place = self.places[self._name_places[name_id]]
+            if place.state != state:
+                continue
+            name_key = self._name_keys[name_id]
+            name_grams = len(name_key) + 1
+            total = len(grams) + name_grams
+            if 2 * (shared + min(len(rest), name_grams - shared)) \
+                    < GAZETTEER_MIN_SCORE * total:
+                continue
+            if rest:
+                shared += len(rest.intersection(trigrams(name_key)))
+            score = 2 * shared / total
+            if score < GAZETTEER_MIN_SCORE:
+                continue
+            rank = (score, -KIND_RANK.get(place.kind, 5), place.population)
+            if best is None or rank > best[0]:
+                best = (rank, name_id, score)
+        if best is None:
+            return None
+        _, name_id, score = best
+        return PlaceMatch(self.places[self._name_places[name_id]],
+                          round(score, 3), self._name_texts[name_id])
+
+    def _resolve(self, text: str, state: Optional[str]) -> Optional[PlaceMatch]:
+        parts = [p for p in re.split(r'[,/]', text) if p.strip()]
+        # "Hunsur, Mysuru district, Karnataka": a state among the later
+        # parts narrows the first
+        for part in parts[1:]:
+            state = self.state_of(part) or state
+        for candidate in dict.fromkeys([parts[0], text] if parts else [text]):
+            key = phonetic_key(candidate)
+            if not key:
+                continue
+            place_ids = self._exact.get(key)
+            if place_ids is None and any(
+                    ord(ch) in _TAMIL for ch in candidate):
+                place_ids = self._loose.get(phonetic_key(candidate, loose=True))
+            if place_ids:
+                self._stats['exact'] += 1
+                place = self.places[self._best(place_ids, state)]
+                return PlaceMatch(place, 1.0, candidate)
+            match = self._fuzzy(key, state)
+            if match is not None:
+                self._stats['fuzzy'] += 1
+                return match
+        return None
+
+    def resolve(self, text: str,
+                state: Optional[str] = None) -> Optional[PlaceMatch]:
+        """Best matching place for `text`, or None (also for lat,lon
+        coordinates, which need no resolving)"""
+        if not text or _COORDINATES.match(text):
+            return None
+        state = self.state_of(state) if state else None
+        cache_key = (text, state)
+        with self._lock:
+            self._stats['lookups'] += 1
+            if cache_key in self._cache:
+                self._cache.move_to_end(cache_key)
+                self._stats['cache_hits'] += 1
+                return self._cache[cache_key]
+        match = self._resolve(text, state)
+        with self._lock:
+            if match is None:
+                self._stats['misses'] += 1
+            self._cache[cache_key] = match
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return match
+
+    def find_places(self, text: str,
+                    state: Optional[str] = None) -> List[Place]:
+        """Places named anywhere in free text, by exact name of one or two
+        words. Latin words must spell a name or alias exactly, since
+        phonetic keys of ordinary words can match places ("daily")."""
+        words = [w.strip('.,;:!?()"\'।') for w in (text or '').split()]
+        found = []
+        i = 0
+        while i < len(words):
+            for size in (2, 1):
+                phrase = ' '.join(words[i:i + size])
+                key = phonetic_key(phrase)
+                if len(key) < 4 or len(words[i:i + size]) < size:
+                    continue
+                place_ids = self._exact.get(key)
+                if place_ids and phrase.isascii():
+                    place_ids = [p for p in place_ids if phrase.lower() in {
+                        n.lower() for n in self.latin_names(self.places[p])}]
+                if place_ids:
+                    place = self.places[self._best(place_ids, state)]
+                    if place not in found:
+                        found.append(place)
+                    i += size - 1
+                    break
+            i += 1
+        return found
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._stats)
+        lookups = counters.get('lookups', 0)
+        return {
+            "places": len(self.places),
+            "names": len(self._name_keys),
+            "resolved_rate": round(1 - counters.get('misses', 0) / lookups, 3)
+            if lookups else 0.0,
+            **counters,
+        }
+
+
+_gazetteer = None
+_init_lock = threading.Lock()
+
+
+def get_gazetteer() -> Gazetteer:
+    """Return the process-wide gazetteer"""
+    global _gazetteer
+    with _init_lock:
+        if _gazetteer is None:
+            _gazetteer = Gazetteer()
+        return _gazetteer
+
+
+def resolve_location(text: str) -> Optional[Place]:
+    """Place named by `text`, preferring the asking farmer's state"""
+    from request_context import current_request
+
+    context = current_request()
+    profile = context.farmer_profile if context else None
+    match = get_gazetteer().resolve(text, profile.state if profile else None)
+    return match.place if match else None
+
+
+def get_gazetteer_stats() -> Dict[str, Any]:
+    return get_gazetteer().stats()
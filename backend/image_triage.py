@@ -0,0 +1,437 @@
+"""
+On-box triage of crop photos before they reach Vaidya.
+
+Every image of a query is checked on the CPU first:
+
+- unusable photos (too small, too dark or bright, blurry) are rejected
+  at once with advice on retaking them, so no LLM call is spent on them;
+- when a triage model is installed (TRIAGE_MODEL_PATH, a NumPy .npz CNN
+  or an .onnx file with onnxruntime), photos it is confident show no
+  plant are rejected too, a confident diagnosis of a common disease is
+  passed to the agents as a hint, and above TRIAGE_DIRECT_CONFIDENCE the
+  photo itself is not sent on, which turns the question into a cheap
+  text-only one.
+
+The share of plant-coloured pixels is only reported: red or purple
+crops, dry leaves and close-ups of lesions fail a colour test, so photos
+with few such pixels still go on to the model and Vaidya.
+
+Model inference is micro-batched: images from concurrent requests are
+collected for up to TRIAGE_MAX_WAIT_MS and run as one batch.
+"""
+
+import io
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from deadlines import DeadlineExceeded, stage_timeout
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:
+    np = Image = None
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+load_dotenv()
+
+TRIAGE_ENABLED = os.getenv('IMAGE_TRIAGE', 'true').lower() != 'false'
+TRIAGE_MODEL_PATH = os.getenv(
+    'TRIAGE_MODEL_PATH',
+    os.path.join(os.path.dirname(__file__), 'var', 'models', 'triage.npz'))
+# Quality checks
+TRIAGE_MIN_SIDE = int(os.getenv('TRIAGE_MIN_SIDE', 128))
+TRIAGE_BLUR_THRESHOLD = float(os.getenv('TRIAGE_BLUR_THRESHOLD', 40))
+# Below this share of plant-coloured pixels a photo is counted (not
+# rejected) as few_plant_pixels
+TRIAGE_MIN_PLANT_FRACTION = float(os.getenv('TRIAGE_MIN_PLANT_FRACTION', 0.05))
+# Model decisions
+TRIAGE_REJECT_CONFIDENCE = float(os.getenv('TRIAGE_REJECT_CONFIDENCE', 0.9))
+TRIAGE_HINT_CONFIDENCE = float(os.getenv('TRIAGE_HINT_CONFIDENCE', 0.8))
+TRIAGE_DIRECT_CONFIDENCE = float(os.getenv('TRIAGE_DIRECT_CONFIDENCE', 0.97))
+# Micro-batching
+TRIAGE_MAX_BATCH = int(os.getenv('TRIAGE_MAX_BATCH', 16))
+TRIAGE_MAX_WAIT_MS = float(os.getenv('TRIAGE_MAX_WAIT_MS', 5))
+
+# Side of the square image the quality checks look at
+QUALITY_SIZE = 256
+NOT_PLANT, HEALTHY = 'not_plant', 'healthy'
+
+RETAKE_ADVICE = {
+    'too_small': "The photo is too small to examine.",
+    'too_dark': "The photo is too dark to see the crop.",
+    'overexposed': "The photo is too bright to see the crop.",
+    'blurry': "The photo is too blurry to see the crop clearly.",
+    'no_plant': "No crop or leaf could be seen in the photo.",
+}
+RETAKE_INSTRUCTIONS = (
+    "Please take the photo again in daylight, holding the phone steady and "
+    "close to the affected leaves, fruit or stem.")
+
+
+class NumpyCNN:
+    """Small CNN evaluated with NumPy.
+
+    The .npz file holds `conv{i}_w` (out, in, 3, 3) and `conv{i}_b` for
+    each 3x3 conv + ReLU + 2x2 max-pool block, `fc_w` (classes, channels)
+    and `fc_b` after global average pooling, `labels` and `input_size`.
+    Labels are "not_plant", "<crop>:healthy" or "<crop>:<disease>".
+    """
+
+    def __init__(self, path: str):
+        weights = np.load(path, allow_pickle=False)
+        self.convs = []
+        while f"conv{len(self.convs)}_w" in weights:
+            i = len(self.convs)
+            self.convs.append((weights[f"conv{i}_w"].astype(np.float32),
+                               weights[f"conv{i}_b"].astype(np.float32)))
+        self.fc_w = weights['fc_w'].astype(np.float32)
+        self.fc_b = weights['fc_b'].astype(np.float32)
+        self.labels = [str(label) for label in weights['labels']]
+        self.input_size = int(weights['input_size'])
+        # (out, in, 3, 3) kernels as (9 * in, out) matrices for im2col
+        self._kernels = {id(w): w.transpose(2, 3, 1, 0).reshape(-1, len(w))
+                         for w, _ in self.convs}
+
+    def predict(self, batch: 'np.ndarray') -> 'np.ndarray':
+        """Class probabilities of an (N, H, W, 3) batch in [0, 1]"""
+        x = batch
+        for w, b in self.convs:
+            n, h, w_, _ = x.shape
+            padded = np.pad(x, ((0, 0), (1, 1), (1, 1), (0, 0)))
+            # im2col: one matmul over all 3x3 patches of the batch
+            patches = np.concatenate(
+                [padded[:, i:i + h, j:j + w_] for i in range(3)
+                 for j in range(3)], axis=3)
+            x = patches @ self._kernels[id(w)] + b
+            np.maximum(x, 0, out=x)
+            # 2x2 max-pool; max() over tiny axes is far slower than this
+            h, w_ = h // 2 * 2, w_ // 2 * 2
+            x = np.maximum(
+                np.maximum(x[:, 0:h:2, 0:w_:2], x[:, 1:h:2, 0:w_:2]),
+                np.maximum(x[:, 0:h:2, 1:w_:2], x[:, 1:h:2, 1:w_:2]))
+        logits = x.mean(axis=(1, 2)) @ self.fc_w.T + self.fc_b
+        return _softmax(logits)
+
+
+class OnnxModel:
+    """Triage model exported to ONNX (NHWC float input, logits output);
+    labels and input size come from its metadata"""
+
+    def __init__(self, path: str):
+        self.session = onnxruntime.InferenceSession(
+            path, providers=['CPUExecutionProvider'])
+        meta = self.session.get_modelmeta().custom_metadata_map
+        self.labels = meta['labels'].split(',')
+        self.input_size = int(meta.get('input_size', 64))
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch: 'np.ndarray') -> 'np.ndarray':
+        logits = self.session.run(None, {self.input_name: batch})[0]
+        return _softmax(logits)
+
+
+def _softmax(logits: 'np.ndarray') -> 'np.ndarray':
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def load_model(path: str = TRIAGE_MODEL_PATH):
+    """The triage model at `path`, None when there is none"""
+    if not os.path.exists(path):
+        return None
+    try:
+        if path.endswith('.onnx'):
+            if onnxruntime is None:
+                print("ERROR: onnxruntime is needed for the ONNX triage model")
+                return None
+            return OnnxModel(path)
+        return NumpyCNN(path)
+    except Exception as e:
+        print(f"ERROR: Loading triage model {path} failed: {e}")
+        return None
+
+
+class MicroBatcher:
+    """Runs `func` on batches of items submitted from many threads.
+
+    The worker takes the first waiting item, then whatever else arrives
+    within `max_wait` seconds (up to `max_batch` items); `func(items)`
+    returns one result per item.
+    """
+
+    def __init__(self, func: Callable[[List[Any]], List[Any]],
+                 max_batch: int = TRIAGE_MAX_BATCH,
+                 max_wait: float = TRIAGE_MAX_WAIT_MS / 1000,
+                 name: str = 'micro-batcher'):
+        self.func = func
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._stats = Counter()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=name,
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        batches = stats.get('batches', 0)
+        stats['avg_batch_size'] = round(
+            stats.get('items', 0) / batches, 2) if batches else 0.0
+        return stats
+
+    def _run(self) -> None:
+        while True:
+            pending = [self._queue.get()]
+            end = time.monotonic() + self.max_wait
+            while len(pending) < self.max_batch:
+                try:
+                    pending.append(self._queue.get(
+                        timeout=max(0.0, end - time.monotonic())))
+                except queue.Empty:
+                    break
+            pending = [(item, future) for item, future in pending
+                       if future.set_running_or_notify_cancel()]
+            if not pending:
+                continue
+            try:
+                results = self.func([item for item, _ in pending])
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(pending, results):
+                future.set_result(result)
+            with self._lock:
+                self._stats['batches'] += 1
+                self._stats['items'] += len(pending)
+
+
+def decode(data: bytes, size: int = QUALITY_SIZE
+           ) -> Tuple['Image.Image', Tuple[int, int]]:
+    """RGB image resized to size x size, and the original size"""
+    image = Image.open(io.BytesIO(data))
+    original = image.size
+    # Lets the JPEG decoder skip detail we would throw away anyway
+    image.draft('RGB', (size, size))
+    image = image.convert('RGB').resize((size, size), Image.BILINEAR)
+    return image, original
+
+
+def quality_issue(pixels: 'np.ndarray', original: Tuple[int, int]
+                  ) -> Tuple[Optional[str], Dict[str, float]]:
+    """Why an (H, W, 3) image in [0, 1] is unusable (None if it is
+    fine), with the measurements behind the decision"""
+    gray = pixels @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    laplacian = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2]
+                 + gray[1:-1, 2:] - 4 * gray[1:-1, 1:-1])
+    brightness = float(gray.mean())
+    # Variance of the Laplacian in 8-bit units; low means no edges
+    sharpness = float(laplacian.var() * 255 ** 2)
+
+    # Plant-coloured pixels: saturated hues from 20 (orange-yellow) to
+    # 170 degrees (green-cyan); lesions are usually yellow or brown, which
+    # falls in the same range. Worked out per HSV sector, without trig.
+    r, g, b = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+    high = np.maximum(np.maximum(r, g), b)
+    chroma = high - np.minimum(np.minimum(r, g), b)
+    red_sector = (r >= high) & (g - b >= chroma / 3)
+    green_sector = (g >= high) & (r < high) & (b - r <= chroma * 5 / 6)
+    plant = ((red_sector | green_sector) & (chroma > 0.15 * high)
+             & (high > 0.1))
+    plant_fraction = float(plant.mean())
+
+    metrics = {"brightness": round(brightness, 3),
+               "sharpness": round(sharpness, 1),
+               "plant_fraction": round(plant_fraction, 3)}
+    if min(original) < TRIAGE_MIN_SIDE:
+        return 'too_small', metrics
+    if brightness < 0.08:
+        return 'too_dark', metrics
+    if brightness > 0.95:
+        return 'overexposed', metrics
+    if sharpness < TRIAGE_BLUR_THRESHOLD:
+        return 'blurry', metrics
+    return None, metrics
+
+
+class ImageTriage:
+    """Outcome of triaging a query's images"""
+
+    def __init__(self, images: List[Tuple[bytes, str]],
+                 results: List[Dict[str, Any]]):
+        self.results = results
+        # Images still worth sending to the agents
+        self.images = [image for image, result in zip(images, results)
+                       if result['usable'] and not result['diagnosed']]
+        self.usable = any(result['usable'] for result in results)
+
+    @property
+    def hint(self) -> Optional[str]:
+        """Note for the agents about confident diagnoses"""
+        findings = [
+            f"{_describe(result['label'])} ({result['confidence']:.0%} "
+            f"confidence)" for result in self.results
+            if result['usable'] and result.get('hinted')]
+        if not findings:
+            return None
+        return ("Image triage: the farmer's photo most likely shows "
+                + "; ".join(findings) + ". Confirm it fits the question "
+                "before advising treatment.")
+
+    @property
+    def rejection(self) -> Optional[str]:
+        """Answer for the farmer when none of the images can be used"""
+        if self.usable or not self.results:
+            return None
+        reasons = dict.fromkeys(result['reason'] for result in self.results)
+        return " ".join([RETAKE_ADVICE[reason] for reason in reasons]
+                        + [RETAKE_INSTRUCTIONS])
+
+
+def _describe(label: str) -> str:
+    crop, _, disease = label.partition(':')
+    return f"{crop} {disease}".replace('_', ' ')
+
+
+class ImageTriager:
+    """Quality checks plus the (optional) batched triage model"""
+
+    def __init__(self, model=None):
+        self.model = model
+        self.batcher = MicroBatcher(
+            self._predict, name='image-triage') if model else None
+        self._stats = Counter()
+        self._lock = threading.Lock()
+
+    def triage(self, images: List[Tuple[bytes, str]]) -> ImageTriage:
+        started = time.perf_counter()
+        results = []
+        pending = []
+        for data, _ in images:
+            result = {"usable": True, "reason": None, "diagnosed": False}
+            results.append(result)
+            try:
+                image, original = decode(data)
+            except Exception as e:
+                # Leave formats we cannot read to Gemini
+                print(f"DEBUG: Image triage skipped an undecodable image: {e}")
+                continue
+            pixels = np.asarray(image, dtype=np.float32) / 255.0
+            reason, metrics = quality_issue(pixels, original)
+            result.update(metrics)
+            if reason:
+                result.update(usable=False, reason=reason)
+            elif self.batcher is not None:
+                size = self.model.input_size
+                small = image.resize((size, size), Image.BILINEAR)
+                pending.append((result, self.batcher.submit(
+                    np.asarray(small, dtype=np.float32) / 255.0)))
+
+        for result, future in pending:
+            try:
+                probs = future.result(timeout=stage_timeout('image_triage'))
+            except (FutureTimeout, DeadlineExceeded):
+                future.cancel()
+                self._count('model_timeouts')
+                continue
+            except Exception as e:
+                print(f"ERROR: Image triage model failed: {e}")
+                continue
+            self._apply(result, probs)
+
+        for result in results:
+            self._count('images')
+            if not result['usable']:
+                self._count(f"rejected_{result['reason']}")
+            elif result['diagnosed']:
+                self._count('diagnosed')
+            elif result.get('hinted'):
+                self._count('hinted')
+            if result.get('plant_fraction', 1.0) < TRIAGE_MIN_PLANT_FRACTION:
+                self._count('few_plant_pixels')
+        self._count('latency_ms_total', (time.perf_counter() - started) * 1000)
+        return ImageTriage(images, results)
+
+    def _apply(self, result: Dict[str, Any], probs: 'np.ndarray') -> None:
+        best = int(probs.argmax())
+        label = self.model.labels[best]
+        confidence = float(probs[best])
+        result.update(label=label, confidence=round(confidence, 3))
+        if label == NOT_PLANT:
+            if confidence >= TRIAGE_REJECT_CONFIDENCE:
+                result.update(usable=False, reason='no_plant')
+            return
+        if label.endswith(':' + HEALTHY) or confidence < TRIAGE_HINT_CONFIDENCE:
+            return
+        result['hinted'] = True
+        result['diagnosed'] = confidence >= TRIAGE_DIRECT_CONFIDENCE
+
+    def _predict(self, batch: List['np.ndarray']) -> List['np.ndarray']:
+        return list(self.model.predict(np.stack(batch)))
+
+    def _count(self, name: str, amount: float = 1) -> None:
+        with self._lock:
+            self._stats[name] += amount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        images = stats.get('images', 0)
+        stats['avg_latency_ms'] = round(
+            stats.pop('latency_ms_total', 0) / images, 2) if images else 0.0
+        return {
+            "enabled": True,
+            "model": type(self.model).__name__ if self.model else None,
+            "labels": len(self.model.labels) if self.model else 0,
+            "batching": self.batcher.stats() if self.batcher else None,
+            **stats,
+        }
+
+
+_triager = None
+_init_lock = threading.Lock()
+
+
+def get_image_triager() -> Optional[ImageTriager]:
+    """Return the process-wide triager, None when triage is off"""
+    global _triager
+    if not TRIAGE_ENABLED or np is None:
+        return None
+    with _init_lock:
+        if _triager is None:
+            _triager = ImageTriager(load_model())
+        return _triager
+
+
+def triage_images(images: List[Tuple[bytes, str]]) -> Optional[ImageTriage]:
+    triager = get_image_triager()
+    if triager is None or not images:
+        return None
+    return triager.triage(images)
+
+
+def get_triage_stats() -> Dict[str, Any]:
+    triager = get_image_triager()
+    if triager is None:
+        reason = "numpy/Pillow are not installed" if np is None else "disabled"
+        return {"enabled": False, "reason": reason}
+    return triager.stats()
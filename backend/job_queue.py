@@ -0,0 +1,292 @@
+"""
+Persistent job queue for long-running work such as Shikshak media
+generation.
+
+Jobs are stored in a local SQLite file so they survive restarts, picked
+up by a pool of worker threads and optionally reported to a webhook when
+they finish. Identical requests (same kind and dedup key) share one job
+while it is queued or running, and its result for JOB_DEDUP_HOURS after.
+
+Several processes may share the file (the debug reloader runs two).
+Claims are made in write transactions and held under a lease of
+JOB_LEASE_SECONDS; jobs of a process that died are run again once their
+lease has run out. Finished jobs are deleted after JOB_RETENTION_DAYS.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+JOB_DB_PATH = os.getenv(
+    'JOB_DB_PATH',
+    os.path.join(os.path.dirname(__file__), 'var', 'jobs.sqlite3'))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+JOB_WEBHOOK_URL = os.getenv('JOB_WEBHOOK_URL')
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1.0))
+# How long a claimed job may run before another process may take it over
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', 1800))
+# How long a finished job's result answers identical requests
+JOB_DEDUP_HOURS = float(os.getenv('JOB_DEDUP_HOURS', 24))
+JOB_RETENTION_DAYS = float(os.getenv('JOB_RETENTION_DAYS', 7))
+# Finished jobs are pruned every this many completions
+PRUNE_EVERY = 100
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = 'queued', 'running', 'succeeded', \
+    'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    dedup_key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    webhook_url TEXT,
+    owner TEXT,
+    lease_until REAL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_dedup ON jobs (kind, dedup_key, status);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+_handlers: Dict[str, Callable[..., Any]] = {}
+
+
+def register_handler(kind: str, handler: Callable[..., Any]) -> None:
+    """Register the function that executes jobs of `kind`.
+
+    The handler is called with the job payload as keyword arguments and
+    returns a JSON-serializable result.
+    """
+    _handlers[kind] = handler
+
+
+def dedup_key_for(payload: Dict[str, Any]) -> str:
+    """Stable key of a payload; identical requests map to the same key"""
+    normalized = {
+        k: v.strip().lower() if isinstance(v, str) else v
+        for k, v in payload.items()
+    }
+    canonical = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+def _ago(seconds: float) -> str:
+    return (datetime.now() - timedelta(seconds=seconds)).isoformat()
+
+
+class JobQueue:
+    """SQLite-backed job store shared by the API and the workers"""
+
+    def __init__(self, path: str = JOB_DB_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        # Claims of this queue; other processes only take them over once
+        # their lease ran out
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._completed = 0
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(_SCHEMA)
+            columns = {row['name'] for row in self._conn.execute(
+                "PRAGMA table_info(jobs)")}
+            for column in ('owner TEXT', 'lease_until REAL'):
+                if column.split()[0] not in columns:
+                    self._conn.execute(
+                        f"ALTER TABLE jobs ADD COLUMN {column}")
+
+    def enqueue(self, kind: str, payload: Dict[str, Any],
+                webhook_url: Optional[str] = None) -> Tuple[Dict, bool]:
+        """Queue a job, or return the existing one for an identical
+        request. Returns (job, created)."""
+        dedup_key = dedup_key_for(payload)
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE kind = ? AND dedup_key = ? "
+                "AND (status IN (?, ?) OR (status = ? AND updated_at >= ?)) "
+                "ORDER BY created_at DESC LIMIT 1",
+                (kind, dedup_key, QUEUED, RUNNING, SUCCEEDED,
+                 _ago(JOB_DEDUP_HOURS * 3600))).fetchone()
+            if row:
+                return _row_to_job(row), False
+            now = _now()
+            job_id = str(uuid.uuid4())
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, kind, dedup_key, payload, status, "
+                "webhook_url, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, dedup_key,
+                 json.dumps(payload, ensure_ascii=False), QUEUED,
+                 webhook_url or JOB_WEBHOOK_URL, now, now))
+        with self._wakeup:
+            self._wakeup.notify()
+        return self.get(job_id), True
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return _row_to_job(row) if row else None
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """Mark the oldest queued job as running and return it"""
+        now = time.time()
+        with self._lock, self._conn:
+            # Other processes claim from the same file: select and mark
+            # within one write transaction
+            self._conn.execute('BEGIN IMMEDIATE')
+            # Jobs whose process died are run again
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, owner = NULL, updated_at = ? "
+                "WHERE status = ? AND lease_until < ?",
+                (QUEUED, _now(), RUNNING, now))
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = ? "
+                "ORDER BY created_at LIMIT 1", (QUEUED,)).fetchone()
+            if not row:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, owner = ?, lease_until = ?, "
+                "updated_at = ? WHERE job_id = ?",
+                (RUNNING, self.owner, now + JOB_LEASE_SECONDS, _now(),
+                 row['job_id']))
+        job = _row_to_job(row)
+        job['status'] = RUNNING
+        return job
+
+    def complete(self, job_id: str, result: Any = None,
+                 error: Optional[str] = None) -> bool:
+        """Record the outcome of a job this queue claimed; any `error`,
+        even an empty one, fails it. Returns False when the claim was
+        taken over meanwhile (the new owner records the outcome)."""
+        status = FAILED if error is not None else SUCCEEDED
+        with self._lock, self._conn:
+            recorded = self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, "
+                "updated_at = ? WHERE job_id = ? AND owner = ? "
+                "AND status = ?",
+                (status, json.dumps(result, ensure_ascii=False, default=str)
+                 if result is not None else None, error, _now(), job_id,
+                 self.owner, RUNNING)).rowcount
+            self._completed += 1
+            prune = self._completed % PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+        return bool(recorded)
+
+    def prune(self) -> int:
+        """Delete jobs finished more than JOB_RETENTION_DAYS ago"""
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (SUCCEEDED, FAILED,
+                 _ago(JOB_RETENTION_DAYS * 86400))).rowcount
+
+    def wait_for_work(self, timeout: float) -> None:
+        with self._wakeup:
+            self._wakeup.wait(timeout)
+
+
+def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "job_id": row['job_id'],
+        "kind": row['kind'],
+        "payload": json.loads(row['payload']),
+        "status": row['status'],
+        "result": json.loads(row['result']) if row['result'] else None,
+        "error": row['error'],
+        "webhook_url": row['webhook_url'],
+        "created_at": row['created_at'],
+        "updated_at": row['updated_at'],
+    }
+
+
+def _notify_webhook(job: Dict[str, Any]) -> None:
+    try:
+        requests.post(job['webhook_url'], json={
+            "job_id": job['job_id'],
+            "kind": job['kind'],
+            "status": job['status'],
+            "result": job['result'],
+            "error": job['error'],
+        }, timeout=5)
+    except Exception as e:
+        print(f"ERROR: Webhook for job {job['job_id']} failed: {e}")
+
+
+def _worker_loop(jobs: JobQueue) -> None:
+    while True:
+        job = jobs.claim()
+        if job is None:
+            jobs.wait_for_work(JOB_POLL_INTERVAL)
+            continue
+        handler = _handlers.get(job['kind'])
+        started = time.time()
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for job kind {job['kind']}")
+            result = handler(**job['payload'])
+        except Exception as e:
+            # str() of e.g. a bare KeyError() or TimeoutError() is empty
+            error = str(e) or repr(e)
+            print(f"ERROR: Job {job['job_id']} failed: {error}")
+            recorded = jobs.complete(job['job_id'], error=error)
+        else:
+            recorded = jobs.complete(job['job_id'], result=result)
+        print(f"DEBUG: Job {job['job_id']} ({job['kind']}) finished in "
+              f"{time.time() - started:.2f}s")
+        if not recorded:
+            print(f"DEBUG: Job {job['job_id']} was taken over by another "
+                  f"worker")
+            continue
+        finished = jobs.get(job['job_id'])
+        if finished and finished['webhook_url']:
+            _notify_webhook(finished)
+
+
+_queue = None
+_workers = []
+_init_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Return the process-wide job queue"""
+    global _queue
+    with _init_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
+
+
+def start_workers(count: int = JOB_WORKERS) -> None:
+    """Start the worker pool (once per process)"""
+    jobs = get_job_queue()
+    with _init_lock:
+        while len(_workers) < count:
+            worker = threading.Thread(
+                target=_worker_loop, args=(jobs,),
+                name=f'job-worker-{len(_workers)}', daemon=True)
+            worker.start()
+            _workers.append(worker)
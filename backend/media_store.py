@@ -0,0 +1,345 @@
+"""
+Content-addressed media store.
+
+Images are uploaded once, in chunks, and stored under their SHA-256
+digest; requests and responses then reference them by hash instead of
+carrying base64 strings inside the JSON body. Uploading a file that is
+already stored costs nothing. A garbage collector bounds the store by
+total size and age.
+
+Storage goes through the MediaBackend interface; LocalFileBackend keeps
+objects on the local filesystem.
+"""
+
+import base64
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MEDIA_ROOT = os.getenv(
+    'MEDIA_ROOT', os.path.join(os.path.dirname(__file__), 'var', 'media'))
+MEDIA_MAX_BYTES = int(os.getenv('MEDIA_MAX_BYTES', 5 * 1024 ** 3))
+MEDIA_MAX_AGE_DAYS = float(os.getenv('MEDIA_MAX_AGE_DAYS', 30))
+MEDIA_GC_INTERVAL = float(os.getenv('MEDIA_GC_INTERVAL', 3600))
+MEDIA_MAX_OBJECT_BYTES = int(os.getenv('MEDIA_MAX_OBJECT_BYTES',
+                                       20 * 1024 ** 2))
+# Read size when appending an upload chunk
+COPY_BLOCK_BYTES = 1024 * 1024
+# Upload sessions not completed within this window are discarded
+UPLOAD_TTL_SECONDS = 24 * 3600
+
+_DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+def is_valid_digest(digest: str) -> bool:
+    """Whether `digest` is a lowercase hex SHA-256"""
+    return bool(digest) and bool(_DIGEST_PATTERN.match(digest))
+
+
+def sniff_mime_type(head: bytes) -> str:
+    """Guess an image MIME type from its first bytes"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[4:12] in (b'ftypheic', b'ftypheix', b'ftypmif1'):
+        return 'image/heic'
+    return 'application/octet-stream'
+
+
+def decode_base64_image(value: str) -> bytes:
+    """Decode a base64 image, with or without a data: URL prefix"""
+    if value.startswith('data:') and ',' in value:
+        value = value.split(',', 1)[1]
+    return base64.b64decode(value, validate=False)
+
+
+class MediaBackend(ABC):
+    """Where media objects live, addressed by SHA-256 digest"""
+
+    @abstractmethod
+    def exists(self, digest: str) -> bool:
+        ...
+
+    @abstractmethod
+    def put_file(self, digest: str, source_path: str) -> None:
+        """Store the file at `source_path` (consumed) under `digest`"""
+
+    @abstractmethod
+    def open(self, digest: str) -> BinaryIO:
+        ...
+
+    @abstractmethod
+    def delete(self, digest: str) -> None:
+        ...
+
+    @abstractmethod
+    def iter_objects(self) -> Iterator[Tuple[str, int, float]]:
+        """Yield (digest, size in bytes, last access time)"""
+
+
+class LocalFileBackend(MediaBackend):
+    """Objects as files under root/ab/cd/<digest>"""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self._path(digest))
+
+    def put_file(self, digest: str, source_path: str) -> None:
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source_path, path)
+
+    def open(self, digest: str) -> BinaryIO:
+        path = self._path(digest)
+        # Reads count as use, so the age-based collector keeps hot media
+        os.utime(path)
+        return open(path, 'rb')
+
+    def delete(self, digest: str) -> None:
+        try:
+            os.remove(self._path(digest))
+        except FileNotFoundError:
+            pass
+
+    def iter_objects(self) -> Iterator[Tuple[str, int, float]]:
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if is_valid_digest(name):
+                    stat = os.stat(os.path.join(dirpath, name))
+                    yield name, stat.st_size, stat.st_mtime
+
+
+class MediaStore:
+    """Chunked uploads, deduplication and garbage collection on top of a
+    MediaBackend.
+
+    Upload sessions are files in `uploads_dir` (the partial data plus a
+    small JSON sidecar), so they survive restarts and any worker process
+    can continue them.
+    """
+
+    def __init__(self, backend: MediaBackend, uploads_dir: str):
+        self.backend = backend
+        self.uploads_dir = uploads_dir
+        os.makedirs(uploads_dir, exist_ok=True)
+
+    def start_upload(self, expected_digest: Optional[str] = None) -> Dict:
+        """Open an upload session.
+
+        If the client already knows the digest and the object is stored,
+        no session is needed and the existing reference is returned.
+        """
+        if expected_digest is not None:
+            if not is_valid_digest(expected_digest):
+                raise ValueError("sha256 must be 64 lowercase hex characters")
+            if self.backend.exists(expected_digest):
+                return {"sha256": expected_digest, "exists": True}
+        upload_id = uuid.uuid4().hex
+        data_path, meta_path = self._upload_paths(upload_id)
+        open(data_path, 'wb').close()
+        with open(meta_path, 'w') as f:
+            json.dump({"expected_digest": expected_digest}, f)
+        return {"upload_id": upload_id, "offset": 0, "exists": False}
+
+    def upload_offset(self, upload_id: str) -> int:
+        """Bytes received so far for an upload"""
+        return os.path.getsize(self._require_upload(upload_id)[0])
+
+    def append_chunk(self, upload_id: str, offset: int,
+                     stream: BinaryIO) -> int:
+        """Append a chunk written at `offset`; returns the new offset.
+
+        A client that lost a response asks for the current offset and
+        resumes from there instead of re-sending the whole file.
+        """
+        data_path, meta_path = self._require_upload(upload_id)
+        too_large = False
+        with open(data_path, 'ab') as f:
+            # A retried chunk may race the original from another worker;
+            # the offset is only checked once we hold the upload
+            self._lock_upload(f, upload_id, data_path, meta_path)
+            current = f.seek(0, os.SEEK_END)
+            if offset != current:
+                raise ValueError(f"offset mismatch, upload is at {current}")
+            # Never write past the size cap, whatever the body's length
+            remaining = MEDIA_MAX_OBJECT_BYTES - current
+            while True:
+                block = stream.read(min(COPY_BLOCK_BYTES, remaining + 1))
+                if not block:
+                    break
+                if len(block) > remaining:
+                    too_large = True
+                    break
+                f.write(block)
+                remaining -= len(block)
+            new_offset = f.tell()
+        if too_large:
+            self.abort_upload(upload_id)
+            raise ValueError("media exceeds the maximum object size")
+        return new_offset
+
+    def complete_upload(self, upload_id: str) -> Dict:
+        """Hash the uploaded bytes and move them into the store"""
+        data_path, meta_path = self._require_upload(upload_id)
+        with open(meta_path) as f:
+            expected = json.load(f).get("expected_digest")
+        digest = hashlib.sha256()
+        with open(data_path, 'rb') as f:
+            # Held until the file has left the uploads dir, so no chunk
+            # lands in it after hashing
+            self._lock_upload(f, upload_id, data_path, meta_path)
+            head = f.read(16)
+            digest.update(head)
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+            size = f.tell()
+            sha256 = digest.hexdigest()
+            if expected and expected != sha256:
+                self.abort_upload(upload_id)
+                raise ValueError(
+                    "uploaded bytes do not match the given sha256")
+            if self.backend.exists(sha256):
+                os.remove(data_path)
+            else:
+                self.backend.put_file(sha256, data_path)
+            os.remove(meta_path)
+        return {
+            "sha256": sha256,
+            "size": size,
+            "content_type": sniff_mime_type(head),
+        }
+
+    def abort_upload(self, upload_id: str) -> None:
+        for path in self._upload_paths(upload_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def put_bytes(self, data: bytes) -> str:
+        """Store `data` directly and return its digest"""
+        sha256 = hashlib.sha256(data).hexdigest()
+        if not self.backend.exists(sha256):
+            path = os.path.join(self.uploads_dir, f"direct-{uuid.uuid4().hex}")
+            with open(path, 'wb') as f:
+                f.write(data)
+            self.backend.put_file(sha256, path)
+        return sha256
+
+    def exists(self, digest: str) -> bool:
+        return is_valid_digest(digest) and self.backend.exists(digest)
+
+    def read(self, digest: str) -> Tuple[bytes, str]:
+        """Return (bytes, MIME type) of a stored object"""
+        if not self.exists(digest):
+            raise LookupError(f"media {digest} not found")
+        with self.backend.open(digest) as f:
+            data = f.read()
+        return data, sniff_mime_type(data[:16])
+
+    def collect_garbage(self, max_bytes: int = MEDIA_MAX_BYTES,
+                        max_age_days: float = MEDIA_MAX_AGE_DAYS) -> Dict:
+        """Drop objects unused for `max_age_days`, then the least recently
+        used ones until the store fits in `max_bytes`."""
+        now = time.time()
+        cutoff = now - max_age_days * 86400
+        objects = sorted(self.backend.iter_objects(), key=lambda o: o[2])
+        deleted = 0
+        total = sum(size for _, size, _ in objects)
+        for digest, size, accessed in objects:
+            if accessed >= cutoff and total <= max_bytes:
+                break
+            self.backend.delete(digest)
+            total -= size
+            deleted += 1
+        aborted = 0
+        for name in os.listdir(self.uploads_dir):
+            path = os.path.join(self.uploads_dir, name)
+            if os.path.getmtime(path) < now - UPLOAD_TTL_SECONDS:
+                os.remove(path)
+                aborted += 1
+        return {"deleted": deleted, "remaining_bytes": total,
+                "removed_upload_files": aborted}
+
+    def _upload_paths(self, upload_id: str) -> Tuple[str, str]:
+        if not re.match(r'^[0-9a-f]{32}$', upload_id or ''):
+            raise LookupError(f"upload {upload_id} not found")
+        data_path = os.path.join(self.uploads_dir, upload_id)
+        return data_path, data_path + '.json'
+
+    @staticmethod
+    def _lock_upload(f: BinaryIO, upload_id: str, data_path: str,
+                     meta_path: str) -> None:
+        """Take the exclusive lock on an open upload file and make sure the
+        session was not completed or aborted while we waited for it"""
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            current = os.path.samestat(os.fstat(f.fileno()),
+                                       os.stat(data_path))
+        except FileNotFoundError:
+            current = False
+        if not current or not os.path.exists(meta_path):
+            raise LookupError(f"upload {upload_id} not found")
+
+    def _require_upload(self, upload_id: str) -> Tuple[str, str]:
+        data_path, meta_path = self._upload_paths(upload_id)
+        if not os.path.exists(meta_path):
+            raise LookupError(f"upload {upload_id} not found")
+        return data_path, meta_path
+
+
+_store = None
+_gc_thread = None
+_init_lock = threading.Lock()
+
+
+def get_media_store() -> MediaStore:
+    """Return the process-wide store on the local filesystem backend"""
+    global _store
+    with _init_lock:
+        if _store is None:
+            _store = MediaStore(
+                LocalFileBackend(os.path.join(MEDIA_ROOT, 'objects')),
+                os.path.join(MEDIA_ROOT, 'uploads'))
+        return _store
+
+
+def start_garbage_collector(interval: float = MEDIA_GC_INTERVAL) -> None:
+    """Run collect_garbage every `interval` seconds in a daemon thread"""
+    global _gc_thread
+    store = get_media_store()
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                result = store.collect_garbage()
+                print(f"DEBUG: Media GC: {result}")
+            except Exception as e:
+                print(f"ERROR: Media GC failed: {e}")
+
+    with _init_lock:
+        if _gc_thread is None:
+            _gc_thread = threading.Thread(
+                target=run, name='media-gc', daemon=True)
+            _gc_thread.start()
@@ -0,0 +1,434 @@
+"""
+Messaging ingestion for SMS, WhatsApp and IVR gateways.
+
+Gateways deliver messages by webhook, often in bursts, and expect a
+quick acknowledgement. /api/messages/inbound only writes the messages to
+a local SQLite queue and answers 202; redeliveries with the same gateway
+message id are ignored.
+
+A dispatcher thread claims work in batches for a pool of
+MESSAGING_WORKERS threads. A claim takes all queued messages of a farmer
+(so fragments of one question sent as several SMS are answered together)
+and never a farmer whose earlier messages are still being answered, which
+keeps each farmer's messages in order. Replies go into an outbound table
+and are handed to the sender registered for the channel, oldest first
+per recipient, with exponential backoff on failure.
+
+Several processes may share the queue file (the debug reloader runs two).
+Claims are made in write transactions and held under a lease for
+MESSAGING_LEASE_SECONDS; messages and replies of a process that died are
+taken over once its lease runs out.
+
+Queue depth, the age of the oldest waiting message and delivery counts
+are reported by get_messaging_stats.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+from dotenv import load_dotenv
+
+from deadlines import REQUEST_TIMEOUT_SECONDS
+
+load_dotenv()
+
+MESSAGING_DB_PATH = os.getenv(
+    'MESSAGING_DB_PATH',
+    os.path.join(os.path.dirname(__file__), 'var', 'messages.sqlite3'))
+MESSAGING_WORKERS = int(os.getenv('MESSAGING_WORKERS', 4))
+MESSAGING_POLL_INTERVAL = float(os.getenv('MESSAGING_POLL_INTERVAL', 1.0))
+# Messages of one farmer answered together at most
+MESSAGING_MAX_COALESCED = int(os.getenv('MESSAGING_MAX_COALESCED', 5))
+# Where the default sender POSTs replies; without it replies are logged
+MESSAGING_OUTBOUND_URL = os.getenv('MESSAGING_OUTBOUND_URL')
+MESSAGING_SEND_ATTEMPTS = int(os.getenv('MESSAGING_SEND_ATTEMPTS', 6))
+MESSAGING_RETRY_BASE_SECONDS = float(os.getenv('MESSAGING_RETRY_BASE_SECONDS', 2))
+MESSAGING_RETRY_MAX_SECONDS = 300
+# How long a claim is held before another process may take it over
+MESSAGING_LEASE_SECONDS = float(os.getenv(
+    'MESSAGING_LEASE_SECONDS', 2 * REQUEST_TIMEOUT_SECONDS + 30))
+
+FALLBACK_REPLY = ("Sorry, we could not answer your message right now. "
+                  "Please send it again in a little while.")
+
+QUEUED, PROCESSING, DONE, FAILED = 'queued', 'processing', 'done', 'failed'
+PENDING, SENT = 'pending', 'sent'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS inbound_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    gateway_id TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    farmer_key TEXT NOT NULL,
+    farmer_id TEXT,
+    native_language TEXT,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL,
+    query_id TEXT,
+    error TEXT,
+    owner TEXT,
+    lease_until REAL,
+    received_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (channel, gateway_id)
+);
+CREATE INDEX IF NOT EXISTS inbound_status
+    ON inbound_messages (status, farmer_key, id);
+CREATE TABLE IF NOT EXISTS outbound_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    text TEXT NOT NULL,
+    in_reply_to TEXT NOT NULL,
+    query_id TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    received_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS outbound_due
+    ON outbound_messages (status, next_attempt_at);
+"""
+
+
+class PermanentSendError(Exception):
+    """The gateway refused the reply for good (e.g. invalid number)"""
+
+
+_senders: Dict[str, Callable[[Dict[str, Any]], None]] = {}
+
+
+def register_sender(channel: str, sender: Callable[[Dict[str, Any]], None]) -> None:
+    """Register the function that delivers replies on `channel`.
+
+    The sender is called with a dict of channel, recipient, text,
+    in_reply_to and query_id. Raising retries the delivery later;
+    PermanentSendError fails it at once.
+    """
+    _senders[channel] = sender
+
+
+def http_sender(message: Dict[str, Any]) -> None:
+    """Default sender: POST the reply as JSON to MESSAGING_OUTBOUND_URL,
+    or log it when no URL is configured"""
+    if not MESSAGING_OUTBOUND_URL:
+        print(f"DEBUG: Reply to {message['channel']}:{message['recipient']}: "
+              f"{message['text'][:80]}")
+        return
+    resp = requests.post(MESSAGING_OUTBOUND_URL, json=message, timeout=10)
+    if 400 <= resp.status_code < 500 and resp.status_code not in (408, 429):
+        raise PermanentSendError(f"Gateway returned {resp.status_code}")
+    resp.raise_for_status()
+
+
+def _farmer_key(message: Dict[str, Any]) -> str:
+    return message.get('farmer_id') or f"{message['channel']}:{message['sender']}"
+
+
+class MessageQueue:
+    """SQLite queue of inbound messages and outbound replies"""
+
+    def __init__(self, path: str = MESSAGING_DB_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stats = Counter()
+        self._answer_seconds = 0.0
+        # Claims of this queue; other processes only take them over once
+        # their lease ran out
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(_SCHEMA)
+            columns = {row['name'] for row in self._conn.execute(
+                "PRAGMA table_info(inbound_messages)")}
+            for column in ('owner TEXT', 'lease_until REAL'):
+                if column.split()[0] not in columns:
+                    self._conn.execute(
+                        f"ALTER TABLE inbound_messages ADD COLUMN {column}")
+
+    def enqueue(self, messages: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """Store gateway messages. Returns (accepted, duplicates)."""
+        now = time.time()
+        accepted = 0
+        with self._lock, self._conn:
+            for message in messages:
+                accepted += self._conn.execute(
+                    "INSERT OR IGNORE INTO inbound_messages (channel, "
+                    "gateway_id, sender, farmer_key, farmer_id, "
+                    "native_language, text, status, received_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (message['channel'],
+                     message.get('message_id') or str(uuid.uuid4()),
+                     message['sender'], _farmer_key(message),
+                     message.get('farmer_id'), message.get('native_language'),
+                     message['text'], QUEUED, now, now)).rowcount
+            self._stats['received'] += accepted
+            self._stats['duplicates'] += len(messages) - accepted
+        if accepted:
+            self.notify()
+        return accepted, len(messages) - accepted
+
+    def notify(self) -> None:
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def wait_for_work(self, timeout: float) -> None:
+        with self._wakeup:
+            self._wakeup.wait(timeout)
+
+    def claim(self, max_farmers: int) -> List[List[Dict[str, Any]]]:
+        """Queued messages of up to `max_farmers` farmers with nothing in
+        progress, oldest farmer first, each group in arrival order"""
+        groups = []
+        now = time.time()
+        with self._lock, self._conn:
+            # Other processes claim from the same file: select and mark
+            # within one write transaction
+            self._conn.execute('BEGIN IMMEDIATE')
+            # Messages whose answering process died are answered again
+            self._stats['taken_over'] += self._conn.execute(
+                "UPDATE inbound_messages SET status = ?, owner = NULL "
+                "WHERE status = ? AND lease_until < ?",
+                (QUEUED, PROCESSING, now)).rowcount
+            farmers = self._conn.execute(
+                "SELECT farmer_key FROM inbound_messages WHERE status = ? "
+                "AND farmer_key NOT IN (SELECT farmer_key FROM "
+                "inbound_messages WHERE status = ?) "
+                "GROUP BY farmer_key ORDER BY MIN(id) LIMIT ?",
+                (QUEUED, PROCESSING, max_farmers)).fetchall()
+            for farmer in farmers:
+                rows = self._conn.execute(
+                    "SELECT * FROM inbound_messages WHERE status = ? "
+                    "AND farmer_key = ? ORDER BY id LIMIT ?",
+                    (QUEUED, farmer['farmer_key'],
+                     MESSAGING_MAX_COALESCED)).fetchall()
+                self._conn.executemany(
+                    "UPDATE inbound_messages SET status = ?, owner = ?, "
+                    "lease_until = ?, updated_at = ? WHERE id = ?",
+                    [(PROCESSING, self.owner, now + MESSAGING_LEASE_SECONDS,
+                      now, row['id']) for row in rows])
+                groups.append([dict(row) for row in rows])
+        return groups
+
+    def answered(self, group: List[Dict[str, Any]], reply: str,
+                 query_id: Optional[str] = None,
+                 error: Optional[str] = None) -> None:
+        """Finish a claimed group and queue its reply, unless the claim
+        was taken over meanwhile (the new owner replies)"""
+        now = time.time()
+        last = group[-1]
+        with self._lock, self._conn:
+            finished = self._conn.executemany(
+                "UPDATE inbound_messages SET status = ?, query_id = ?, "
+                "error = ?, updated_at = ? "
+                "WHERE id = ? AND owner = ? AND status = ?",
+                [(FAILED if error else DONE, query_id, error, now, m['id'],
+                  self.owner, PROCESSING) for m in group]).rowcount
+            if finished < len(group):
+                self._stats['lost_claims'] += 1
+                return
+            self._conn.execute(
+                "INSERT INTO outbound_messages (channel, recipient, text, "
+                "in_reply_to, query_id, status, next_attempt_at, received_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (last['channel'], last['sender'], reply, last['gateway_id'],
+                 query_id, PENDING, now, group[0]['received_at']))
+            self._stats['answered'] += len(group)
+            self._stats['coalesced'] += len(group) - 1
+            self._stats['answer_failures'] += int(bool(error))
+        self.notify()
+
+    def due_replies(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Replies due for delivery, only the oldest pending one per
+        recipient so that replies arrive in order. Each is leased to this
+        process: it comes due again only if no outcome is recorded."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            rows = self._conn.execute(
+                "SELECT o.* FROM outbound_messages o JOIN ("
+                "SELECT channel, recipient, MIN(id) AS id "
+                "FROM outbound_messages WHERE status = ? "
+                "GROUP BY channel, recipient) first ON o.id = first.id "
+                "WHERE o.next_attempt_at <= ? ORDER BY o.id LIMIT ?",
+                (PENDING, now, limit)).fetchall()
+            self._conn.executemany(
+                "UPDATE outbound_messages SET next_attempt_at = ? "
+                "WHERE id = ?",
+                [(now + MESSAGING_LEASE_SECONDS, row['id']) for row in rows])
+        return [dict(row) for row in rows]
+
+    def delivered(self, reply_id: int) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT received_at FROM outbound_messages WHERE id = ?",
+                (reply_id,)).fetchone()
+            self._conn.execute(
+                "UPDATE outbound_messages SET status = ?, sent_at = ?, "
+                "attempts = attempts + 1 WHERE id = ?", (SENT, now, reply_id))
+            self._stats['sent'] += 1
+            self._answer_seconds += now - row['received_at']
+
+    def delivery_failed(self, reply: Dict[str, Any], error: str,
+                        permanent: bool = False) -> None:
+        attempts = reply['attempts'] + 1
+        give_up = permanent or attempts >= MESSAGING_SEND_ATTEMPTS
+        delay = min(MESSAGING_RETRY_MAX_SECONDS,
+                    MESSAGING_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE outbound_messages SET status = ?, attempts = ?, "
+                "next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (FAILED if give_up else PENDING, attempts,
+                 time.time() + delay, error, reply['id']))
+            self._stats['send_failures' if give_up else 'send_retries'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            inbound = {row['status']: row['count'] for row in self._conn.execute(
+                "SELECT status, COUNT(*) AS count FROM inbound_messages "
+                "WHERE status IN (?, ?) GROUP BY status", (QUEUED, PROCESSING))}
+            outbound = {row['status']: row['count'] for row in self._conn.execute(
+                "SELECT status, COUNT(*) AS count FROM outbound_messages "
+                "WHERE status IN (?, ?) GROUP BY status", (PENDING, FAILED))}
+            oldest = self._conn.execute(
+                "SELECT MIN(received_at) FROM inbound_messages "
+                "WHERE status = ?", (QUEUED,)).fetchone()[0]
+            oldest_reply = self._conn.execute(
+                "SELECT MIN(received_at) FROM outbound_messages "
+                "WHERE status = ?", (PENDING,)).fetchone()[0]
+            counters = dict(self._stats)
+            answer_seconds = self._answer_seconds
+        return {
+            "queued": inbound.get(QUEUED, 0),
+            "processing": inbound.get(PROCESSING, 0),
+            "replies_pending": outbound.get(PENDING, 0),
+            "replies_failed": outbound.get(FAILED, 0),
+            "lag_seconds": round(now - oldest, 1) if oldest else 0.0,
+            "oldest_unsent_reply_seconds": round(now - oldest_reply, 1)
+            if oldest_reply else 0.0,
+            "avg_seconds_to_reply": round(answer_seconds / counters['sent'], 2)
+            if counters.get('sent') else None,
+            **counters,
+        }
+
+
+class MessagingWorkers:
+    """Dispatcher, answering pool and reply sender for a MessageQueue"""
+
+    def __init__(self, queue: MessageQueue,
+                 answer: Callable[[Dict[str, Any], str], Tuple[str, str]],
+                 workers: int = MESSAGING_WORKERS):
+        self.queue = queue
+        self.answer = answer
+        self.workers = workers
+        self._free = threading.Semaphore(workers)
+        self._pool = ThreadPoolExecutor(max_workers=workers,
+                                        thread_name_prefix='messaging')
+
+    def start(self) -> None:
+        threading.Thread(target=self._dispatch_loop, name='messaging-dispatch',
+                         daemon=True).start()
+        threading.Thread(target=self._send_loop, name='messaging-send',
+                         daemon=True).start()
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            self._free.acquire()
+            # Claim as many farmers as there are free workers
+            free = 1
+            while self._free.acquire(blocking=False):
+                free += 1
+            groups = self.queue.claim(free)
+            for _ in range(free - len(groups)):
+                self._free.release()
+            for group in groups:
+                self._pool.submit(self._answer_group, group)
+            if not groups:
+                self.queue.wait_for_work(MESSAGING_POLL_INTERVAL)
+
+    def _answer_group(self, group: List[Dict[str, Any]]) -> None:
+        text = '\n'.join(m['text'] for m in group)
+        try:
+            query_id, reply = self.answer(group[-1], text)
+            self.queue.answered(group, reply, query_id)
+        except Exception as e:
+            print(f"ERROR: Answering messages from {group[0]['farmer_key']} "
+                  f"failed: {e}")
+            self.queue.answered(group, FALLBACK_REPLY, error=str(e))
+        finally:
+            self._free.release()
+            self.queue.notify()
+
+    def _send_loop(self) -> None:
+        while True:
+            replies = self.queue.due_replies()
+            for reply in replies:
+                self._send(reply)
+            if not replies:
+                self.queue.wait_for_work(MESSAGING_POLL_INTERVAL)
+
+    def _send(self, reply: Dict[str, Any]) -> None:
+        sender = _senders.get(reply['channel'], http_sender)
+        try:
+            sender({k: reply[k] for k in ('channel', 'recipient', 'text',
+                                           'in_reply_to', 'query_id')})
+        except PermanentSendError as e:
+            print(f"ERROR: Reply {reply['id']} refused by gateway: {e}")
+            self.queue.delivery_failed(reply, str(e), permanent=True)
+        except Exception as e:
+            print(f"ERROR: Sending reply {reply['id']} failed: {e}")
+            self.queue.delivery_failed(reply, str(e))
+        else:
+            self.queue.delivered(reply['id'])
+
+
+_queue = None
+_workers = None
+_init_lock = threading.Lock()
+
+
+def get_message_queue() -> MessageQueue:
+    """Return the process-wide message queue"""
+    global _queue
+    with _init_lock:
+        if _queue is None:
+            _queue = MessageQueue()
+        return _queue
+
+
+def start_messaging(answer: Callable[[Dict[str, Any], str], Tuple[str, str]]
+                    ) -> MessagingWorkers:
+    """Start answering queued messages (once per process).
+
+    `answer(message, text)` gets the farmer's latest message and the
+    combined text of the claimed messages and returns (query_id, reply).
+    """
+    global _workers
+    queue = get_message_queue()
+    with _init_lock:
+        if _workers is None:
+            _workers = MessagingWorkers(queue, answer)
+            _workers.start()
+        return _workers
+
+
+def get_messaging_stats() -> Dict[str, Any]:
+    stats = get_message_queue().stats()
+    stats["workers"] = _workers.workers if _workers else 0
+    return stats
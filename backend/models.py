@@ -11,6 +11,8 @@ class FarmerCreate(BaseModel):
     city: str = Field(..., description="Farmer's city")
     contact_number: str = Field(..., description="Farmer's contact number")
     native_language: str = Field(..., description="Farmer's native language")
+    crops: List[str] = Field(default_factory=list, description="Crops the farmer grows")
+    experience_level: Optional[str] = Field(None, description="beginner, intermediate or experienced")
 
     class Config:
         schema_extra = {
@@ -19,7 +21,9 @@ class FarmerCreate(BaseModel):
                 "state": "Maharashtra",
                 "city": "Mumbai",
                 "contact_number": "+91-9876543210",
-                "native_language": "Hindi"
+                "native_language": "Hindi",
+                "crops": ["tomato", "onion"],
+                "experience_level": "intermediate"
             }
         }
 
@@ -32,6 +36,8 @@ class FarmerResponse(BaseModel):
     city: str = Field(..., description="Farmer's city")
     contact_number: str = Field(..., description="Farmer's contact number")
     native_language: str = Field(..., description="Farmer's native language")
+    crops: List[str] = Field(default_factory=list, description="Crops the farmer grows")
+    experience_level: Optional[str] = Field(None, description="beginner, intermediate or experienced")
     created_at: str = Field(..., description="Creation timestamp")
     updated_at: str = Field(..., description="Last update timestamp")
 
@@ -47,6 +53,8 @@ class FarmerResponse(BaseModel):
             city=farmer_create.city,
             contact_number=farmer_create.contact_number,
             native_language=farmer_create.native_language,
+            crops=farmer_create.crops,
+            experience_level=farmer_create.experience_level,
             created_at=now,
             updated_at=now
         )
@@ -60,6 +68,8 @@ class FarmerResponse(BaseModel):
                 "city": "Mumbai",
                 "contact_number": "+91-9876543210",
                 "native_language": "Hindi",
+                "crops": ["tomato", "onion"],
+                "experience_level": "intermediate",
                 "created_at": "2024-01-01T12:00:00",
                 "updated_at": "2024-01-01T12:00:00"
             }
@@ -74,6 +84,9 @@ class UserQueryRequest(BaseModel):
     voice_input_text: Optional[str] = Field(None, description="Voice input text")
     image_input: Optional[str] = Field(None, description="Base64 image")
     image_inputs: Optional[List[str]] = Field(None, description="List of base64 images")
+    image_refs: Optional[List[str]] = Field(None, description="SHA-256 hashes of images uploaded to /api/media")
+    omit_duplicate_voice: Optional[bool] = Field(False, description="Leave voice_response_text out of the response when it equals text_response")
+    idempotency_key: Optional[str] = Field(None, description="Client key that makes retries of this request return the first response (same as the Idempotency-Key header)")
 
     class Config:
         schema_extra = {
@@ -83,7 +96,9 @@ class UserQueryRequest(BaseModel):
                 "text_input": "What's the weather like today?",
                 "voice_input_text": None,
                 "image_input": None,
-                "image_inputs": None
+                "image_inputs": None,
+                "image_refs": ["9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"],
+                "idempotency_key": "6f1c2a9e-3b7d-4e15-9a0c-8d2f4b6e1a37"
             }
         }
 
@@ -91,9 +106,11 @@ class UserQueryRequest(BaseModel):
 class UserQueryResponse(BaseModel):
     """Model for user query response"""
     text_response: str = Field(..., description="Text response to the query")
-    voice_response_text: str = Field(..., description="Voice response as text")
+    voice_response_text: str = Field(..., description="Voice response as text; absent when omit_duplicate_voice was requested and it equals text_response")
     image_response: Optional[str] = Field(None, description="Base64 encoded image response")
     image_responses: Optional[List[str]] = Field(None, description="List of base64 image responses")
+    image_response_refs: Optional[List[str]] = Field(None, description="SHA-256 hashes of response images, served from /api/media")
+    partial: bool = Field(False, description="True when the answer was cut short by the request deadline")
     native_language: str = Field(..., description="Response in native language")
     query_id: str = Field(..., description="Unique identifier for the query")
 
@@ -104,12 +121,76 @@ class UserQueryResponse(BaseModel):
                 "voice_response_text": "The weather is sunny today with temperature around 30°C.",
                 "image_response": "base64_encoded_image_data",
                 "image_responses": ["base64_encoded_image_1", "base64_encoded_image_2"],
+                "image_response_refs": ["60303ae22b998861bce3b28f33eec1be758a213c86c93c076dbe9f558c11c752"],
                 "native_language": "आज मौसम धूप है और तापमान लगभग 30°C है।",
                 "query_id": "query-12345"
             }
         }
 
 
+class MediaUploadRequest(BaseModel):
+    """Model for opening a media upload"""
+    sha256: Optional[str] = Field(None, description="SHA-256 of the file, if known; skips the upload when already stored")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "sha256": "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"
+            }
+        }
+
+
+class InboundMessage(BaseModel):
+    """Model for a message delivered by an SMS, WhatsApp or IVR gateway"""
+    channel: str = Field(..., description="Gateway channel, e.g. sms, whatsapp or ivr")
+    sender: str = Field(..., description="Sender address on the channel (phone number)")
+    text: str = Field(..., description="Message text (IVR: the transcribed speech)")
+    message_id: Optional[str] = Field(None, description="Gateway's message id; redeliveries with the same id are ignored")
+    farmer_id: Optional[str] = Field(None, description="Registered farmer id, when the gateway knows it")
+    native_language: Optional[str] = Field(None, description="Language to answer in; defaults to the farmer's")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "channel": "sms",
+                "sender": "+919845012345",
+                "text": "ಟೊಮೇಟೊ ಬೆಲೆ ಎಷ್ಟು?",
+                "message_id": "SM5f2c9a1e",
+                "farmer_id": None,
+                "native_language": "Kannada"
+            }
+        }
+
+
+class MediaRef(BaseModel):
+    """Model for a stored media object"""
+    sha256: str = Field(..., description="SHA-256 of the media bytes")
+    size: Optional[int] = Field(None, description="Size in bytes")
+    content_type: Optional[str] = Field(None, description="Detected MIME type")
+
+
+class JobStatusResponse(BaseModel):
+    """Model for background job status"""
+    job_id: str = Field(..., description="Unique identifier for the job")
+    kind: str = Field(..., description="Type of work the job performs")
+    status: str = Field(..., description="queued, running, succeeded or failed")
+    error: Optional[str] = Field(None, description="Failure reason")
+    created_at: str = Field(..., description="Creation timestamp")
+    updated_at: str = Field(..., description="Last update timestamp")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "job_id": "7c9e6679-7425-40de-944b-e07fc1f90ae7",
+                "kind": "educational_video",
+                "status": "running",
+                "error": None,
+                "created_at": "2024-01-01T12:00:00",
+                "updated_at": "2024-01-01T12:00:05"
+            }
+        }
+
+
 class APIResponse(BaseModel):
     """Standard API response model"""
     message: str = Field(..., description="Response message")
@@ -0,0 +1,417 @@
+"""
+Precomputed answers to the most frequent questions.
+
+Most traffic in a district and language is a few hundred intents (local
+prices, the rain outlook, PM-KISAN status, common tomato diseases). A
+nightly batch mines the top intents from the analytics Parquet files,
+runs each once through the agents (a bounded worker pool within a
+request-rate and token budget) and stores the answers as a new version
+of a lookup table keyed by (intent, district, language):
+
+    python precompute.py run          # e.g. from cron at 02:00
+    python precompute.py mine         # only list the top intents
+
+A version becomes visible to the request path only once it has been
+fully written; the query handler then answers matching questions from
+it without a live LLM call. Answers older than PRECOMPUTE_MAX_AGE_HOURS
+are not served.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+import analytics
+from analytics import ANALYTICS_DIR, pa
+
+try:
+    import pyarrow.dataset as pads
+except ImportError:
+    pads = None
+
+load_dotenv()
+
+PRECOMPUTE_ENABLED = os.getenv('PRECOMPUTE_ENABLED', 'true').lower() != 'false'
+PRECOMPUTE_DB_PATH = os.getenv(
+    'PRECOMPUTE_DB_PATH',
+    os.path.join(os.path.dirname(__file__), 'var', 'precomputed.sqlite3'))
+# Intents kept per (district, language), and how often one must have been
+# asked in the lookback window to qualify
+PRECOMPUTE_TOP_INTENTS = int(os.getenv('PRECOMPUTE_TOP_INTENTS', 300))
+PRECOMPUTE_MIN_COUNT = int(os.getenv('PRECOMPUTE_MIN_COUNT', 3))
+PRECOMPUTE_LOOKBACK_DAYS = int(os.getenv('PRECOMPUTE_LOOKBACK_DAYS', 7))
+PRECOMPUTE_CONCURRENCY = int(os.getenv('PRECOMPUTE_CONCURRENCY', 4))
+PRECOMPUTE_RATE_PER_MINUTE = float(os.getenv('PRECOMPUTE_RATE_PER_MINUTE', 60))
+# Input plus output tokens one run may spend; 0 for no limit
+PRECOMPUTE_TOKEN_BUDGET = int(os.getenv('PRECOMPUTE_TOKEN_BUDGET', 2000000))
+PRECOMPUTE_MAX_AGE_HOURS = float(os.getenv('PRECOMPUTE_MAX_AGE_HOURS', 26))
+PRECOMPUTE_KEEP_VERSIONS = int(os.getenv('PRECOMPUTE_KEEP_VERSIONS', 3))
+# Seconds the request path caches which version is current
+ACTIVE_VERSION_TTL = 60
+
+BUILDING, PUBLISHED, ABANDONED = 'building', 'published', 'abandoned'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answer_versions (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    status TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    intents INTEGER NOT NULL DEFAULT 0,
+    answered INTEGER NOT NULL DEFAULT 0,
+    tokens INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS precomputed_answers (
+    version INTEGER NOT NULL,
+    intent TEXT NOT NULL,
+    district TEXT NOT NULL,
+    language TEXT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    agent TEXT,
+    domains TEXT NOT NULL,
+    asked INTEGER NOT NULL,
+    PRIMARY KEY (version, intent, district, language)
+);
+"""
+
+# Words that do not change what is being asked
+_FILLER_WORDS = frozenset(
+    "a an the is are was please pls tell me my i what whats what's can you "
+    "could would kindly about for of to today now".split())
+
+
+def normalize_intent(question: str) -> str:
+    """Key under which phrasings of the same question are grouped.
+
+    Case, punctuation, symbols and filler words are dropped; vowel signs
+    of Indic scripts are kept.
+    """
+    text = unicodedata.normalize('NFKC', question).lower()
+    text = ''.join(
+        ' ' if unicodedata.category(ch)[0] in 'PS' else ch for ch in text)
+    words = [w for w in text.split() if w not in _FILLER_WORDS]
+    return ' '.join(words)
+
+
+def _district_key(district: Optional[str]) -> str:
+    return (district or '').strip().lower()
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def mine_top_intents(directory: str = ANALYTICS_DIR,
+                     lookback_days: int = PRECOMPUTE_LOOKBACK_DAYS,
+                     top_n: int = PRECOMPUTE_TOP_INTENTS,
+                     min_count: int = PRECOMPUTE_MIN_COUNT
+                     ) -> List[Dict[str, Any]]:
+    """Most asked intents per (district, language) in the query logs.
+
+    Only answered text questions from farmers with a known district are
+    counted. Each intent comes with its most common phrasing, which is
+    the question the batch asks the agents.
+    """
+    if pads is None:
+        raise RuntimeError("pyarrow is required to mine the query logs")
+    if not os.path.isdir(directory):
+        return []
+    schema = analytics.QUERY_SCHEMA
+    since = datetime.now(timezone.utc) - timedelta(days=lookback_days)
+    # Files written before a column was added read it as null
+    dataset = pads.dataset(directory, format='parquet', schema=schema,
+                           partitioning='hive', exclude_invalid_files=True)
+    field = pads.field
+    table = dataset.to_table(
+        columns=['question', 'district', 'state', 'native_language'],
+        filter=(field('ts') >= pa.scalar(since, schema.field('ts').type))
+        & (field('status') == 'ok') & (field('image_count') == 0)
+        & field('district').is_valid())
+
+    counts = Counter()
+    phrasings = {}
+    states = {}
+    for row in table.to_pylist():
+        intent = normalize_intent(row['question'])
+        if not intent:
+            continue
+        key = (intent, _district_key(row['district']), row['native_language'])
+        counts[key] += 1
+        phrasings.setdefault(key, Counter())[row['question'].strip()] += 1
+        states[key] = row['state']
+
+    by_cohort = {}
+    for key, asked in counts.most_common():
+        if asked < min_count:
+            break
+        cohort = by_cohort.setdefault(key[1:], [])
+        if len(cohort) < top_n:
+            cohort.append({
+                "intent": key[0], "district": key[1], "state": states[key],
+                "language": key[2], "asked": asked,
+                "question": phrasings[key].most_common(1)[0][0],
+            })
+    return [intent for cohort in by_cohort.values() for intent in cohort]
+
+
+class RateLimiter:
+    """Spaces calls evenly to at most `per_minute` a minute"""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(max(0.0, start - now))
+
+
+class AnswerBank:
+    """Versioned SQLite table of precomputed answers"""
+
+    def __init__(self, path: str = PRECOMPUTE_DB_PATH,
+                 max_age_hours: float = PRECOMPUTE_MAX_AGE_HOURS):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_age_hours = max_age_hours
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._active = None  # (version, finished_at, checked_at)
+        self._stats = Counter()
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(_SCHEMA)
+
+    def lookup(self, question: str, district: Optional[str],
+               language: str) -> Optional[Dict[str, Any]]:
+        """Current precomputed answer to `question`, or None"""
+        version = self._active_version()
+        with self._lock:
+            self._stats['lookups'] += 1
+            if version is None or not district:
+                return None
+            row = self._conn.execute(
+                "SELECT answer, agent, domains FROM precomputed_answers "
+                "WHERE version = ? AND intent = ? AND district = ? "
+                "AND language = ?",
+                (version, normalize_intent(question), _district_key(district),
+                 language)).fetchone()
+            if row is None:
+                return None
+            self._stats['hits'] += 1
+        return {"answer": row['answer'], "agent": row['agent'],
+                "domains": json.loads(row['domains']), "version": version}
+
+    def _active_version(self) -> Optional[int]:
+        now = time.monotonic()
+        with self._lock:
+            if self._active is None or now - self._active[2] > ACTIVE_VERSION_TTL:
+                row = self._conn.execute(
+                    "SELECT version, finished_at FROM answer_versions "
+                    "WHERE status = ? ORDER BY version DESC LIMIT 1",
+                    (PUBLISHED,)).fetchone()
+                self._active = (row['version'], row['finished_at'], now) \
+                    if row else (None, None, now)
+            version, finished_at, _ = self._active
+        if version is None:
+            return None
+        age = datetime.now(timezone.utc) - datetime.fromisoformat(finished_at)
+        if age > timedelta(hours=self.max_age_hours):
+            return None
+        return version
+
+    def begin_version(self, intents: int) -> int:
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO answer_versions (status, started_at, intents) "
+                "VALUES (?, ?, ?)", (BUILDING, _now(), intents))
+            return cursor.lastrowid
+
+    def store(self, version: int, intent: Dict[str, Any], answer: str,
+              agent: Optional[str], domains: List[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO precomputed_answers (version, intent, "
+                "district, language, question, answer, agent, domains, asked) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (version, intent['intent'], intent['district'],
+                 intent['language'], intent['question'], answer, agent,
+                 json.dumps(domains), intent['asked']))
+
+    def finish_version(self, version: int, answered: int, tokens: int,
+                       publish: bool = True,
+                       keep: int = PRECOMPUTE_KEEP_VERSIONS) -> None:
+        """Publish (or abandon) a version and drop all but the newest
+        `keep` published ones"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE answer_versions SET status = ?, finished_at = ?, "
+                "answered = ?, tokens = ? WHERE version = ?",
+                (PUBLISHED if publish else ABANDONED, _now(), answered,
+                 tokens, version))
+            kept = [row[0] for row in self._conn.execute(
+                "SELECT version FROM answer_versions WHERE status = ? "
+                "ORDER BY version DESC LIMIT ?", (PUBLISHED, keep))]
+            stale = [row[0] for row in self._conn.execute(
+                "SELECT version FROM answer_versions WHERE status != ? "
+                "AND version NOT IN (%s)" % ','.join('?' * len(kept)),
+                (BUILDING, *kept))]
+            for old in stale:
+                self._conn.execute(
+                    "DELETE FROM precomputed_answers WHERE version = ?", (old,))
+                self._conn.execute(
+                    "DELETE FROM answer_versions WHERE version = ?", (old,))
+            self._active = None
+
+    def stats(self) -> Dict[str, Any]:
+        version = self._active_version()
+        with self._lock:
+            counters = dict(self._stats)
+            entries = self._conn.execute(
+                "SELECT COUNT(*) FROM precomputed_answers WHERE version = ?",
+                (version,)).fetchone()[0] if version else 0
+            versions = [dict(row) for row in self._conn.execute(
+                "SELECT * FROM answer_versions ORDER BY version DESC LIMIT 5")]
+        lookups = counters.get('lookups', 0)
+        return {
+            "enabled": PRECOMPUTE_ENABLED,
+            "active_version": version,
+            "entries": entries,
+            "hit_rate": round(counters.get('hits', 0) / lookups, 3)
+            if lookups else 0.0,
+            "versions": versions,
+            **counters,
+        }
+
+
+def run_precompute(pipeline, intents: List[Dict[str, Any]],
+                   bank: 'AnswerBank',
+                   concurrency: int = PRECOMPUTE_CONCURRENCY,
+                   rate_per_minute: float = PRECOMPUTE_RATE_PER_MINUTE,
+                   token_budget: int = PRECOMPUTE_TOKEN_BUDGET
+                   ) -> Dict[str, Any]:
+    """Answer `intents` with the agents and publish them as a new version.
+
+    Questions are started no faster than `rate_per_minute`, at most
+    `concurrency` at a time; once `token_budget` is spent no new ones are
+    started and what was answered is published.
+    """
+    from profile_cache import location_context
+    from request_context import RequestContext, request_scope
+    from token_accounting import close_usage, open_usage
+
+    version = bank.begin_version(len(intents))
+    limiter = RateLimiter(rate_per_minute)
+    totals = Counter()
+    totals_lock = threading.Lock()
+
+    def answer_one(intent):
+        with totals_lock:
+            if token_budget and totals['tokens'] >= token_budget:
+                totals['skipped_budget'] += 1
+                return
+        limiter.wait()
+        context = RequestContext(
+            query_id=f"precompute-{uuid.uuid4()}", farmer_id='precompute',
+            native_language=intent['language'], request_class='background')
+        open_usage(context)
+        note = location_context(intent['district'].title(),
+                                intent['state'] or '', intent['language'])
+        try:
+            with request_scope(context):
+                answer = pipeline.answer(
+                    intent['question'], 'precompute', None, note)
+        except Exception as e:
+            print(f"ERROR: Precomputing '{intent['question']}' failed: {e}")
+            answer = None
+        finally:
+            usage = (close_usage(context) or {}).get('totals', {})
+        with totals_lock:
+            totals['tokens'] += ((usage.get('input_tokens') or 0)
+                                 + (usage.get('output_tokens') or 0))
+            if answer is None or answer.partial or not answer.text:
+                totals['failed'] += 1
+                return
+            totals['answered'] += 1
+        bank.store(version, intent, answer.text, answer.author, answer.domains)
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency,
+                                thread_name_prefix='precompute') as pool:
+            list(pool.map(answer_one, intents))
+    except BaseException:
+        bank.finish_version(version, totals['answered'], totals['tokens'],
+                            publish=False)
+        raise
+    bank.finish_version(version, totals['answered'], totals['tokens'],
+                        publish=totals['answered'] > 0)
+    return {"version": version, "intents": len(intents), **totals}
+
+
+_bank = None
+_init_lock = threading.Lock()
+
+
+def get_answer_bank() -> Optional[AnswerBank]:
+    """Return the process-wide answer bank, None when disabled"""
+    global _bank
+    if not PRECOMPUTE_ENABLED:
+        return None
+    with _init_lock:
+        if _bank is None:
+            _bank = AnswerBank()
+        return _bank
+
+
+def get_precompute_stats() -> Dict[str, Any]:
+    bank = get_answer_bank()
+    if bank is None:
+        return {"enabled": False}
+    return bank.stats()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Precompute answers to the top questions")
+    parser.add_argument('command', choices=['mine', 'run'])
+    parser.add_argument('--top', type=int, default=PRECOMPUTE_TOP_INTENTS,
+                        help="intents per district and language")
+    parser.add_argument('--min-count', type=int, default=PRECOMPUTE_MIN_COUNT)
+    parser.add_argument('--concurrency', type=int,
+                        default=PRECOMPUTE_CONCURRENCY)
+    parser.add_argument('--rate', type=float,
+                        default=PRECOMPUTE_RATE_PER_MINUTE,
+                        help="questions started per minute")
+    parser.add_argument('--token-budget', type=int,
+                        default=PRECOMPUTE_TOKEN_BUDGET)
+    args = parser.parse_args()
+
+    top = mine_top_intents(top_n=args.top, min_count=args.min_count)
+    print(f"{len(top)} intents above {args.min_count} asks")
+    if args.command == 'mine':
+        for intent in top:
+            print(f"{intent['asked']:6d}  {intent['district']:<15} "
+                  f"{intent['language']:<10} {intent['question']}")
+    elif top:
+        from query_pipeline import QueryPipeline
+
+        print(json.dumps(run_precompute(
+            QueryPipeline(), top, AnswerBank(), args.concurrency, args.rate,
+            args.token_budget)))
@@ -0,0 +1,550 @@
+"""
+Price trend statistics and short-horizon forecasts for every commodity
+and market.
+
+A nightly batch reads the daily modal-price history (Agmarknet-style CSV
+or Parquet files under PRICE_HISTORY_DIR), lays it out as one
+series x day matrix and computes everything with NumPy over all series
+at once: rolling means, changes, volatility, monthly seasonality, and
+forecasts from a damped-trend EWMA (Holt) and a level-adjusted
+seasonal-naive model. The model with the lower error on the last
+BACKTEST_DAYS of each series is used for it. Averages over the markets
+of each state and over the whole country are computed as extra series.
+
+The results replace the contents of an indexed SQLite table in one
+transaction, so get_market_trends is a primary-key lookup:
+
+    python price_forecast.py run
+"""
+
+import glob
+import os
+import sqlite3
+import threading
+import time
+import warnings
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+try:
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+except ImportError:
+    np = pa = None
+
+load_dotenv()
+
+PRICE_HISTORY_DIR = os.getenv(
+    'PRICE_HISTORY_DIR',
+    os.path.join(os.path.dirname(__file__), 'var', 'price_history'))
+PRICE_DB_PATH = os.getenv(
+    'PRICE_DB_PATH',
+    os.path.join(os.path.dirname(__file__), 'var', 'prices.sqlite3'))
+# Days of history used; older rows are ignored
+PRICE_HISTORY_DAYS = int(os.getenv('PRICE_HISTORY_DAYS', 730))
+PRICE_UNIT = os.getenv('PRICE_UNIT', '₹/quintal')
+
+HORIZONS = (7, 14, 30)
+BACKTEST_DAYS = 14
+SEASON_DAYS = 365
+# Holt's damped trend smoothing
+ALPHA, BETA, PHI = 0.3, 0.05, 0.9
+# Forecast moves smaller than this (relative) count as stable
+STABLE_BAND = 0.02
+ALL = '*'
+
+# Column names accepted in the history files (Agmarknet export names too)
+COLUMN_ALIASES = {
+    'commodity': ('commodity', 'Commodity'),
+    'market': ('market', 'Market', 'market_name'),
+    'state': ('state', 'State'),
+    'date': ('date', 'arrival_date', 'Arrival_Date', 'Price Date'),
+    'modal_price': ('modal_price', 'Modal_Price', 'Modal_x0020_Price',
+                    'Modal Price (Rs./Quintal)'),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS price_trends (
+    commodity_key TEXT NOT NULL,
+    state_key TEXT NOT NULL,
+    market_key TEXT NOT NULL,
+    commodity TEXT NOT NULL,
+    state TEXT NOT NULL,
+    market TEXT NOT NULL,
+    as_of TEXT NOT NULL,
+    last_observed TEXT NOT NULL,
+    last_price REAL NOT NULL,
+    mean_7d REAL, mean_30d REAL,
+    change_7d_pct REAL, change_30d_pct REAL,
+    volatility_30d_pct REAL,
+    low_30d REAL, high_30d REAL,
+    seasonal_index_this_month REAL, seasonal_index_next_month REAL,
+    forecast_7d REAL, forecast_14d REAL, forecast_30d REAL,
+    method TEXT NOT NULL,
+    backtest_mape_pct REAL,
+    PRIMARY KEY (commodity_key, state_key, market_key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS price_trends_state_price
+    ON price_trends (commodity_key, state_key, last_price);
+CREATE INDEX IF NOT EXISTS price_trends_market
+    ON price_trends (commodity_key, market_key);
+"""
+
+_COLUMNS = (
+    'commodity_key', 'state_key', 'market_key', 'commodity', 'state',
+    'market', 'as_of', 'last_observed', 'last_price', 'mean_7d', 'mean_30d',
+    'change_7d_pct', 'change_30d_pct', 'volatility_30d_pct', 'low_30d',
+    'high_30d', 'seasonal_index_this_month', 'seasonal_index_next_month',
+    'forecast_7d', 'forecast_14d', 'forecast_30d', 'method',
+    'backtest_mape_pct')
+
+
+def _key(name: str) -> str:
+    return ' '.join(name.lower().split())
+
+
+def read_history(directory: str = PRICE_HISTORY_DIR,
+                 days: int = PRICE_HISTORY_DAYS) -> 'pa.Table':
+    """All price rows of the last `days` days as one Arrow table with
+    commodity, market, state, date and modal_price columns"""
+    tables = []
+    for path in sorted(glob.glob(os.path.join(directory, '*'))):
+        if path.endswith('.parquet'):
+            table = pq.read_table(path)
+        elif path.endswith('.csv'):
+            table = pacsv.read_csv(path)
+        else:
+            continue
+        columns = {}
+        for name, aliases in COLUMN_ALIASES.items():
+            found = next((a for a in aliases if a in table.column_names), None)
+            if found is None:
+                raise ValueError(f"{path} has no {name} column")
+            columns[name] = table[found]
+        tables.append(pa.table({
+            'commodity': columns['commodity'].cast(pa.string()),
+            'market': columns['market'].cast(pa.string()),
+            'state': columns['state'].cast(pa.string()),
+            'date': _to_date(columns['date']),
+            'modal_price': columns['modal_price'].cast(pa.float64()),
+        }))
+    if not tables:
+        return None
+    history = pa.concat_tables(tables)
+    since = date.today() - timedelta(days=days)
+    keep = pc.and_(pc.greater_equal(history['date'], pa.scalar(since)),
+                   pc.greater(history['modal_price'], 0))
+    return history.filter(pc.fill_null(keep, False))
+
+
+def _to_date(column: 'pa.ChunkedArray') -> 'pa.ChunkedArray':
+    if pa.types.is_date(column.type):
+        return column.cast(pa.date32())
+    if pa.types.is_timestamp(column.type):
+        return column.cast(pa.date32())
+    text = column.cast(pa.string())
+    parsed = None
+    for fmt in ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d %b %Y'):
+        attempt = pc.strptime(text, format=fmt, unit='s', error_is_null=True)
+        parsed = attempt if parsed is None else pc.coalesce(parsed, attempt)
+    return parsed.cast(pa.date32())
+
+
+class PriceMatrix:
+    """Daily prices of many series as a (series, day) float matrix.
+
+    Several rows for the same series and day (varieties, grades) are
+    averaged; days without a report are NaN.
+    """
+
+    def __init__(self, history: 'pa.Table', end: Optional[date] = None):
+        # Strings are factorized by Arrow; the series id is built from
+        # the integer codes, so no per-row Python objects are created
+        commodity, commodities = _factorize(history['commodity'])
+        state, states = _factorize(history['state'])
+        market, markets = _factorize(history['market'])
+        days = history['date'].cast(pa.int32()).to_numpy()
+        prices = history['modal_price'].to_numpy()
+
+        end_day = (end - date(1970, 1, 1)).days if end else int(days.max())
+        self.start_day = int(days.min())
+        self.days = end_day - self.start_day + 1
+        series_ids = ((commodity * len(states) + state) * len(markets)
+                      + market)
+        keys, first, inverse = np.unique(
+            series_ids, return_index=True, return_inverse=True)
+        self.commodity = commodities[commodity[first]]
+        self.state = states[state[first]]
+        self.market = markets[market[first]]
+
+        in_range = days <= end_day
+        flat = inverse[in_range] * self.days + (days[in_range] - self.start_day)
+        size = len(keys) * self.days
+        sums = np.bincount(flat, weights=prices[in_range], minlength=size)
+        counts = np.bincount(flat, minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.values = (sums / counts).reshape(len(keys), self.days)
+
+    def with_averages(self) -> 'PriceMatrix':
+        """Append one series per (commodity, state) and per commodity,
+        averaging the markets' forward-filled prices"""
+        filled = forward_fill(self.values)
+        groups = [
+            (self.commodity, self.state, np.full(len(self.state), ALL)),
+            (self.commodity, np.full(len(self.state), ALL),
+             np.full(len(self.state), ALL)),
+        ]
+        commodity, state, market, values = ([self.commodity], [self.state],
+                                            [self.market], [self.values])
+        valid = ~np.isnan(filled)
+        prices = np.where(valid, filled, 0)
+        for c, s, m in groups:
+            _, first, inverse = np.unique(
+                np.char.add(np.char.add(c, '\x1f'), s),
+                return_index=True, return_inverse=True)
+            # Sum the rows of each group: sort by group, reduce runs
+            order = np.argsort(inverse, kind='stable')
+            starts = np.searchsorted(inverse[order], np.arange(len(first)))
+            sums = np.add.reduceat(prices[order], starts, axis=0)
+            counts = np.add.reduceat(valid[order], starts, axis=0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values.append(sums / counts)
+            commodity.append(c[first])
+            state.append(s[first])
+            market.append(m[first])
+        combined = object.__new__(PriceMatrix)
+        combined.start_day, combined.days = self.start_day, self.days
+        combined.commodity = np.concatenate(commodity)
+        combined.state = np.concatenate(state)
+        combined.market = np.concatenate(market)
+        combined.values = np.vstack(values)
+        return combined
+
+
+def _factorize(column: 'pa.ChunkedArray'):
+    """(int codes, unique values) of a string column"""
+    encoded = pc.dictionary_encode(column.combine_chunks())
+    return (encoded.indices.to_numpy(zero_copy_only=False).astype(np.int64),
+            encoded.dictionary.to_numpy(zero_copy_only=False).astype(str))
+
+
+def forward_fill(values: 'np.ndarray') -> 'np.ndarray':
+    """Carry each series' last price over days without a report"""
+    index = np.where(np.isnan(values), 0, np.arange(values.shape[1]))
+    np.maximum.accumulate(index, axis=1, out=index)
+    return values[np.arange(len(values))[:, None], index]
+
+
+def holt_forecast(values: 'np.ndarray', horizons) -> 'np.ndarray':
+    """Damped-trend exponential smoothing of every series at once;
+    returns (series, len(horizons)) forecasts from the last day.
+
+    The loop runs over days, each step updating all series together.
+    Series without a price get NaN forecasts.
+    """
+    if values.shape[1] == 0:
+        return np.full((len(values), len(horizons)), np.nan)
+    observed = ~np.isnan(values)
+    first = observed.argmax(axis=1)
+    level = values[np.arange(len(values)), first]
+    trend = np.zeros(len(values))
+    for t in range(values.shape[1]):
+        x = values[:, t]
+        seen = observed[:, t]
+        damped = PHI * trend
+        new_level = ALPHA * x + (1 - ALPHA) * (level + damped)
+        new_trend = BETA * (new_level - level) + (1 - BETA) * damped
+        level = np.where(seen, new_level, level)
+        trend = np.where(seen, new_trend, trend)
+    # Sum of PHI^1..PHI^h for each horizon
+    damping = np.array([sum(PHI ** i for i in range(1, h + 1))
+                        for h in horizons])
+    return level[:, None] + trend[:, None] * damping[None, :]
+
+
+def seasonal_naive_forecast(filled: 'np.ndarray', horizons) -> 'np.ndarray':
+    """Price a year before each target day, scaled by how this month's
+    level compares with the same month a year ago; NaN without a year of
+    history"""
+    days = filled.shape[1]
+    if days < SEASON_DAYS + 30:
+        return np.full((len(filled), len(horizons)), np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        level_now = np.nanmean(filled[:, -30:], axis=1)
+        level_then = np.nanmean(
+            filled[:, -30 - SEASON_DAYS:-SEASON_DAYS], axis=1)
+    ratio = level_now / level_then
+    columns = [days - 1 - SEASON_DAYS + h for h in horizons]
+    return filled[:, columns] * ratio[:, None]
+
+
+def _mape(forecast: 'np.ndarray', actual: 'np.ndarray') -> 'np.ndarray':
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmean(np.abs(forecast - actual) / actual, axis=1) * 100
+
+
+def compute_trends(matrix: PriceMatrix) -> Dict[str, 'np.ndarray']:
+    """Statistics and forecasts of every series of `matrix`, as columns"""
+    values = matrix.values
+    filled = forward_fill(values)
+    n = len(values)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        last_price = filled[:, -1]
+        observed = ~np.isnan(values)
+        last_observed = values.shape[1] - 1 - observed[:, ::-1].argmax(axis=1)
+        mean_7d = np.nanmean(filled[:, -7:], axis=1)
+        mean_30d = np.nanmean(filled[:, -30:], axis=1)
+        prior_7d = np.nanmean(filled[:, -14:-7], axis=1)
+        prior_30d = np.nanmean(filled[:, -60:-30], axis=1)
+        returns = np.diff(np.log(filled[:, -31:]), axis=1)
+        volatility = np.nanstd(returns, axis=1) * 100
+        low_30d = np.nanmin(filled[:, -30:], axis=1)
+        high_30d = np.nanmax(filled[:, -30:], axis=1)
+
+        # Monthly seasonal index: each calendar month's mean over the
+        # series' overall mean (needs a year of history)
+        first_day = date(1970, 1, 1) + timedelta(days=matrix.start_day)
+        months = np.array([(first_day + timedelta(days=d)).month - 1
+                           for d in range(values.shape[1])])
+        monthly = np.stack([np.nanmean(values[:, months == m], axis=1)
+                            if (months == m).any() else np.full(n, np.nan)
+                            for m in range(12)], axis=1)
+        seasonal = monthly / np.nanmean(values, axis=1)[:, None]
+        if values.shape[1] < SEASON_DAYS:
+            seasonal[:] = np.nan
+    this_month = months[-1]
+
+    # Backtest both models on the last BACKTEST_DAYS, pick the better one.
+    # Without history before those days (the first fortnight of data)
+    # there is nothing to test; Holt is used and no error reported
+    if values.shape[1] > BACKTEST_DAYS:
+        backtest_horizons = range(1, BACKTEST_DAYS + 1)
+        actual = values[:, -BACKTEST_DAYS:]
+        history = values[:, :-BACKTEST_DAYS]
+        errors = np.stack([
+            _mape(holt_forecast(history, backtest_horizons), actual),
+            _mape(seasonal_naive_forecast(forward_fill(history),
+                                          backtest_horizons), actual),
+        ], axis=1)
+    else:
+        errors = np.full((n, 2), np.nan)
+    # Holt unless seasonal-naive did strictly better (NaN compares False)
+    choice = np.less(errors[:, 1], errors[:, 0]).astype(int)
+
+    forecasts = np.where(
+        (choice == 1)[:, None],
+        seasonal_naive_forecast(filled, HORIZONS),
+        holt_forecast(values, HORIZONS))
+    chosen_error = errors[np.arange(n), choice]
+
+    def pct(now, before):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (now / before - 1) * 100
+
+    return {
+        "last_price": last_price,
+        "last_observed": last_observed + matrix.start_day,
+        "mean_7d": mean_7d, "mean_30d": mean_30d,
+        "change_7d_pct": pct(mean_7d, prior_7d),
+        "change_30d_pct": pct(mean_30d, prior_30d),
+        "volatility_30d_pct": volatility,
+        "low_30d": low_30d, "high_30d": high_30d,
+        "seasonal_index_this_month": seasonal[:, this_month],
+        "seasonal_index_next_month": seasonal[:, (this_month + 1) % 12],
+        "forecast_7d": forecasts[:, 0], "forecast_14d": forecasts[:, 1],
+        "forecast_30d": forecasts[:, 2],
+        "method": np.where(choice == 1, 'seasonal_naive', 'holt'),
+        "backtest_mape_pct": chosen_error,
+    }
+
+
+class PriceTrendStore:
+    """Indexed SQLite table of the latest trends per series"""
+
+    def __init__(self, path: str = PRICE_DB_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(_SCHEMA)
+
+    def replace_all(self, matrix: PriceMatrix,
+                    trends: Dict[str, 'np.ndarray']) -> int:
+        """Swap in a new set of trends; readers see old or new, never a
+        mix"""
+        as_of = datetime.now().isoformat(timespec='seconds')
+        epoch = date(1970, 1, 1)
+
+        def number(column):
+            values = np.round(trends[column].astype(float), 2)
+            return [None if np.isnan(v) else float(v) for v in values]
+
+        numeric = {column: number(column) for column in _COLUMNS[8:]
+                   if column != 'method'}
+        last_observed = [(epoch + timedelta(days=int(d))).isoformat()
+                         for d in trends['last_observed']]
+        rows = []
+        for i in range(len(matrix.commodity)):
+            if numeric['last_price'][i] is None:
+                continue
+            rows.append((
+                _key(matrix.commodity[i]), _key(matrix.state[i]),
+                _key(matrix.market[i]), matrix.commodity[i],
+                matrix.state[i], matrix.market[i], as_of, last_observed[i],
+                *(numeric[column][i] for column in _COLUMNS[8:21]),
+                str(trends['method'][i]), numeric['backtest_mape_pct'][i]))
+        placeholders = ', '.join('?' * len(_COLUMNS))
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM price_trends")
+            self._conn.executemany(
+                f"INSERT INTO price_trends ({', '.join(_COLUMNS)}) "
+                f"VALUES ({placeholders})", rows)
+        return len(rows)
+
+    def get(self, commodity: str, state: str = ALL,
+            market: str = ALL) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM price_trends WHERE commodity_key = ? "
+                "AND state_key = ? AND market_key = ?",
+                (_key(commodity), _key(state), _key(market))).fetchone()
+        return dict(row) if row else None
+
+    def find_market(self, commodity: str, market: str,
+                    state: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Trends of the market whose name starts with `market` (e.g.
+        "mysuru" matches "Mysuru (Bandipalya)"), in `state` if given"""
+        prefix = _key(market)
+        query = ("SELECT * FROM price_trends WHERE commodity_key = ? "
+                 "AND market_key >= ? AND market_key < ? AND market_key != ?")
+        params = [_key(commodity), prefix, prefix + '\uffff', ALL]
+        if state:
+            query += " AND state_key = ?"
+            params.append(_key(state))
+        with self._lock:
+            row = self._conn.execute(query + " LIMIT 1", params).fetchone()
+        return dict(row) if row else None
+
+    def best_markets(self, commodity: str, state: str,
+                     limit: int = 5) -> List[Dict[str, Any]]:
+        """Markets of `state` paying the most for `commodity`"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT market, last_price, last_observed FROM price_trends "
+                "WHERE commodity_key = ? AND state_key = ? AND market_key != ? "
+                "ORDER BY last_price DESC LIMIT ?",
+                (_key(commodity), _key(state), ALL, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+
+def trend_report(trends: Dict[str, Any], horizon_days: int = 30
+                 ) -> Dict[str, Any]:
+    """Tool-facing summary of one trends row at the forecast horizon
+    closest to `horizon_days`"""
+    horizon = min(HORIZONS, key=lambda h: abs(h - horizon_days))
+    last = trends['last_price']
+    forecast = trends[f'forecast_{horizon}d']
+    if forecast is None:
+        direction = 'unknown'
+    elif forecast > last * (1 + STABLE_BAND):
+        direction = 'increasing'
+    elif forecast < last * (1 - STABLE_BAND):
+        direction = 'decreasing'
+    else:
+        direction = 'stable'
+    spread = None
+    if forecast is not None and trends['volatility_30d_pct'] is not None:
+        # Rough 95% band from recent daily volatility
+        spread = forecast * trends['volatility_30d_pct'] / 100 * 1.96 \
+            * horizon ** 0.5
+    return {
+        "status": "success",
+        "commodity": trends['commodity'],
+        "market": None if trends['market'] == ALL else trends['market'],
+        "state": None if trends['state'] == ALL else trends['state'],
+        "unit": PRICE_UNIT,
+        "last_reported": trends['last_observed'],
+        "computed_at": trends['as_of'],
+        "price_trends": {
+            "current_price": last,
+            "average_7_days": trends['mean_7d'],
+            "average_30_days": trends['mean_30d'],
+            "change_7_days_pct": trends['change_7d_pct'],
+            "change_30_days_pct": trends['change_30d_pct'],
+            "range_30_days": [trends['low_30d'], trends['high_30d']],
+            "daily_volatility_pct": trends['volatility_30d_pct'],
+            "trend_direction": direction,
+        },
+        "seasonality": {
+            "this_month_vs_year_average": trends['seasonal_index_this_month'],
+            "next_month_vs_year_average": trends['seasonal_index_next_month'],
+        },
+        "prediction": {
+            "horizon_days": horizon,
+            "expected_price": forecast,
+            "likely_range": [round(forecast - spread), round(forecast + spread)]
+            if spread is not None else None,
+            "method": trends['method'],
+            "recent_error_pct": trends['backtest_mape_pct'],
+        },
+    }
+
+
+def run_forecasts(directory: str = PRICE_HISTORY_DIR,
+                  store: Optional[PriceTrendStore] = None) -> Dict[str, Any]:
+    """Nightly job: history files -> trends table"""
+    started = time.perf_counter()
+    history = read_history(directory)
+    if history is None or history.num_rows == 0:
+        return {"series": 0, "message": f"no price history in {directory}"}
+    matrix = PriceMatrix(history).with_averages()
+    loaded = time.perf_counter()
+    trends = compute_trends(matrix)
+    computed = time.perf_counter()
+    written = (store or get_price_store()).replace_all(matrix, trends)
+    return {
+        "rows": history.num_rows,
+        "series": len(matrix.values),
+        "days": matrix.days,
+        "written": written,
+        "load_seconds": round(loaded - started, 2),
+        "compute_seconds": round(computed - loaded, 2),
+        "write_seconds": round(time.perf_counter() - computed, 2),
+    }
+
+
+_store = None
+_init_lock = threading.Lock()
+
+
+def get_price_store() -> PriceTrendStore:
+    """Return the process-wide trends table"""
+    global _store
+    with _init_lock:
+        if _store is None:
+            _store = PriceTrendStore()
+        return _store
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(
+        description="Compute price trends and forecasts")
+    parser.add_argument('command', choices=['run'])
+    parser.add_argument('--history', default=PRICE_HISTORY_DIR)
+    args = parser.parse_args()
+    if np is None:
+        raise SystemExit("numpy and pyarrow are required")
+    print(json.dumps(run_forecasts(args.history)))
@@ -0,0 +1,274 @@
+"""
+Read-through cache of farmer profiles.
+
+Queries only carry a farmer_id; the handler looks the profile up here so
+the agents know the farmer's city, state and language without a
+Firestore read on every request. Entries expire after a TTL and the
+least recently used ones are evicted; unknown ids are cached negatively
+for a shorter time. A Firestore snapshot listener refreshes cached
+entries when profiles change, and the most active farmers of the last
+run are prefetched in one batched read at startup.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+from models import FarmerResponse
+
+load_dotenv()
+
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', 10000))
+PROFILE_CACHE_TTL = float(os.getenv('PROFILE_CACHE_TTL', 3600))
+PROFILE_NEGATIVE_TTL = float(os.getenv('PROFILE_NEGATIVE_TTL', 300))
+PROFILE_PREFETCH_COUNT = int(os.getenv('PROFILE_PREFETCH_COUNT', 500))
+# Activity is tracked for at most this many farmers
+PROFILE_ACTIVITY_SIZE = int(os.getenv(
+    'PROFILE_ACTIVITY_SIZE', 4 * PROFILE_PREFETCH_COUNT))
+PROFILE_HOT_PATH = os.getenv(
+    'PROFILE_HOT_PATH',
+    os.path.join(os.path.dirname(__file__), 'var', 'hot_farmers.json'))
+PROFILE_HOT_SAVE_INTERVAL = float(os.getenv('PROFILE_HOT_SAVE_INTERVAL', 300))
+
+
+class ProfileCache:
+    """LRU/TTL cache in front of a profile loader.
+
+    `loader(farmer_id)` returns a FarmerResponse or None for unknown ids;
+    `bulk_loader(ids)` returns {farmer_id: FarmerResponse}. When the
+    loader raises (e.g. the Firestore breaker is open) an expired entry is
+    served as is; without one the lookup returns None.
+    """
+
+    def __init__(self, loader: Callable[[str], Optional[FarmerResponse]],
+                 bulk_loader: Optional[Callable[
+                     [Iterable[str]], Dict[str, FarmerResponse]]] = None,
+                 max_entries: int = PROFILE_CACHE_SIZE,
+                 ttl: float = PROFILE_CACHE_TTL,
+                 negative_ttl: float = PROFILE_NEGATIVE_TTL,
+                 activity_size: int = PROFILE_ACTIVITY_SIZE):
+        self.loader = loader
+        self.bulk_loader = bulk_loader
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.activity_size = activity_size
+        # farmer_id -> (profile or None, expires_at)
+        self._entries = OrderedDict()
+        self._activity = Counter()
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    def get(self, farmer_id: str) -> Optional[FarmerResponse]:
+        """Profile of `farmer_id`, loading it on a miss"""
+        if not farmer_id:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(farmer_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(farmer_id)
+                if entry[0] is None:
+                    self._stats['negative_hits'] += 1
+                else:
+                    self._stats['hits'] += 1
+                    self._count_activity(farmer_id)
+                return entry[0]
+            self._stats['misses'] += 1
+
+        try:
+            profile = self.loader(farmer_id)
+        except Exception as e:
+            print(f"ERROR: Profile lookup for {farmer_id} failed: {e}")
+            with self._lock:
+                self._stats['load_errors'] += 1
+                if entry is None:
+                    return None
+                self._stats['stale_served'] += 1
+                return entry[0]
+        self._store(farmer_id, profile)
+        if profile is not None:
+            # Unknown ids are never worth prefetching
+            with self._lock:
+                self._count_activity(farmer_id)
+        return profile
+
+    def put(self, profile: FarmerResponse) -> None:
+        """Insert or refresh a profile (write-through on registration)"""
+        self._store(profile.farmer_id, profile)
+
+    def update_if_cached(self, farmer_id: str,
+                         profile: Optional[FarmerResponse]) -> None:
+        """Apply a change notification to an entry we hold.
+
+        Profiles nobody asked for are not pulled into the cache, but a
+        negative entry is replaced so a new registration shows up at once.
+        """
+        with self._lock:
+            if farmer_id not in self._entries:
+                return
+            self._stats['invalidations'] += 1
+        if profile is None:
+            self.invalidate(farmer_id)
+        else:
+            self._store(farmer_id, profile)
+
+    def invalidate(self, farmer_id: str) -> None:
+        with self._lock:
+            self._entries.pop(farmer_id, None)
+
+    def prefetch(self, farmer_ids: Iterable[str]) -> int:
+        """Load `farmer_ids` with one bulk read; returns profiles found"""
+        farmer_ids = [i for i in dict.fromkeys(farmer_ids) if i]
+        if not farmer_ids or self.bulk_loader is None:
+            return 0
+        profiles = self.bulk_loader(farmer_ids)
+        for farmer_id in farmer_ids:
+            self._store(farmer_id, profiles.get(farmer_id))
+        return len(profiles)
+
+    def hot_ids(self, count: int = PROFILE_PREFETCH_COUNT) -> List[str]:
+        """Most frequently looked-up farmer ids"""
+        with self._lock:
+            return [i for i, _ in self._activity.most_common(count)]
+
+    def decay_activity(self) -> None:
+        """Halve the activity counts so recent traffic outweighs old"""
+        with self._lock:
+            self._activity = Counter(
+                {i: n // 2 for i, n in self._activity.items() if n > 1})
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = (self._stats['hits'] + self._stats['negative_hits']
+                       + self._stats['misses'])
+            hits = self._stats['hits'] + self._stats['negative_hits']
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "tracked_farmers": len(self._activity),
+                "lookups": lookups,
+                "hit_rate": round(hits / lookups, 4) if lookups else None,
+                **self._stats,
+            }
+
+    def _count_activity(self, farmer_id: str) -> None:
+        # Caller holds the lock
+        self._activity[farmer_id] += 1
+        if len(self._activity) > self.activity_size:
+            # Keep the busier half; a newcomer has to earn its place again
+            self._activity = Counter(dict(
+                self._activity.most_common(self.activity_size // 2)))
+            self._stats['activity_trims'] += 1
+
+    def _store(self, farmer_id: str,
+               profile: Optional[FarmerResponse]) -> None:
+        ttl = self.ttl if profile is not None else self.negative_ttl
+        with self._lock:
+            self._entries[farmer_id] = (profile, time.time() + ttl)
+            self._entries.move_to_end(farmer_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+
+def profile_context(profile: Optional[FarmerResponse]) -> Optional[str]:
+    """Short note about the farmer sent to the agents with the question.
+
+    Only what the agents need (place and language) is included; name and
+    contact details stay out of the prompt.
+    """
+    if profile is None:
+        return None
+    return location_context(profile.city, profile.state,
+                            profile.native_language)
+
+
+def location_context(city: str, state: str, native_language: str) -> str:
+    return (
+        f"Farmer profile: farms near {city}, "
+        f"{state} and speaks {native_language}. Use this "
+        f"location for weather, market prices and schemes unless the "
+        f"question names another place."
+    )
+
+
+def load_hot_ids(path: str = PROFILE_HOT_PATH) -> List[str]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def save_hot_ids(cache: ProfileCache, path: str = PROFILE_HOT_PATH) -> None:
+    hot_ids = cache.hot_ids()
+    if not hot_ids:
+        # Keep the previous list when this process served nobody
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(hot_ids, f)
+    os.replace(tmp_path, path)
+
+
+_cache = None
+_watch = None
+_init_lock = threading.Lock()
+
+
+def get_profile_cache() -> ProfileCache:
+    """Return the process-wide cache backed by Firestore"""
+    global _cache
+    with _init_lock:
+        if _cache is None:
+            from farmer_service import get_farmer_from_db, get_farmers_from_db
+            _cache = ProfileCache(get_farmer_from_db, get_farmers_from_db)
+        return _cache
+
+
+def start_profile_cache() -> ProfileCache:
+    """Prefetch the hot farmers, subscribe to profile changes and keep
+    the hot list up to date for the next start"""
+    global _watch
+    cache = get_profile_cache()
+    with _init_lock:
+        if _watch is not None:
+            return cache
+        _watch = threading.Thread(target=_run_background, args=(cache,),
+                                  name='profile-cache', daemon=True)
+        _watch.start()
+    atexit.register(save_hot_ids, cache)
+    return cache
+
+
+def _run_background(cache: ProfileCache) -> None:
+    from farmer_service import watch_farmer_changes
+
+    started = datetime.now().isoformat()
+    try:
+        found = cache.prefetch(load_hot_ids())
+        print(f"DEBUG: Prefetched {found} farmer profiles")
+    except Exception as e:
+        print(f"ERROR: Profile prefetch failed: {e}")
+    try:
+        # Only writes after startup reach the listener, so subscribing
+        # costs no reads for the existing collection
+        watch_farmer_changes(cache.update_if_cached, started)
+    except Exception as e:
+        print(f"ERROR: Profile change listener not started: {e}")
+    while True:
+        time.sleep(PROFILE_HOT_SAVE_INTERVAL)
+        try:
+            save_hot_ids(cache)
+        except OSError as e:
+            print(f"ERROR: Saving hot farmer list failed: {e}")
+        cache.decay_activity()
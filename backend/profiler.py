@@ -0,0 +1,274 @@
+"""
+On-demand sampling profiler and memory snapshots for a live worker.
+
+While a capture runs, a background thread reads the stack of every other
+thread (sys._current_frames) every PROFILER_INTERVAL_MS and counts
+identical stacks. Nothing is installed into the interpreter (no
+sys.setprofile), so untouched code runs at full speed and the cost is the
+sampler thread's own time, reported as `overhead_pct`. Results come back
+as collapsed stacks (flamegraph.pl, speedscope, inferno) or as a
+speedscope JSON profile.
+
+Threads blocked in a known waiting call (locks, queues, sockets,
+selectors, sleep) are left out unless `idle=True`, so the flame graph
+shows where CPU goes; with idle samples included it shows wall time.
+
+The memory mode diffs two tracemalloc snapshots taken `seconds` apart.
+Both are opt-in with PROFILER_ENABLED and only one capture runs at a time.
+"""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', 'false').lower() == 'true'
+PROFILER_INTERVAL_MS = float(os.getenv('PROFILER_INTERVAL_MS', 10))
+PROFILER_MAX_SECONDS = float(os.getenv('PROFILER_MAX_SECONDS', 60))
+# Frames kept per allocation traceback in memory mode
+PROFILER_TRACEMALLOC_FRAMES = int(os.getenv('PROFILER_TRACEMALLOC_FRAMES', 10))
+MAX_STACK_DEPTH = 128
+
+# (file name, function) pairs where a thread is waiting, not working
+_IDLE_FRAMES = {
+    ('threading.py', 'wait'), ('threading.py', '_wait_for_tstate_lock'),
+    ('queue.py', 'get'), ('selectors.py', 'select'),
+    ('socket.py', 'accept'), ('socket.py', 'readinto'),
+    ('socketserver.py', 'serve_forever'), ('ssl.py', 'read'),
+    # Capture and background loops of this app that sleep between rounds
+    ('profiler.py', '_run'), ('profiler.py', 'capture_profile'),
+    ('profiler.py', 'capture_memory'), ('media_store.py', 'run'),
+    ('profile_cache.py', '_run_background'),
+}
+
+
+class ProfilerBusy(Exception):
+    """Another capture is already running in this process"""
+
+
+_capture_lock = threading.Lock()
+
+
+class SamplingProfiler:
+    """Counts the stacks of all threads on a timer"""
+
+    def __init__(self, interval: float = PROFILER_INTERVAL_MS / 1000,
+                 idle: bool = False):
+        self.interval = interval
+        self.idle = idle
+        self.stacks = Counter()
+        self.samples = 0
+        self.sampling_time = 0.0
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = 0.0
+        self._elapsed = 0.0
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            module = os.path.basename(filename)
+            parent = os.path.basename(os.path.dirname(filename))
+            if parent not in ('', 'site-packages', 'lib') \
+                    and not parent.startswith('python'):
+                module = f"{parent}/{module}"
+            label = f"{code.co_name} ({module}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _sample(self, names: Dict[int, str]) -> None:
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            code = frame.f_code
+            if not self.idle and (os.path.basename(code.co_filename),
+                                  code.co_name) in _IDLE_FRAMES:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            self.stacks[tuple(reversed(stack))] += 1
+
+    def _run(self) -> None:
+        next_at = time.perf_counter()
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            self._sample(names)
+            self.samples += 1
+            self.sampling_time += time.perf_counter() - started
+            next_at += self.interval
+            delay = next_at - time.perf_counter()
+            if delay < 0:
+                # Fell behind; skip the missed ticks rather than burst
+                next_at = time.perf_counter()
+                delay = 0
+            self._stop.wait(delay)
+
+    def start(self) -> None:
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(
+            target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._elapsed = time.perf_counter() - self._started
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "duration_seconds": round(self._elapsed, 3),
+            "interval_ms": self.interval * 1000,
+            "ticks": self.samples,
+            "stack_samples": sum(self.stacks.values()),
+            "distinct_stacks": len(self.stacks),
+            "overhead_pct": round(100 * self.sampling_time / self._elapsed, 2)
+            if self._elapsed else 0.0,
+            "idle_included": self.idle,
+        }
+
+    def collapsed(self) -> str:
+        """One `frame;frame;frame count` line per distinct stack"""
+        return '\n'.join(f"{';'.join(stack)} {count}"
+                         for stack, count in self.stacks.most_common()) + '\n'
+
+    def speedscope(self, name: str = 'fasal-mitra') -> Dict[str, Any]:
+        """Profile in speedscope's file format, one profile per thread"""
+        frame_index = {}
+        frames = []
+        by_thread = {}
+        for stack, count in self.stacks.items():
+            indices = []
+            for label in stack[1:]:
+                if label not in frame_index:
+                    frame_index[label] = len(frames)
+                    frames.append({"name": label})
+                indices.append(frame_index[label])
+            samples, weights = by_thread.setdefault(stack[0], ([], []))
+            samples.append(indices)
+            weights.append(count * self.interval)
+        profiles = [{
+            "type": "sampled",
+            "name": thread,
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": samples,
+            "weights": weights,
+        } for thread, (samples, weights) in sorted(by_thread.items())]
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "fasal-mitra profiler",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+
+def _bounded(seconds: float) -> float:
+    return max(0.0, min(float(seconds), PROFILER_MAX_SECONDS))
+
+
+def capture_profile(seconds: float, interval: Optional[float] = None,
+                    idle: bool = False) -> SamplingProfiler:
+    """Sample all threads for `seconds` and return the finished profiler.
+
+    Raises ProfilerBusy while another capture runs.
+    """
+    if not _capture_lock.acquire(blocking=False):
+        raise ProfilerBusy("A capture is already running")
+    try:
+        profiler = SamplingProfiler(
+            interval=max(0.001, interval or PROFILER_INTERVAL_MS / 1000),
+            idle=idle)
+        profiler.start()
+        try:
+            time.sleep(_bounded(seconds))
+        finally:
+            profiler.stop()
+        print(f"DEBUG: Profile captured: {profiler.summary()}")
+        return profiler
+    finally:
+        _capture_lock.release()
+
+
+def _stat_entry(stat) -> Dict[str, Any]:
+    frames = stat.traceback.format() if len(stat.traceback) > 1 else None
+    frame = stat.traceback[0]
+    entry = {
+        "location": f"{frame.filename}:{frame.lineno}",
+        "size_kb": round(stat.size / 1024, 1),
+        "count": stat.count,
+    }
+    if hasattr(stat, 'size_diff'):
+        entry["size_diff_kb"] = round(stat.size_diff / 1024, 1)
+        entry["count_diff"] = stat.count_diff
+    if frames:
+        entry["traceback"] = frames
+    return entry
+
+
+def capture_memory(seconds: float = 0, top: int = 25,
+                   group_by: str = 'lineno') -> Dict[str, Any]:
+    """Largest allocation sites, and with `seconds` > 0 the sites that
+    grew most over that window.
+
+    tracemalloc only sees allocations made after it starts; when it was
+    not already tracing it is started for the capture and stopped after,
+    so the first snapshot is nearly empty and the diff is what counts.
+    """
+    if group_by not in ('lineno', 'filename', 'traceback'):
+        raise ValueError("group_by must be lineno, filename or traceback")
+    if not _capture_lock.acquire(blocking=False):
+        raise ProfilerBusy("A capture is already running")
+    started_here = not tracemalloc.is_tracing()
+    try:
+        if started_here:
+            tracemalloc.start(PROFILER_TRACEMALLOC_FRAMES)
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+                   tracemalloc.Filter(False, '<frozen importlib._bootstrap>')]
+        before = tracemalloc.take_snapshot().filter_traces(filters)
+        seconds = _bounded(seconds)
+        result: Dict[str, Any] = {"seconds": seconds, "group_by": group_by,
+                                  "started_tracing": started_here}
+        if seconds:
+            time.sleep(seconds)
+            after = tracemalloc.take_snapshot().filter_traces(filters)
+            result["growth"] = [_stat_entry(s) for s in
+                                after.compare_to(before, group_by)[:top]]
+        else:
+            after = before
+        result["top"] = [_stat_entry(s) for s in
+                         after.statistics(group_by)[:top]]
+        current, peak = tracemalloc.get_traced_memory()
+        result["traced_kb"] = round(current / 1024, 1)
+        result["peak_kb"] = round(peak / 1024, 1)
+        return result
+    finally:
+        if started_here:
+            tracemalloc.stop()
+        _capture_lock.release()
+
+
+def top_functions(profiler: SamplingProfiler,
+                  limit: int = 20) -> List[Tuple[str, int]]:
+    """Functions by samples in which they were on the stack"""
+    inclusive = Counter()
+    for stack, count in profiler.stacks.items():
+        for label in set(stack[1:]):
+            inclusive[label] += count
+    return inclusive.most_common(limit)
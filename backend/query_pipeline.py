@@ -0,0 +1,231 @@
+"""
+Query pipeline - runs a farmer's question through the Mitra agents.
+
+Owns the ADK session service and runners so every entry point answers
+questions the same way. The event stream is consumed only until the
+final response shows up; the rest of the run is closed right away.
+"""
+
+import asyncio
+import threading
+import uuid
+from typing import List, Optional, Tuple
+
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from agents.agent import (
+    root_agent, FAN_OUT_ENABLED, FAN_OUT_SYNTHESIZER, detect_domains,
+    get_fan_out_agent
+)
+from agents.model_router import (
+    classify_query, escalate_after_failure, record_complexity
+)
+from agents.plugins import build_plugins
+from deadlines import DeadlineExceeded, count, time_left
+from request_context import current_request
+
+
+APP_NAME = "fasal_mitra_kisan"
+
+
+class AgentAnswer:
+    """Final answer produced by the agents for one question"""
+
+    def __init__(self, text: Optional[str], author: Optional[str],
+                 domains: List[str], partial: bool = False,
+                 precomputed: bool = False):
+        self.text = text
+        self.author = author
+        self.domains = domains
+        # True when the deadline hit and `text` is what was ready by then
+        self.partial = partial
+        # True when served from the nightly answer bank (precompute.py)
+        self.precomputed = precomputed
+
+    @property
+    def fan_out(self) -> bool:
+        return self.author == FAN_OUT_SYNTHESIZER
+
+
+def final_response_text(event) -> Optional[str]:
+    """Text of `event` if it is an agent's final response, else None.
+
+    Transfer and tool-narration messages carry function calls and are not
+    final, so they are never mistaken for the answer.
+    """
+    if not event.is_final_response() or not event.content:
+        return None
+    text = ''.join(
+        part.text for part in event.content.parts or []
+        if part.text and not part.thought
+    ).strip()
+    return text or None
+
+
+PARTIAL_ANSWER_INTRO = (
+    "I could not finish checking everything in time. Here is what I found "
+    "so far:"
+)
+TIMEOUT_ANSWER = (
+    "Sorry, this is taking longer than expected. Please try again in a "
+    "little while."
+)
+
+
+def partial_answer(findings: List[str], domains: List[str]) -> AgentAnswer:
+    """Answer to give when the deadline passes before the final response"""
+    if findings:
+        text = "\n\n".join([PARTIAL_ANSWER_INTRO] + findings)
+    else:
+        text = TIMEOUT_ANSWER
+    return AgentAnswer(text, None, domains, partial=True)
+
+
+class QueryPipeline:
+    """Answers questions with Mitra or, for compound questions, with a
+    fan-out pipeline over the relevant specialists."""
+
+    def __init__(self):
+        self.session_service = InMemorySessionService()
+        self.runner = self._build_runner(root_agent)
+        self._fan_out_runners = {}
+        self._lock = threading.Lock()
+
+    def _build_runner(self, agent) -> Runner:
+        return Runner(
+            agent=agent,
+            app_name=APP_NAME,
+            session_service=self.session_service,
+            plugins=build_plugins()
+        )
+
+    def get_runner(self, domains: List[str]) -> Runner:
+        """Runner for a question touching `domains`"""
+        if not FAN_OUT_ENABLED or len(domains) < 2:
+            return self.runner
+        key = tuple(domains)
+        with self._lock:
+            if key not in self._fan_out_runners:
+                self._fan_out_runners[key] = self._build_runner(
+                    get_fan_out_agent(key))
+            return self._fan_out_runners[key]
+
+    async def answer_async(self, question: str, user_id: str,
+                           images: Optional[List[Tuple[bytes, str]]] = None,
+                           farmer_note: Optional[str] = None
+                           ) -> AgentAnswer:
+        """Run `question` and return as soon as the final response arrives.
+
+        `images` are (bytes, MIME type) pairs sent along with the question;
+        `farmer_note` is background about the farmer (see profile_cache).
+        A run that fails is retried with every agent one model tier up.
+        When the request deadline passes, a partial answer is returned.
+        """
+        domains = detect_domains(question)
+        context = current_request()
+        if context is not None:
+            context.complexity = classify_query(
+                question, len(images or []), domains)
+            record_complexity(context.complexity)
+            print(f"DEBUG: Query complexity: {context.complexity}")
+        findings = []
+        try:
+            return await asyncio.wait_for(
+                self._run_with_escalation(
+                    question, user_id, images, farmer_note, domains,
+                    context, findings),
+                timeout=time_left())
+        except (asyncio.TimeoutError, DeadlineExceeded):
+            count('request_timeouts')
+            print(f"DEBUG: Deadline reached with {len(findings)} findings")
+            return partial_answer(findings, domains)
+
+    async def _run_with_escalation(self, question, user_id, images,
+                                   farmer_note, domains, context, findings):
+        while True:
+            try:
+                return await self._run_once(
+                    question, user_id, images, farmer_note, domains,
+                    findings)
+            except DeadlineExceeded:
+                raise
+            except Exception:
+                if not escalate_after_failure(context):
+                    raise
+                print(f"DEBUG: Retrying one model tier up "
+                      f"(escalation {context.tier_escalation})")
+
+    async def _run_once(self, question: str, user_id: str,
+                        images: Optional[List[Tuple[bytes, str]]],
+                        farmer_note: Optional[str],
+                        domains: List[str],
+                        findings: List[str]) -> AgentAnswer:
+        runner = self.get_runner(domains)
+        fan_out = runner is not self.runner
+        if fan_out:
+            print(f"DEBUG: Fanning out to {', '.join(domains)}")
+
+        session_id = f"session_{uuid.uuid4()}"
+        await self.session_service.create_session(
+            app_name=APP_NAME,
+            user_id=user_id,
+            session_id=session_id,
+            state={"farmer_question": question}
+        )
+        context_parts = [types.Part(text=farmer_note)] if farmer_note else []
+        new_message = types.Content(
+            role='user',
+            parts=context_parts + [types.Part(text=question)] + [
+                types.Part.from_bytes(data=data, mime_type=mime_type)
+                for data, mime_type in images or []
+            ]
+        )
+
+        print(f"DEBUG: Sending to agent: {question}")
+        events = runner.run_async(
+            user_id=user_id,
+            session_id=session_id,
+            new_message=new_message
+        )
+        try:
+            async for event in events:
+                text = final_response_text(event)
+                # Branch findings are inputs to the synthesis, not answers;
+                # they are kept in case the deadline cuts the synthesis off
+                if fan_out and event.author != FAN_OUT_SYNTHESIZER:
+                    if text:
+                        findings.append(text)
+                    continue
+                if text:
+                    print(f"DEBUG: Final response from {event.author}: "
+                          f"{text[:100]}...")
+                    return AgentAnswer(text, event.author, domains)
+        except Exception as e:
+            print(f"ERROR: Agent execution failed: {str(e)}")
+            raise
+        finally:
+            # Stop whatever the run still had in flight once we are done
+            await events.aclose()
+            await self.session_service.delete_session(
+                app_name=APP_NAME,
+                user_id=user_id,
+                session_id=session_id
+            )
+        return AgentAnswer(None, None, domains)
+
+    def answer(self, question: str, user_id: str,
+               images: Optional[List[Tuple[bytes, str]]] = None,
+               farmer_note: Optional[str] = None) -> AgentAnswer:
+        """Blocking wrapper that runs answer_async on a private event loop"""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            return loop.run_until_complete(
+                self.answer_async(question, user_id, images, farmer_note))
+        finally:
+            # Finalize the runner's nested generators left open by the
+            # early exit before the loop goes away
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
@@ -0,0 +1,57 @@
+"""
+Per-request context shared by the query handler, ADK plugins and tools.
+
+The handler opens a context before running the agents; anything further
+down the call chain (plugins, tool functions) can reach it through
+current_request() without threading extra arguments through ADK.
+"""
+
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+
+_current_request = contextvars.ContextVar('fasal_mitra_request', default=None)
+
+
+class RequestContext:
+    """State for a single farmer query"""
+
+    def __init__(self, query_id: str, farmer_id: str,
+                 native_language: str = 'Kannada', farmer_profile=None,
+                 deadline: Optional[float] = None,
+                 request_class: str = 'interactive'):
+        self.query_id = query_id
+        self.farmer_id = farmer_id
+        self.native_language = native_language
+        # Stored FarmerResponse, when the farmer is registered
+        self.farmer_profile = farmer_profile
+        self.started_at = time.time()
+        # time.monotonic() value by which the answer must be ready
+        self.deadline = deadline
+        # Queueing class for outbound calls (concurrency_limits.py):
+        # 'interactive' for farmers waiting, 'background' for batch work
+        self.request_class = request_class
+        # Filled in by token_accounting when the request is opened
+        self.usage = None
+        # Model tiering (agents/model_router.py): the query's complexity,
+        # tiers added after a failed run and the LLM calls in flight
+        self.complexity = None
+        self.tier_escalation = 0
+        self.model_calls = {}
+
+
+@contextmanager
+def request_scope(context: RequestContext):
+    """Make `context` the current request for the enclosed block"""
+    token = _current_request.set(context)
+    try:
+        yield context
+    finally:
+        _current_request.reset(token)
+
+
+def current_request() -> Optional[RequestContext]:
+    """Return the context of the request being processed, if any"""
+    return _current_request.get()
@@ -0,0 +1,104 @@
+"""
+Compact JSON encoding and compression for API responses.
+
+Bodies are encoded with orjson (falling back to the standard library) as
+UTF-8 rather than ASCII escapes, which halves the size of Kannada and
+Hindi text, then compressed with brotli or gzip according to the
+client's Accept-Encoding header.
+"""
+
+import gzip
+import json
+from typing import Any, Dict, Optional
+
+from flask import Response, request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Below this size compression costs more than it saves
+MIN_COMPRESS_BYTES = 512
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def dumps(payload: Any) -> bytes:
+    """Serialize `payload` to compact UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def accepted_encodings(header: Optional[str]) -> Dict[str, float]:
+    """Parse an Accept-Encoding header into {coding: q}"""
+    encodings = {}
+    for item in (header or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        encodings[coding.strip().lower()] = q
+    return encodings
+
+
+def choose_encoding(header: Optional[str]) -> Optional[str]:
+    """Best compression both sides support: brotli, then gzip"""
+    encodings = accepted_encodings(header)
+    candidates = (['br'] if brotli is not None else []) + ['gzip']
+    best = None
+    for coding in candidates:
+        q = encodings.get(coding, encodings.get('*', 0.0))
+        if q > 0 and (best is None or q > best[1]):
+            best = (coding, q)
+    return best[0] if best else None
+
+
+def compress(body: bytes, coding: Optional[str]) -> bytes:
+    if coding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if coding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+
+def json_response(payload: Any, status: int = 200) -> Response:
+    """Build a compact, content-negotiated JSON response"""
+    body = dumps(payload)
+    coding = None
+    if len(body) >= MIN_COMPRESS_BYTES:
+        coding = choose_encoding(request.headers.get('Accept-Encoding'))
+        body = compress(body, coding)
+    response = Response(body, status=status,
+                        mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    if coding:
+        response.headers['Content-Encoding'] = coding
+    return response
+
+
+def query_response_payload(query_response,
+                           omit_duplicate_voice: bool = False) -> dict:
+    """Dict form of a UserQueryResponse.
+
+    With `omit_duplicate_voice`, voice_response_text is left out when it
+    equals text_response; clients then speak the text response.
+    """
+    exclude = None
+    if omit_duplicate_voice and \
+            query_response.voice_response_text == query_response.text_response:
+        exclude = {'voice_response_text'}
+    return query_response.model_dump(exclude=exclude)
@@ -0,0 +1,293 @@
+"""
+Stored query responses and idempotent query submission.
+
+Mobile clients retry /api/getUserQueryResponse after a timeout. With an
+Idempotency-Key header (or `idempotency_key` field) the first request
+claims the key and runs; retries that arrive while it is still running
+wait for its response, and later retries get the stored response instead
+of a new agent run. Keys are scoped to the farmer and bound to the
+request they were first used with, so reusing one for a different
+question is refused.
+
+Every response is also kept by query_id for GET /api/queries/<query_id>.
+Entries expire after RESPONSE_STORE_TTL_HOURS and the store is capped at
+RESPONSE_STORE_MAX_ENTRIES. Claims live in the same SQLite file, so
+workers sharing it see each other's keys; a claim whose run died is taken
+over after IDEMPOTENCY_LEASE_SECONDS.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from deadlines import REQUEST_TIMEOUT_SECONDS
+from job_queue import dedup_key_for
+
+load_dotenv()
+
+RESPONSE_STORE_ENABLED = os.getenv(
+    'RESPONSE_STORE_ENABLED', 'true').lower() != 'false'
+RESPONSE_STORE_DB_PATH = os.getenv(
+    'RESPONSE_STORE_DB_PATH',
+    os.path.join(os.path.dirname(__file__), 'var', 'responses.sqlite3'))
+RESPONSE_STORE_TTL_HOURS = float(os.getenv('RESPONSE_STORE_TTL_HOURS', 24))
+RESPONSE_STORE_MAX_ENTRIES = int(os.getenv('RESPONSE_STORE_MAX_ENTRIES', 50000))
+# A running claim older than this is assumed dead and can be taken over
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv(
+    'IDEMPOTENCY_LEASE_SECONDS', 2 * REQUEST_TIMEOUT_SECONDS + 30))
+# How often a waiting retry checks for a run finished by another worker
+IDEMPOTENCY_POLL_SECONDS = 0.25
+# Expired entries are pruned every this many stored responses
+PRUNE_EVERY = 100
+
+RUN, RUNNING, DONE = 'run', 'running', 'done'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS query_responses (
+    query_id TEXT PRIMARY KEY,
+    farmer_id TEXT,
+    response TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS query_responses_created
+    ON query_responses (created_at);
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    request_hash TEXT NOT NULL,
+    query_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idempotency_keys_created
+    ON idempotency_keys (created_at);
+"""
+
+
+class IdempotencyConflict(Exception):
+    """The key was first used with a different request"""
+
+
+def request_hash(payload: Dict[str, Any]) -> str:
+    """Fingerprint of a query request, without the fields that only shape
+    the response"""
+    return dedup_key_for({k: v for k, v in payload.items()
+                          if k not in ('idempotency_key',
+                                       'omit_duplicate_voice')})
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class ResponseStore:
+    """SQLite store of query responses and idempotency claims"""
+
+    def __init__(self, path: str = RESPONSE_STORE_DB_PATH,
+                 ttl_hours: float = RESPONSE_STORE_TTL_HOURS,
+                 max_entries: int = RESPONSE_STORE_MAX_ENTRIES):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = timedelta(hours=ttl_hours)
+        self.max_entries = max_entries
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        # Runs of this process, so that waiting retries wake at once
+        self._finished: Dict[str, threading.Event] = {}
+        self._stats = Counter()
+        self._puts = 0
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(_SCHEMA)
+
+    def _fresh(self, created_at: str) -> bool:
+        return _now() - datetime.fromisoformat(created_at) <= self.ttl
+
+    def _response(self, query_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(
+            "SELECT response, created_at FROM query_responses "
+            "WHERE query_id = ?", (query_id,)).fetchone()
+        if row is None or not self._fresh(row['created_at']):
+            return None
+        return json.loads(row['response'])
+
+    def get(self, query_id: str) -> Optional[Dict[str, Any]]:
+        """Stored response of a query, None when unknown or expired"""
+        with self._lock:
+            return self._response(query_id)
+
+    def claim(self, key: str, req_hash: str,
+              query_id: str) -> Tuple[str, str, Optional[Dict[str, Any]]]:
+        """Claim `key` for a run with `query_id`.
+
+        Returns (RUN, query_id, None) when the caller should run the query,
+        (RUNNING, owner_query_id, None) while another request runs it and
+        (DONE, owner_query_id, response) once it has finished. Raises
+        IdempotencyConflict when the key belongs to a different request.
+        """
+        now = _now()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT * FROM idempotency_keys WHERE key = ?",
+                (key,)).fetchone()
+            if row is not None:
+                if row['request_hash'] != req_hash:
+                    self._stats['conflicts'] += 1
+                    raise IdempotencyConflict(
+                        "Idempotency key was already used for a "
+                        "different request")
+                age = now - datetime.fromisoformat(row['created_at'])
+                if row['state'] == DONE:
+                    response = self._response(row['query_id'])
+                    if response is not None:
+                        self._stats['replayed'] += 1
+                        return DONE, row['query_id'], response
+                elif age.total_seconds() < IDEMPOTENCY_LEASE_SECONDS:
+                    return RUNNING, row['query_id'], None
+                else:
+                    self._stats['taken_over'] += 1
+            self._conn.execute(
+                "INSERT OR REPLACE INTO idempotency_keys (key, request_hash, "
+                "query_id, state, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, req_hash, query_id, RUNNING, now.isoformat()))
+            self._finished[key] = threading.Event()
+            self._stats['claimed'] += 1
+        return RUN, query_id, None
+
+    def wait(self, key: str, timeout: float) -> Tuple[str, Optional[Dict]]:
+        """Wait up to `timeout` seconds for the run holding `key`.
+
+        Returns (DONE, response) when it finished, (RUN, None) when its
+        claim was released and (RUNNING, None) on timeout.
+        """
+        with self._lock:
+            self._stats['waited'] += 1
+            finished = self._finished.get(key)
+        deadline = _now() + timedelta(seconds=timeout)
+        while True:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT state, query_id FROM idempotency_keys "
+                    "WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return RUN, None
+                if row['state'] == DONE:
+                    response = self._response(row['query_id'])
+                    if response is None:
+                        return RUN, None
+                    self._stats['joined'] += 1
+                    return DONE, response
+            left = (deadline - _now()).total_seconds()
+            if left <= 0:
+                with self._lock:
+                    self._stats['wait_timeouts'] += 1
+                return RUNNING, None
+            delay = min(left, IDEMPOTENCY_POLL_SECONDS)
+            if finished is not None:
+                finished.wait(delay)
+            else:
+                threading.Event().wait(delay)
+
+    def put(self, query_id: str, farmer_id: Optional[str],
+            response: Dict[str, Any], key: Optional[str] = None,
+            keep_key: bool = True) -> None:
+        """Store a response; with `key`, finish the run holding it. With
+        keep_key=False the key is released so that a retry runs again."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO query_responses (query_id, "
+                "farmer_id, response, created_at) VALUES (?, ?, ?, ?)",
+                (query_id, farmer_id, json.dumps(response, ensure_ascii=False),
+                 _now().isoformat()))
+            self._stats['stored'] += 1
+            if key is not None:
+                if keep_key:
+                    self._conn.execute(
+                        "UPDATE idempotency_keys SET state = ? "
+                        "WHERE key = ? AND query_id = ?",
+                        (DONE, key, query_id))
+                else:
+                    self._conn.execute(
+                        "DELETE FROM idempotency_keys "
+                        "WHERE key = ? AND query_id = ?", (key, query_id))
+            self._puts += 1
+            prune = self._puts % PRUNE_EVERY == 0
+        if key is not None:
+            self._wake(key)
+        if prune:
+            self.prune()
+
+    def release(self, key: str, query_id: str) -> None:
+        """Give up the claim of a run that failed"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM idempotency_keys WHERE key = ? AND query_id = ?",
+                (key, query_id))
+            self._stats['released'] += 1
+        self._wake(key)
+
+    def _wake(self, key: str) -> None:
+        with self._lock:
+            finished = self._finished.pop(key, None)
+        if finished is not None:
+            finished.set()
+
+    def prune(self) -> int:
+        """Drop expired entries and the oldest beyond the size cap"""
+        cutoff = (_now() - self.ttl).isoformat()
+        with self._lock, self._conn:
+            removed = self._conn.execute(
+                "DELETE FROM query_responses WHERE created_at < ?",
+                (cutoff,)).rowcount
+            removed += self._conn.execute(
+                "DELETE FROM query_responses WHERE query_id IN ("
+                "SELECT query_id FROM query_responses "
+                "ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)).rowcount
+            self._conn.execute(
+                "DELETE FROM idempotency_keys WHERE created_at < ?",
+                (cutoff,))
+            self._stats['pruned'] += removed
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._stats)
+            entries = self._conn.execute(
+                "SELECT COUNT(*) FROM query_responses").fetchone()[0]
+            keys = self._conn.execute(
+                "SELECT COUNT(*) FROM idempotency_keys").fetchone()[0]
+        return {
+            "enabled": RESPONSE_STORE_ENABLED,
+            "entries": entries,
+            "idempotency_keys": keys,
+            "ttl_hours": self.ttl.total_seconds() / 3600,
+            **counters,
+        }
+
+
+_store = None
+_init_lock = threading.Lock()
+
+
+def get_response_store() -> Optional[ResponseStore]:
+    """Return the process-wide response store, None when disabled"""
+    global _store
+    if not RESPONSE_STORE_ENABLED:
+        return None
+    with _init_lock:
+        if _store is None:
+            _store = ResponseStore()
+        return _store
+
+
+def get_response_store_stats() -> Dict[str, Any]:
+    store = get_response_store()
+    if store is None:
+        return {"enabled": False}
+    return store.stats()
@@ -0,0 +1,401 @@
+"""
+Farmer segments for shared educational content.
+
+Most farmers share a handful of profiles: what they grow, the climate of
+their region, their language and how experienced they are. A batch pass
+clusters the profiles within each language with k-means over those
+features and stores each farmer's segment:
+
+    python segments.py run            # e.g. nightly from cron
+
+Each segment is named by a descriptor of its centroid
+(language|climate zone|main crops|experience level), so a segment keeps
+its key across runs as long as its farmers stay alike, and content
+banked for it stays valid. Farmers registered since the last run are
+placed in the segment with the nearest centroid.
+"""
+
+import json
+import math
+import os
+import sqlite3
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SEGMENT_DB_PATH = os.getenv(
+    'SEGMENT_DB_PATH',
+    os.path.join(os.path.dirname(__file__), 'var', 'segments.sqlite3'))
+# Farmers per segment the clustering aims for, and the most segments one
+# language is split into
+SEGMENT_TARGET_SIZE = int(os.getenv('SEGMENT_TARGET_SIZE', 500))
+SEGMENT_MAX_PER_LANGUAGE = int(os.getenv('SEGMENT_MAX_PER_LANGUAGE', 64))
+# Most common crops that get their own feature; the rest count as "other"
+SEGMENT_CROP_VOCABULARY = int(os.getenv('SEGMENT_CROP_VOCABULARY', 40))
+# Crops named in a segment's key
+SEGMENT_KEY_CROPS = 2
+
+EXPERIENCE_LEVELS = ('beginner', 'intermediate', 'experienced')
+DEFAULT_EXPERIENCE = 'beginner'
+
+# Coarse agro-climatic zone of each state
+CLIMATE_ZONES = {
+    'rajasthan': 'arid', 'gujarat': 'arid',
+    'punjab': 'gangetic_plains', 'haryana': 'gangetic_plains',
+    'uttar pradesh': 'gangetic_plains', 'bihar': 'gangetic_plains',
+    'delhi': 'gangetic_plains',
+    'west bengal': 'eastern_humid', 'odisha': 'eastern_humid',
+    'jharkhand': 'eastern_humid', 'chhattisgarh': 'eastern_humid',
+    'assam': 'eastern_humid', 'tripura': 'eastern_humid',
+    'meghalaya': 'eastern_humid', 'manipur': 'eastern_humid',
+    'mizoram': 'eastern_humid', 'nagaland': 'eastern_humid',
+    'arunachal pradesh': 'eastern_humid', 'sikkim': 'himalayan',
+    'himachal pradesh': 'himalayan', 'uttarakhand': 'himalayan',
+    'jammu and kashmir': 'himalayan', 'ladakh': 'himalayan',
+    'maharashtra': 'deccan', 'karnataka': 'deccan', 'telangana': 'deccan',
+    'andhra pradesh': 'deccan', 'madhya pradesh': 'central',
+    'kerala': 'humid_coastal', 'goa': 'humid_coastal',
+    'tamil nadu': 'humid_coastal', 'puducherry': 'humid_coastal',
+}
+ZONES = sorted(set(CLIMATE_ZONES.values())) + ['other']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    segment_key TEXT PRIMARY KEY,
+    language TEXT NOT NULL,
+    zone TEXT NOT NULL,
+    crops TEXT NOT NULL,
+    experience_level TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    centroid TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS farmer_segments (
+    farmer_id TEXT PRIMARY KEY,
+    segment_key TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS segment_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def _field(profile: Any, name: str, default=None):
+    if isinstance(profile, dict):
+        return profile.get(name, default)
+    return getattr(profile, name, default)
+
+
+def climate_zone(state: Optional[str]) -> str:
+    return CLIMATE_ZONES.get((state or '').strip().lower(), 'other')
+
+
+def _crops(profile: Any) -> List[str]:
+    return [c.strip().lower() for c in _field(profile, 'crops') or []
+            if c and c.strip()]
+
+
+def _experience(profile: Any) -> str:
+    level = (_field(profile, 'experience_level') or '').strip().lower()
+    return level if level in EXPERIENCE_LEVELS else DEFAULT_EXPERIENCE
+
+
+def _language(profile: Any) -> str:
+    return (_field(profile, 'native_language') or 'Kannada').strip().title()
+
+
+def segment_descriptor(language: str, zone: str, crops: Iterable[str],
+                       experience_level: str) -> Dict[str, Any]:
+    crops = sorted(crops)[:SEGMENT_KEY_CROPS]
+    return {
+        "segment_key": '|'.join(
+            [language.lower(), zone, '+'.join(crops) or 'mixed',
+             experience_level]),
+        "language": language,
+        "zone": zone,
+        "crops": crops,
+        "experience_level": experience_level,
+    }
+
+
+class FeatureSpace:
+    """Maps profiles to vectors: zone one-hot, crop multi-hot over the
+    vocabulary (scaled so a farmer's crops weigh 1 together) and the
+    experience level on 0..1"""
+
+    def __init__(self, crop_vocabulary: List[str]):
+        self.crops = list(crop_vocabulary)
+        self._crop_index = {c: i for i, c in enumerate(self.crops)}
+        self.width = len(ZONES) + len(self.crops) + 1
+
+    def vectors(self, profiles: List[Any]) -> np.ndarray:
+        matrix = np.zeros((len(profiles), self.width))
+        zone_index = {z: i for i, z in enumerate(ZONES)}
+        crop_offset = len(ZONES)
+        for row, profile in enumerate(profiles):
+            matrix[row, zone_index[climate_zone(_field(profile, 'state'))]] = 1
+            columns = [crop_offset + self._crop_index[c]
+                       for c in _crops(profile) if c in self._crop_index]
+            if columns:
+                matrix[row, columns] = 1 / len(columns)
+            matrix[row, -1] = (EXPERIENCE_LEVELS.index(_experience(profile))
+                               / (len(EXPERIENCE_LEVELS) - 1))
+        return matrix
+
+    def describe(self, language: str, centroid: np.ndarray) -> Dict[str, Any]:
+        zone = ZONES[int(np.argmax(centroid[:len(ZONES)]))]
+        weights = centroid[len(ZONES):-1]
+        order = np.argsort(-weights)[:SEGMENT_KEY_CROPS]
+        # A crop names the segment when most of its farmers grow it
+        crops = [self.crops[i] for i in order
+                 if weights[i] * SEGMENT_KEY_CROPS >= 0.5]
+        level = EXPERIENCE_LEVELS[int(round(
+            centroid[-1] * (len(EXPERIENCE_LEVELS) - 1)))]
+        return segment_descriptor(language, zone, crops, level)
+
+
+def _squared_distances(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    return np.maximum(
+        (points * points).sum(1)[:, None] - 2 * points @ centroids.T
+        + (centroids * centroids).sum(1)[None, :], 0)
+
+
+def kmeans(points: np.ndarray, k: int, iterations: int = 25,
+           seed: int = 0) -> np.ndarray:
+    """Cluster labels of `points` (k-means++ seeding, Lloyd iterations)"""
+    n = len(points)
+    k = min(k, n)
+    rng = np.random.default_rng(seed)
+    centroids = np.empty((k, points.shape[1]))
+    centroids[0] = points[rng.integers(n)]
+    closest = _squared_distances(points, centroids[:1])[:, 0]
+    for i in range(1, k):
+        total = closest.sum()
+        pick = rng.choice(n, p=closest / total) if total > 0 else rng.integers(n)
+        centroids[i] = points[pick]
+        closest = np.minimum(
+            closest, _squared_distances(points, centroids[i:i + 1])[:, 0])
+
+    labels = np.zeros(n, dtype=np.int64)
+    for step in range(iterations):
+        new_labels = np.argmin(_squared_distances(points, centroids), axis=1)
+        if step and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, points)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return labels
+
+
+class SegmentStore:
+    """SQLite table of segments and of each farmer's segment"""
+
+    def __init__(self, path: str = SEGMENT_DB_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._centroids = None  # language -> (keys, matrix), loaded lazily
+        self._space = None
+        self._stats = Counter()
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(_SCHEMA)
+
+    def replace_all(self, space: FeatureSpace,
+                    segments: List[Dict[str, Any]],
+                    assignments: Dict[str, str]) -> None:
+        """Swap in a new segmentation in one transaction"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM segments")
+            self._conn.execute("DELETE FROM farmer_segments")
+            self._conn.executemany(
+                "INSERT INTO segments VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(s['segment_key'], s['language'], s['zone'],
+                  json.dumps(s['crops']), s['experience_level'], s['size'],
+                  json.dumps(s['centroid'])) for s in segments])
+            self._conn.executemany(
+                "INSERT INTO farmer_segments VALUES (?, ?)",
+                assignments.items())
+            for key, value in (
+                    ('crop_vocabulary', json.dumps(space.crops)),
+                    ('updated_at', datetime.now(timezone.utc).isoformat())):
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO segment_meta VALUES (?, ?)",
+                    (key, value))
+            self._centroids = None
+
+    def _segment(self, segment_key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(
+            "SELECT segment_key, language, zone, crops, experience_level "
+            "FROM segments WHERE segment_key = ?", (segment_key,)).fetchone()
+        if row is None:
+            return None
+        segment = dict(row)
+        segment['crops'] = json.loads(segment['crops'])
+        return segment
+
+    def _load_centroids(self) -> None:
+        row = self._conn.execute(
+            "SELECT value FROM segment_meta WHERE key = 'crop_vocabulary'"
+        ).fetchone()
+        self._space = FeatureSpace(json.loads(row['value']) if row else [])
+        by_language = {}
+        for row in self._conn.execute(
+                "SELECT segment_key, language, centroid FROM segments"):
+            keys, vectors = by_language.setdefault(row['language'], ([], []))
+            keys.append(row['segment_key'])
+            vectors.append(json.loads(row['centroid']))
+        self._centroids = {language: (keys, np.array(vectors))
+                           for language, (keys, vectors) in by_language.items()}
+
+    def segment_for(self, profile: Any) -> Dict[str, Any]:
+        """Segment of a farmer profile (a FarmerResponse or a dict).
+
+        The segment from the last run is used when the farmer was in it,
+        else the one with the nearest centroid in the farmer's language;
+        without any for the language, one is described from the profile.
+        """
+        farmer_id = _field(profile, 'farmer_id')
+        language = _language(profile)
+        with self._lock:
+            if farmer_id:
+                row = self._conn.execute(
+                    "SELECT segment_key FROM farmer_segments "
+                    "WHERE farmer_id = ?", (farmer_id,)).fetchone()
+                segment = row and self._segment(row['segment_key'])
+                if segment:
+                    self._stats['assigned'] += 1
+                    return segment
+            if self._centroids is None:
+                self._load_centroids()
+            nearest = self._centroids.get(language)
+            if nearest:
+                keys, matrix = nearest
+                vector = self._space.vectors([profile])
+                key = keys[int(np.argmin(_squared_distances(vector, matrix)))]
+                segment = self._segment(key)
+                if segment:
+                    self._stats['nearest'] += 1
+                    return segment
+            self._stats['described'] += 1
+        return segment_descriptor(
+            language, climate_zone(_field(profile, 'state')),
+            _crops(profile), _experience(profile))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._stats)
+            segments, farmers = self._conn.execute(
+                "SELECT (SELECT COUNT(*) FROM segments), "
+                "(SELECT COUNT(*) FROM farmer_segments)").fetchone()
+            row = self._conn.execute(
+                "SELECT value FROM segment_meta WHERE key = 'updated_at'"
+            ).fetchone()
+            largest = [dict(r) for r in self._conn.execute(
+                "SELECT segment_key, size FROM segments "
+                "ORDER BY size DESC LIMIT 10")]
+        return {
+            "segments": segments,
+            "farmers": farmers,
+            "updated_at": row['value'] if row else None,
+            "largest": largest,
+            **counters,
+        }
+
+
+def run_segmentation(farmers: Iterable[Any], store: 'SegmentStore',
+                     target_size: int = SEGMENT_TARGET_SIZE,
+                     max_per_language: int = SEGMENT_MAX_PER_LANGUAGE,
+                     vocabulary_size: int = SEGMENT_CROP_VOCABULARY
+                     ) -> Dict[str, Any]:
+    """Cluster `farmers` and replace the stored segmentation.
+
+    Language partitions the farmers outright (content is written in one);
+    within a language k-means runs with about `target_size` farmers per
+    cluster. Clusters whose centroids describe alike are merged.
+    """
+    by_language = {}
+    crop_counts = Counter()
+    for farmer in farmers:
+        by_language.setdefault(_language(farmer), []).append(farmer)
+        crop_counts.update(set(_crops(farmer)))
+    space = FeatureSpace(
+        [c for c, _ in crop_counts.most_common(vocabulary_size)])
+
+    segments = {}
+    assignments = {}
+    for language, group in by_language.items():
+        points = space.vectors(group)
+        k = max(1, min(max_per_language, math.ceil(len(group) / target_size)))
+        labels = kmeans(points, k)
+        for label in np.unique(labels):
+            members = labels == label
+            centroid = points[members].mean(axis=0)
+            segment = space.describe(language, centroid)
+            key = segment['segment_key']
+            if key in segments:
+                merged = segments[key]
+                total = merged['size'] + int(members.sum())
+                merged['centroid'] = list(
+                    (np.array(merged['centroid']) * merged['size']
+                     + centroid * members.sum()) / total)
+                merged['size'] = total
+            else:
+                segments[key] = {**segment, "size": int(members.sum()),
+                                 "centroid": centroid.tolist()}
+            for index in np.flatnonzero(members):
+                farmer_id = _field(group[index], 'farmer_id')
+                if farmer_id:
+                    assignments[farmer_id] = key
+
+    store.replace_all(space, list(segments.values()), assignments)
+    sizes = [s['size'] for s in segments.values()]
+    return {
+        "farmers": sum(sizes),
+        "languages": len(by_language),
+        "segments": len(segments),
+        "median_size": int(np.median(sizes)) if sizes else 0,
+        "crop_vocabulary": len(space.crops),
+    }
+
+
+_store = None
+_init_lock = threading.Lock()
+
+
+def get_segment_store() -> SegmentStore:
+    """Return the process-wide segment store"""
+    global _store
+    with _init_lock:
+        if _store is None:
+            _store = SegmentStore()
+        return _store
+
+
+def segment_for(profile: Any) -> Dict[str, Any]:
+    return get_segment_store().segment_for(profile)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Cluster farmers into segments")
+    parser.add_argument('command', choices=['run'])
+    parser.add_argument('--target-size', type=int, default=SEGMENT_TARGET_SIZE)
+    args = parser.parse_args()
+
+    from farmer_store import get_farmer_store
+
+    result = run_segmentation(get_farmer_store().iter_farmers(),
+                              get_segment_store(), target_size=args.target_size)
+    print(f"DEBUG: Segmentation finished: {result}")
@@ -0,0 +1,80 @@
+"""
+Place resolution against the bundled gazetteer: places missing from it
+must come back unresolved rather than as a similar name elsewhere.
+
+Run from the backend directory:
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gazetteer import Gazetteer  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def gazetteer():
+    return Gazetteer()
+
+
+@pytest.mark.parametrize('text', ['Mysore', 'Mysuru', 'ಮೈಸೂರು', 'Bangalore',
+                                  'Hubli, Karnataka'])
+def test_exact_names_resolve_without_a_state(gazetteer, text):
+    match = gazetteer.resolve(text)
+    assert match is not None and match.score == 1.0
+    assert match.place.state == 'Karnataka'
+
+
+@pytest.mark.parametrize('text, real_state', [
+    ('Mandi', 'Himachal Pradesh'),
+    ('Kollam', 'Kerala'),
+    ('Beed', 'Maharashtra'),
+])
+def test_unknown_places_stay_unresolved(gazetteer, text, real_state):
+    # Close to Mandya, Kolar and Bidar in Karnataka, but different places
+    assert gazetteer.resolve(text) is None
+    assert gazetteer.resolve(text, real_state) is None
+    assert gazetteer.resolve(text, 'Karnataka') is None
+
+
+def test_misspelling_resolves_within_the_farmers_state(gazetteer):
+    match = gazetteer.resolve('Chikkamagalur', 'Karnataka')
+    assert match is not None and match.place.name == 'Chikkamagaluru'
+
+
+def test_misspelling_needs_a_state(gazetteer):
+    assert gazetteer.resolve('Chikkamagalur') is None
+
+
+def test_misspelling_in_another_state_is_not_substituted(gazetteer):
+    assert gazetteer.resolve('Chikkamagalur', 'Kerala') is None
+
+
+def test_weather_queries_unknown_place_as_given(monkeypatch):
+    weather = pytest.importorskip('agents.weather_agent.agent')
+    urls = []
+
+    class Response:
+        status_code = 200
+
+        def json(self):
+            return {"location": {"name": "Kollam", "region": "Kerala"},
+                    "current": {"temp_c": 30}}
+
+    def fake_get(url, *args, **kwargs):
+        urls.append(url)
+        return Response()
+
+    monkeypatch.setattr(weather.requests, 'get', fake_get)
+    result = weather.get_weather_forecast('Kollam')
+    assert '&q=Kollam&' in urls[0]
+    assert result['state'] == 'Kerala'
+
+
+def test_market_place_of_unknown_location_is_passed_through():
+    vyapari = pytest.importorskip('agents.vyapari_agent.agent')
+    assert vyapari._place('Beed') == {"name": "Beed"}
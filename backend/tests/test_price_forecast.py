@@ -0,0 +1,65 @@
+"""
+Nightly trend computation on short and sparse price histories, as in the
+first weeks after deployment or for markets that rarely report.
+
+Run from the backend directory:
+    python -m pytest tests
+"""
+
+import os
+import sys
+from datetime import date, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+np = pytest.importorskip('numpy')
+pa = pytest.importorskip('pyarrow')
+
+from price_forecast import (  # noqa: E402
+    BACKTEST_DAYS, PriceMatrix, compute_trends, holt_forecast
+)
+
+
+def history(rows):
+    """Arrow price table from (market, days before today, price) rows"""
+    today = date.today()
+    return pa.table({
+        'commodity': ['Tomato'] * len(rows),
+        'market': [market for market, _, _ in rows],
+        'state': ['Karnataka'] * len(rows),
+        'date': pa.array([today - timedelta(days=ago) for _, ago, _ in rows],
+                         pa.date32()),
+        'modal_price': [float(price) for _, _, price in rows],
+    })
+
+
+@pytest.mark.parametrize('days', [1, 10, BACKTEST_DAYS, BACKTEST_DAYS + 1])
+def test_short_history(days):
+    rows = [(market, ago, 1000 + ago) for market in ('A', 'B')
+            for ago in range(days)]
+    trends = compute_trends(PriceMatrix(history(rows)).with_averages())
+    assert len(trends['forecast_7d']) == 4
+    assert np.isfinite(trends['forecast_7d']).all()
+    assert (trends['method'] == 'holt').all()
+    if days <= BACKTEST_DAYS:
+        assert np.isnan(trends['backtest_mape_pct']).all()
+
+
+def test_sparse_history():
+    # A reports every day for a month; B only twice, both inside the
+    # backtest window, so it has no history to test against
+    rows = [('A', ago, 1000 + ago) for ago in range(30)]
+    rows += [('B', 3, 900), ('B', 1, 950)]
+    matrix = PriceMatrix(history(rows))
+    trends = compute_trends(matrix)
+    b = list(matrix.market).index('B')
+    assert trends['last_price'][b] == 950
+    assert np.isfinite(trends['forecast_30d'][b])
+    assert np.isnan(trends['backtest_mape_pct'][b])
+
+
+def test_holt_without_days():
+    forecasts = holt_forecast(np.empty((3, 0)), (7, 14, 30))
+    assert forecasts.shape == (3, 3) and np.isnan(forecasts).all()
@@ -0,0 +1,228 @@
+"""
+Token and prompt-size accounting for Mitra agent runs.
+
+For every request this records the input/output tokens of each LlmAgent
+turn, the serialized size of every tool result that goes back into the
+prompt and the share of the prompt taken by system instructions and tool
+schemas. Totals are aggregated into process-wide metrics and the last
+few requests are kept as debug dumps keyed by query_id.
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from google.adk.plugins.base_plugin import BasePlugin
+
+from request_context import RequestContext, current_request
+
+
+# Rough ratio used where the API gives no exact count
+CHARS_PER_TOKEN = 4
+MAX_REQUEST_DUMPS = int(os.getenv('TOKEN_DUMP_HISTORY', 200))
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of `text` from its length"""
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def serialized_size(value: Any) -> int:
+    """Size in bytes of `value` as it is serialized into the prompt"""
+    return len(json.dumps(value, ensure_ascii=False, default=str)
+               .encode('utf-8'))
+
+
+def _instruction_text(system_instruction) -> str:
+    if not system_instruction:
+        return ''
+    if isinstance(system_instruction, str):
+        return system_instruction
+    parts = getattr(system_instruction, 'parts', None) or []
+    return ''.join(part.text or '' for part in parts)
+
+
+def _tool_schema_text(tools) -> str:
+    return ''.join(
+        tool.model_dump_json(exclude_none=True) for tool in tools or [])
+
+
+class RequestUsage:
+    """Token usage collected while answering a single query"""
+
+    def __init__(self, query_id: str):
+        self.query_id = query_id
+        self.turns = []
+        self.tool_results = []
+        self._open_turns = {}
+        self._seen_responses = set()
+
+    def start_turn(self, agent_name: str, llm_request) -> None:
+        config = llm_request.config
+        system_text = _instruction_text(
+            config.system_instruction if config else None)
+        schema_text = _tool_schema_text(config.tools if config else None)
+        self._open_turns[agent_name] = {
+            "agent": agent_name,
+            "model": llm_request.model,
+            "system_instruction_tokens": estimate_tokens(system_text),
+            "tool_schema_tokens": estimate_tokens(schema_text),
+            "input_tokens": None,
+            "output_tokens": None,
+        }
+        self._record_tool_results(agent_name, llm_request.contents or [])
+
+    def finish_turn(self, agent_name: str, llm_response) -> None:
+        turn = self._open_turns.pop(agent_name, None)
+        if turn is None:
+            return
+        usage = llm_response.usage_metadata
+        if usage:
+            turn["input_tokens"] = usage.prompt_token_count or 0
+            turn["output_tokens"] = usage.candidates_token_count or 0
+        self.turns.append(turn)
+
+    def _record_tool_results(self, agent_name: str, contents) -> None:
+        """Size every function response entering the prompt for the first
+        time; later turns resend it but it is only counted once."""
+        for content in contents:
+            for index, part in enumerate(content.parts or []):
+                response = part.function_response
+                if not response:
+                    continue
+                key = response.id or (response.name, id(content), index)
+                if key in self._seen_responses:
+                    continue
+                self._seen_responses.add(key)
+                size = serialized_size(response.response)
+                self.tool_results.append({
+                    "tool": response.name,
+                    "agent": agent_name,
+                    "bytes": size,
+                    "estimated_tokens":
+                        (size + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN,
+                })
+
+    def totals(self) -> Dict[str, int]:
+        input_tokens = sum(t["input_tokens"] or 0 for t in self.turns)
+        system_tokens = sum(
+            t["system_instruction_tokens"] for t in self.turns)
+        return {
+            "llm_turns": len(self.turns),
+            "input_tokens": input_tokens,
+            "output_tokens": sum(t["output_tokens"] or 0 for t in self.turns),
+            "system_instruction_tokens": system_tokens,
+            "tool_schema_tokens": sum(
+                t["tool_schema_tokens"] for t in self.turns),
+            "tool_result_bytes": sum(r["bytes"] for r in self.tool_results),
+            "system_instruction_share": round(
+                system_tokens / input_tokens, 3) if input_tokens else None,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "query_id": self.query_id,
+            "totals": self.totals(),
+            "turns": self.turns,
+            "tool_results": self.tool_results,
+        }
+
+
+class TokenMetrics:
+    """Process-wide token counters per agent and per tool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.agents = {}
+        self.tools = {}
+
+    def add(self, usage: RequestUsage) -> None:
+        with self._lock:
+            self.requests += 1
+            for turn in usage.turns:
+                stats = self.agents.setdefault(turn["agent"], {
+                    "turns": 0, "input_tokens": 0, "output_tokens": 0,
+                    "system_instruction_tokens": 0, "tool_schema_tokens": 0,
+                })
+                stats["turns"] += 1
+                stats["input_tokens"] += turn["input_tokens"] or 0
+                stats["output_tokens"] += turn["output_tokens"] or 0
+                stats["system_instruction_tokens"] += \
+                    turn["system_instruction_tokens"]
+                stats["tool_schema_tokens"] += turn["tool_schema_tokens"]
+            for result in usage.tool_results:
+                stats = self.tools.setdefault(result["tool"], {
+                    "calls": 0, "bytes": 0, "estimated_tokens": 0,
+                })
+                stats["calls"] += 1
+                stats["bytes"] += result["bytes"]
+                stats["estimated_tokens"] += result["estimated_tokens"]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "agents": {k: dict(v) for k, v in self.agents.items()},
+                "tools": {k: dict(v) for k, v in self.tools.items()},
+            }
+
+
+_metrics = TokenMetrics()
+_dumps = OrderedDict()
+_dumps_lock = threading.Lock()
+
+
+def open_usage(context: RequestContext) -> RequestUsage:
+    """Attach a fresh usage record to the request context"""
+    context.usage = RequestUsage(context.query_id)
+    return context.usage
+
+
+def close_usage(context: RequestContext) -> Optional[Dict[str, Any]]:
+    """Fold the request's usage into the metrics and keep its debug dump"""
+    usage = context.usage
+    if usage is None:
+        return None
+    _metrics.add(usage)
+    dump = usage.to_dict()
+    with _dumps_lock:
+        _dumps[usage.query_id] = dump
+        while len(_dumps) > MAX_REQUEST_DUMPS:
+            _dumps.popitem(last=False)
+    return dump
+
+
+def get_request_dump(query_id: str) -> Optional[Dict[str, Any]]:
+    """Return the per-request debug dump for `query_id`, if still kept"""
+    with _dumps_lock:
+        return _dumps.get(query_id)
+
+
+def get_token_metrics() -> Dict[str, Any]:
+    """Return the aggregated per-agent and per-tool counters"""
+    return _metrics.snapshot()
+
+
+class TokenAccountingPlugin(BasePlugin):
+    """ADK plugin recording prompt composition and token usage per turn"""
+
+    def __init__(self):
+        super().__init__(name="token_accounting")
+
+    async def before_model_callback(self, *, callback_context, llm_request):
+        context = current_request()
+        if context and context.usage:
+            context.usage.start_turn(callback_context.agent_name, llm_request)
+        return None
+
+    async def after_model_callback(self, *, callback_context, llm_response):
+        context = current_request()
+        if context and context.usage:
+            context.usage.finish_turn(
+                callback_context.agent_name, llm_response)
+        return None
@@ -0,0 +1,244 @@
+"""
+Projection of tool results down to what the LLM asked for.
+
+Tool results are resent with every later turn of the conversation, so
+anything in them the model did not need costs input tokens and latency
+more than once. Before a result enters the prompt this stage:
+
+- drops top-level fields that only echo the call's arguments and fields
+  of list items that repeat the value at the top level,
+- runs the projectors registered for the tool, which keep only the
+  requested entities (e.g. the asked-for crop's price) and drop fields
+  such as icon URLs,
+- enforces a byte budget per tool by shortening the largest lists and
+  strings, noting what was left out.
+
+Error results pass through untouched. Savings per tool are reported by
+get_projection_stats.
+"""
+
+import copy
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from token_accounting import CHARS_PER_TOKEN, serialized_size
+
+load_dotenv()
+
+TOOL_PROJECTION_ENABLED = os.getenv(
+    'TOOL_PROJECTION_ENABLED', 'true').lower() != 'false'
+# Serialized bytes a tool result may take in the prompt unless its tool
+# registers its own budget
+TOOL_RESULT_MAX_BYTES = int(os.getenv('TOOL_RESULT_MAX_BYTES', 3000))
+# Shortening steps tried before a result is sent over budget
+MAX_FIT_STEPS = 64
+# Strings shorter than this are never cut
+MIN_CUT_LENGTH = 80
+
+# Fields that describe the result rather than carry content; never dropped
+_KEPT_FIELDS = frozenset({'status', 'message', 'error'})
+
+_projectors: Dict[str, List[Callable[[dict, dict], dict]]] = {}
+_budgets: Dict[str, int] = {}
+
+
+def register_projection(tool_name: str,
+                        projector: Optional[Callable[[dict, dict], dict]] = None,
+                        max_bytes: Optional[int] = None) -> None:
+    """Register how results of `tool_name` are projected.
+
+    The projector is called as projector(args, result) with a copy of the
+    result and returns the projected result. Tools of the same name in
+    different agents may each register one, so projectors should leave
+    results of a shape they do not know alone.
+    """
+    if projector is not None:
+        _projectors.setdefault(tool_name, []).append(projector)
+    if max_bytes is not None:
+        _budgets[tool_name] = min(max_bytes, _budgets.get(tool_name, max_bytes))
+
+
+def _entity_key(name: Any) -> str:
+    key = str(name).strip().lower()
+    for suffix in ('oes', 'es', 's'):
+        if key.endswith(suffix) and len(key) > len(suffix) + 2:
+            return key[:-len(suffix)] + ('o' if suffix == 'oes' else '')
+    return key
+
+
+def matches(name: Any, wanted: Any) -> bool:
+    """Whether entity `name` is the one asked for, ignoring case and
+    plurals ('Tomatoes' matches 'tomato'). Whole names only: 'pea' is not
+    'peanut'."""
+    name, wanted = _entity_key(name), _entity_key(wanted)
+    return bool(wanted) and name == wanted
+
+
+def wants_all(wanted: Any) -> bool:
+    return not wanted or str(wanted).strip().lower() in ('all', 'any', '*')
+
+
+def select_entities(mapping: Dict[str, Any], wanted: Any) -> Dict[str, Any]:
+    """Entries of `mapping` whose key matches `wanted`; all when nothing
+    specific was asked for, none when `wanted` is not among them"""
+    if wants_all(wanted):
+        return mapping
+    return {k: v for k, v in mapping.items() if matches(k, wanted)}
+
+
+def _drop_echoed_args(result: dict, args: dict) -> dict:
+    for key, value in args.items():
+        if key in result and key not in _KEPT_FIELDS \
+                and isinstance(value, (str, int, float)) \
+                and str(result[key]).strip().lower() == str(value).strip().lower():
+            del result[key]
+    return result
+
+
+def _drop_repeated_fields(result: dict) -> dict:
+    """Fields of list items that only repeat a top-level value"""
+    for value in result.values():
+        if not isinstance(value, list):
+            continue
+        for item in value:
+            if isinstance(item, dict):
+                for key in [k for k, v in item.items()
+                            if k in result and result[k] == v]:
+                    del item[key]
+    return result
+
+
+def _drop_nulls(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _drop_nulls(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_drop_nulls(v) for v in value]
+    return value
+
+
+_LEFT_OUT = "... {} more left out to fit the size limit"
+
+
+def _list_items(value: list) -> Tuple[list, int]:
+    """Items of a list shortened before, and how many were left out"""
+    if value and isinstance(value[-1], str) and value[-1].startswith('... ') \
+            and value[-1].endswith(_LEFT_OUT.split('{}')[1]):
+        return value[:-1], int(value[-1].split()[1])
+    return value, 0
+
+
+def _largest_part(value: Any, container=None, key=None,
+                  best: Optional[Tuple[int, Any, Any]] = None):
+    """(size, container, key) of the largest list or long string that can
+    still be shortened"""
+    if isinstance(value, dict):
+        for k, v in value.items():
+            best = _largest_part(v, value, k, best)
+    elif isinstance(value, list):
+        if len(_list_items(value)[0]) > 1 and container is not None:
+            size = serialized_size(value)
+            if best is None or size > best[0]:
+                best = (size, container, key)
+        for i, v in enumerate(value):
+            best = _largest_part(v, value, i, best)
+    elif isinstance(value, str) and len(value) >= MIN_CUT_LENGTH \
+            and container is not None:
+        size = serialized_size(value)
+        if best is None or size > best[0]:
+            best = (size, container, key)
+    return best
+
+
+def fit_budget(result: dict, max_bytes: int) -> Tuple[dict, bool]:
+    """Shorten the largest lists and strings of `result` (in place) until
+    it serializes to at most `max_bytes`. Returns (result, shortened)."""
+    shortened = False
+    for _ in range(MAX_FIT_STEPS):
+        if serialized_size(result) <= max_bytes:
+            break
+        largest = _largest_part(result)
+        if largest is None:
+            break
+        _, container, key = largest
+        value = container[key]
+        if isinstance(value, list):
+            items, omitted = _list_items(value)
+            keep = len(items) // 2
+            container[key] = items[:keep] + [
+                _LEFT_OUT.format(omitted + len(items) - keep)]
+        else:
+            container[key] = value[:len(value) // 2].rstrip() + '…'
+        shortened = True
+    return result, shortened
+
+
+class ProjectionStats:
+    """Bytes in and out of the projection per tool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tools = {}
+
+    def add(self, tool_name: str, bytes_in: int, bytes_out: int,
+            shortened: bool) -> None:
+        with self._lock:
+            stats = self.tools.setdefault(tool_name, {
+                "calls": 0, "bytes_in": 0, "bytes_out": 0, "shortened": 0})
+            stats["calls"] += 1
+            stats["bytes_in"] += bytes_in
+            stats["bytes_out"] += bytes_out
+            stats["shortened"] += int(shortened)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            tools = {name: dict(stats) for name, stats in self.tools.items()}
+        for stats in tools.values():
+            saved = stats["bytes_in"] - stats["bytes_out"]
+            stats["estimated_tokens_saved"] = saved // CHARS_PER_TOKEN
+            stats["reduction_pct"] = round(
+                100 * saved / stats["bytes_in"], 1) if stats["bytes_in"] else 0.0
+        bytes_in = sum(s["bytes_in"] for s in tools.values())
+        bytes_out = sum(s["bytes_out"] for s in tools.values())
+        return {
+            "enabled": TOOL_PROJECTION_ENABLED,
+            "estimated_tokens_saved": (bytes_in - bytes_out) // CHARS_PER_TOKEN,
+            "reduction_pct": round(100 * (bytes_in - bytes_out) / bytes_in, 1)
+            if bytes_in else 0.0,
+            "tools": tools,
+        }
+
+
+_stats = ProjectionStats()
+
+
+def project(tool_name: str, args: dict, result: dict) -> Tuple[dict, bool]:
+    """Projected copy of `result` and whether it had to be shortened"""
+    projected = _drop_nulls(copy.deepcopy(result))
+    projected = _drop_repeated_fields(projected)
+    projected = _drop_echoed_args(projected, args or {})
+    for projector in _projectors.get(tool_name, ()):
+        projected = projector(args or {}, projected)
+    return fit_budget(projected,
+                      _budgets.get(tool_name, TOOL_RESULT_MAX_BYTES))
+
+
+def project_tool_result(tool_name: str, args: dict, result: Any,
+                        context) -> Any:
+    """Tool-result stage: keep what the call asked for, within budget"""
+    if not TOOL_PROJECTION_ENABLED or not isinstance(result, dict) \
+            or result.get("status") == "error":
+        return result
+    bytes_in = serialized_size(result)
+    projected, shortened = project(tool_name, args, result)
+    bytes_out = serialized_size(projected)
+    if bytes_out >= bytes_in:
+        projected, bytes_out = result, bytes_in
+    _stats.add(tool_name, bytes_in, bytes_out, shortened)
+    return projected
+
+
+def get_projection_stats() -> Dict[str, Any]:
+    return _stats.snapshot()
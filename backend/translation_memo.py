@@ -0,0 +1,246 @@
+"""
+Translation memo for tool outputs.
+
+Tool functions return English content (scheme descriptions, crop calendar
+stages, best-practice bullets) that the LLM would otherwise translate into
+the farmer's native language on every request. The memo stores translated
+snippets keyed by content hash and target language in a SQLite table
+(shared by all worker processes) with an in-process LRU in front of it. Tool results are
+pre-localized from the memo before they reach the LLM; snippets not yet
+in the memo are translated in the background for the next request.
+"""
+
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MEMO_PATH = os.getenv(
+    'TRANSLATION_MEMO_PATH',
+    os.path.join(os.path.dirname(__file__), 'var',
+                 'translation_memo.sqlite3'))
+LRU_SIZE = int(os.getenv('TRANSLATION_MEMO_LRU_SIZE', 5000))
+TRANSLATION_BATCH_SIZE = int(os.getenv('TRANSLATION_BATCH_SIZE', 20))
+GEMINI_MODEL = os.getenv("GEMINI_MODEL_NAME", "gemini-2.0-flash")
+
+# Languages tool content is already written in
+SOURCE_LANGUAGES = {'english', 'en'}
+# Keys whose values are identifiers or echoes of tool arguments
+SKIP_KEYS = {
+    'status', 'crop_type', 'commodity', 'location', 'market_type',
+    'language', 'farmer_level', 'content_type', 'date', 'error', 'answer',
+    'condition_icon', 'last_updated'
+}
+MIN_PROSE_LENGTH = 12
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS translations (
+    memo_key TEXT PRIMARY KEY,
+    translated TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def memo_key(text: str, language: str) -> str:
+    """Key of `text` translated into `language`"""
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+    return f"{language.lower()}:{digest}"
+
+
+def is_translatable(text: str) -> bool:
+    """Whether `text` looks like English prose worth translating"""
+    if len(text) < MIN_PROSE_LENGTH or ' ' not in text:
+        return False
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars / len(text) > 0.9 and any(ch.isalpha() for ch in text)
+
+
+class TranslationMemo:
+    """LRU-fronted SQLite memo of translated snippets"""
+
+    def __init__(self, path: str = MEMO_PATH, lru_size: int = LRU_SIZE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lru = OrderedDict()
+        self._lru_size = lru_size
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(_SCHEMA)
+
+    def get(self, text: str, language: str) -> Optional[str]:
+        key = memo_key(text, language)
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return self._lru[key]
+            row = self._conn.execute(
+                "SELECT translated FROM translations WHERE memo_key = ?",
+                (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            translated = row[0]
+            self._remember(key, translated)
+            self.hits += 1
+            return translated
+
+    def put(self, text: str, language: str, translated: str) -> None:
+        key = memo_key(text, language)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translations (memo_key, translated) "
+                "VALUES (?, ?)", (key, translated))
+            self._remember(key, translated)
+
+    def _remember(self, key: str, translated: str) -> None:
+        self._lru[key] = translated
+        self._lru.move_to_end(key)
+        while len(self._lru) > self._lru_size:
+            self._lru.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "lru_entries": len(self._lru),
+            }
+
+
+class BackgroundTranslator:
+    """Translates memo misses off the request path, in batches"""
+
+    def __init__(self, memo: TranslationMemo):
+        self._memo = memo
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, text: str, language: str) -> None:
+        key = memo_key(text, language)
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='translation-memo', daemon=True)
+                self._thread.start()
+        self._queue.put((text, language))
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < TRANSLATION_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            by_language = {}
+            for text, language in batch:
+                by_language.setdefault(language, []).append(text)
+            for language, texts in by_language.items():
+                try:
+                    for text, translated in zip(
+                            texts, translate_batch(texts, language)):
+                        self._memo.put(text, language, translated)
+                except Exception as e:
+                    print(f"ERROR: Translation batch failed: {e}")
+                finally:
+                    with self._lock:
+                        for text in texts:
+                            self._pending.discard(memo_key(text, language))
+
+
+def translate_batch(texts: List[str], language: str) -> List[str]:
+    """Translate `texts` into `language` with one Gemini call"""
+    import google.generativeai as genai
+
+    model = genai.GenerativeModel(GEMINI_MODEL)
+    prompt = (
+        f"Translate each string in this JSON array into simple {language} "
+        "for a farmer. Keep numbers, units, currency symbols and proper "
+        "nouns unchanged. Reply with only a JSON array of the same length, "
+        "in the same order."
+    )
+    response = model.generate_content(
+        [prompt, json.dumps(texts, ensure_ascii=False)],
+        generation_config={"response_mime_type": "application/json"}
+    )
+    translated = json.loads(response.text)
+    if not isinstance(translated, list) or len(translated) != len(texts):
+        raise ValueError("translation count does not match the input")
+    return [str(item) for item in translated]
+
+
+_memo = None
+_translator = None
+_init_lock = threading.Lock()
+
+
+def get_memo() -> TranslationMemo:
+    """Return the process-wide memo, opening its file on first use"""
+    global _memo, _translator
+    with _init_lock:
+        if _memo is None:
+            _memo = TranslationMemo()
+            _translator = BackgroundTranslator(_memo)
+        return _memo
+
+
+def localize(value: Any, language: str) -> Tuple[Any, int]:
+    """Replace translatable strings in `value` with memoized translations.
+
+    Returns the localized copy and the number of strings that were
+    missing from the memo; those are queued for background translation.
+    """
+    if not language or language.lower() in SOURCE_LANGUAGES:
+        return value, 0
+    memo = get_memo()
+    misses = []
+
+    def walk(node, key=None):
+        if isinstance(node, dict):
+            return {k: walk(v, k) for k, v in node.items()}
+        if isinstance(node, list):
+            return [walk(item, key) for item in node]
+        if isinstance(node, str) and key not in SKIP_KEYS \
+                and is_translatable(node):
+            translated = memo.get(node, language)
+            if translated is None:
+                misses.append(node)
+                return node
+            return translated
+        return node
+
+    localized = walk(value)
+    for text in misses:
+        _translator.submit(text, language)
+    return localized, len(misses)
+
+
+def localize_tool_result(tool_name: str, args: dict, result: Any,
+                         context) -> Any:
+    """Tool-result stage: pre-localize into the farmer's language"""
+    if context is None or not isinstance(result, dict):
+        return result
+    localized, _ = localize(result, context.native_language)
+    return localized
+
+
+def get_memo_stats() -> dict:
+    """Hit/miss counters of the translation memo"""
+    return get_memo().stats()